@@ -0,0 +1,97 @@
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+from utils.logger import setup_logging
+
+logger = setup_logging('COLD-START-BENCHMARK')
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Heavy dependencies whose import is reported per scenario
+HEAVY_MODULES = ('selenium', 'pandas', 'boto3', 'snowflake.connector', 'aiohttp', 'bs4')
+
+# What a command of the CLI imports before its first request
+SCENARIOS = {
+    'cli': 'import main',
+    'spinneys.scrape': 'import main, spinneys.spinneys_mt',
+    'choithrams.scrape': 'import main, choithrams.choithrams_mt',
+    'carrefour.scrape': 'import main, carrefour.carrefour_sel_mp_json',
+    'carrefour.scrape.hybrid': 'import main, carrefour.carrefour_hybrid',
+    'load': 'import main, db.sf_json_load',
+    'upload': 'import main, utils.spaces_upload',
+}
+
+PROBE = '''
+import sys, time, json
+start = time.perf_counter()
+{code}
+seconds = time.perf_counter() - start
+print(json.dumps({{'seconds': seconds, 'loaded': [name for name in {heavy!r} if name in sys.modules]}}))
+'''
+
+
+def measure(code, repeat=5):
+    """
+    Function to run `code` in `repeat` fresh interpreters and return the
+    median import time, the median process wall time and the heavy modules loaded
+    """
+    import_seconds, wall_seconds, loaded = [], [], []
+    probe = PROBE.format(code=code, heavy=HEAVY_MODULES)
+    for _ in range(repeat):
+        start = time.perf_counter()
+        completed = subprocess.run(
+            [sys.executable, '-c', probe], cwd=REPO_ROOT, capture_output=True, text=True,
+            env={**os.environ, 'PYTHONPATH': REPO_ROOT}
+            )
+        wall_seconds.append(time.perf_counter() - start)
+        if completed.returncode != 0:
+            raise RuntimeError(completed.stderr.strip().splitlines()[-1] if completed.stderr else 'probe failed')
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        import_seconds.append(result['seconds'])
+        loaded = result['loaded']
+    return {
+        'import_ms': round(statistics.median(import_seconds) * 1000, 1),
+        'process_ms': round(statistics.median(wall_seconds) * 1000, 1),
+        'loaded': loaded,
+    }
+
+
+def run_suite(scenarios=SCENARIOS, repeat=5):
+    results = {}
+    for name, code in scenarios.items():
+        try:
+            results[name] = measure(code, repeat)
+        except RuntimeError as e:
+            # e.g. a backend whose dependencies are not installed here
+            logger.warning(f"{name}: {e}")
+            results[name] = {'error': str(e)}
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the cold start of the CLI and of each backend")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--only', nargs='*', help="run only the scenarios starting with these names")
+    parser.add_argument('--output', default=None, help="write the results as json to this file")
+    args = parser.parse_args()
+
+    scenarios = SCENARIOS
+    if args.only:
+        scenarios = {name: code for name, code in SCENARIOS.items() if name.startswith(tuple(args.only))}
+    results = run_suite(scenarios, args.repeat)
+
+    print(f"{'scenario':<26}{'import ms':>12}{'process ms':>12}  heavy modules loaded")
+    for name, result in results.items():
+        if 'error' in result:
+            print(f"{name:<26}{'-':>12}{'-':>12}  {result['error']}")
+            continue
+        print(f"{name:<26}{result['import_ms']:>12}{result['process_ms']:>12}  {', '.join(result['loaded']) or '-'}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
@@ -0,0 +1,103 @@
+import os
+import gzip
+import json
+import hashlib
+import threading
+from urllib.parse import urlsplit, parse_qsl, urlencode
+
+INDEX_FILE = 'index.json'
+
+# Response headers kept with a recorded body
+KEPT_HEADERS = ('Content-Type', 'ETag', 'Last-Modified')
+
+
+def request_key(path, query=''):
+    """
+    Function to build the fixture key of a request, query parameters are
+    sorted so the key does not depend on their order
+    """
+    return f"{path}?{urlencode(sorted(parse_qsl(query, keep_blank_values=True)))}"
+
+
+class FixtureStore:
+    """
+    Recorded responses, one folder per host holding gzip compressed bodies
+    and an index.json of request key -> status, headers and body file.
+
+    A request that was not recorded is answered with one of the responses
+    recorded for the same path, or else for a sibling path (picked from a
+    hash of the request), so a few recorded catalogue pages or categories
+    can stand in for the whole catalogue.
+    """
+    def __init__(self, root):
+        self.root = root
+        self._indexes = {}
+        self._bodies = {}
+        self._lock = threading.Lock()
+
+    def _index_path(self, host):
+        return os.path.join(self.root, host, INDEX_FILE)
+
+    def index(self, host):
+        with self._lock:
+            if host not in self._indexes:
+                path = self._index_path(host)
+                if os.path.exists(path):
+                    with open(path, encoding='utf-8') as f:
+                        self._indexes[host] = json.load(f)
+                else:
+                    self._indexes[host] = {}
+            return self._indexes[host]
+
+    def hosts(self):
+        if not os.path.isdir(self.root):
+            return []
+        return [name for name in os.listdir(self.root) if os.path.exists(self._index_path(name))]
+
+    def save(self, url, response):
+        """Record a requests response under the url it was fetched from."""
+        parts = urlsplit(url)
+        key = request_key(parts.path, parts.query)
+        file_name = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16] + '.gz'
+        os.makedirs(os.path.join(self.root, parts.netloc), exist_ok=True)
+        with gzip.open(os.path.join(self.root, parts.netloc, file_name), 'wb') as f:
+            f.write(response.content)
+
+        index = self.index(parts.netloc)
+        with self._lock:
+            index[key] = {
+                'status': response.status_code,
+                'headers': {name: response.headers[name] for name in KEPT_HEADERS if name in response.headers},
+                'file': file_name,
+            }
+            with open(self._index_path(parts.netloc), 'w', encoding='utf-8') as f:
+                json.dump(index, f, indent=2, sort_keys=True)
+        return key
+
+    def _body(self, host, file_name):
+        cache_key = (host, file_name)
+        with self._lock:
+            if cache_key not in self._bodies:
+                with gzip.open(os.path.join(self.root, host, file_name), 'rb') as f:
+                    self._bodies[cache_key] = f.read()
+            return self._bodies[cache_key]
+
+    def lookup(self, host, path, query=''):
+        """
+        Return (status, headers, body) of the recorded response for the
+        request, or None when nothing was recorded for that path
+        """
+        index = self.index(host)
+        key = request_key(path, query)
+        entry = index.get(key)
+        if entry is None:
+            candidates = sorted(k for k in index if k.split('?', 1)[0] == path)
+            if not candidates:
+                # e.g. an unrecorded Carrefour category under /api/v8/categories/
+                parent = path.rstrip('/').rsplit('/', 1)[0]
+                candidates = sorted(k for k in index if k.split('?', 1)[0].rstrip('/').rsplit('/', 1)[0] == parent)
+            if not candidates:
+                return None
+            digest = int(hashlib.md5(key.encode('utf-8')).hexdigest(), 16)
+            entry = index[candidates[digest % len(candidates)]]
+        return entry['status'], entry['headers'], self._body(host, entry['file'])
@@ -0,0 +1,202 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+
+from utils.logger import setup_logging
+
+logger = setup_logging('PARSER-BENCHMARK')
+
+PAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pages')
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'parser_baseline.json')
+
+
+def read_page(name, pages_dir=PAGES_DIR):
+    with open(os.path.join(pages_dir, name), encoding='utf-8') as f:
+        return f.read()
+
+
+class ReplayDriver:
+    """
+    Stand-in for the Chrome driver of CarrefourCatExtractor, answering
+    Network.getResponseBody with a saved API page and handing out a recorded
+    performance log once, like Chrome does
+    """
+    def __init__(self, body, performance_log=()):
+        self.body = body
+        self.performance_log = list(performance_log)
+
+    def execute_cdp_cmd(self, cmd, params):
+        return {'body': self.body, 'base64Encoded': False}
+
+    def get_log(self, log_type):
+        logs, self.performance_log = self.performance_log, []
+        return logs
+
+
+def build_cases(pages_dir=PAGES_DIR):
+    """
+    Function to return the benchmark cases as name -> callable processing
+    one saved page, imported lazily so the suite only needs the parsers
+    """
+    from bs4 import BeautifulSoup
+    from spinneys import spinneys_mt
+    from choithrams import choithrams_mt
+    from carrefour import HASH_FIELDS
+    from carrefour.carrefour_sel_mp_json import CarrefourCatExtractor
+    from carrefour.network_capture import NetworkCapture
+    from utils.stage_writer import JsonlStageWriter
+
+    spinneys_html = read_page('spinneys_page.html', pages_dir)
+    choithrams_html = read_page('choithrams_page.html', pages_dir)
+    carrefour_html = read_page('carrefour_category.html', pages_dir)
+    api_page = read_page('carrefour_api_page.json', pages_dir)
+    performance_log = json.loads(read_page('carrefour_performance_log.json', pages_dir))
+
+    spinneys_soup = BeautifulSoup(spinneys_html, 'html.parser')
+    spinneys_grid = spinneys_soup.find('div', {'class': 'arc-grid'}).find_all('div', {'class': 'js-product-wrapper product-bx'})
+    spinneys_script = next(script.text for script in spinneys_soup.find_all('script') if spinneys_mt.check_script(script))
+    choithrams_soup = BeautifulSoup(choithrams_html, 'html.parser')
+    choithrams_script = next(script.text for script in choithrams_soup.find_all('script') if choithrams_mt.check_script(script))
+
+    extractor = CarrefourCatExtractor('F21630500', tempfile.gettempdir(), driver=ReplayDriver(api_page))
+    products = json.loads(api_page)['products']
+    stage_path = tempfile.mkdtemp(prefix='bench_stage_')
+
+    def capture_responses():
+        # The recorded log holds two search API responses among the page assets
+        capture = NetworkCapture(ReplayDriver(api_page, performance_log), extractor.search_url)
+        return [capture.wait_for_response(timeout=0) for _ in range(2)]
+
+    def stage_page():
+        with JsonlStageWriter(stage_path, 'bench', hash_fields=HASH_FIELDS) as writer:
+            writer.write(products)
+        for file_path in writer.files:
+            os.remove(file_path)
+
+    return {
+        'spinneys.extract_info_from_grid': lambda: [spinneys_mt.extract_info_from_grid(product) for product in spinneys_grid],
+        'spinneys.extract_impressions': lambda: spinneys_mt.extract_impressions(spinneys_script, 1),
+        'spinneys.parse_page': lambda: spinneys_mt.parse_page(spinneys_html, 1),
+        'choithrams.extract_items': lambda: choithrams_mt.extract_items(choithrams_script, 1),
+        'choithrams.parse_page': lambda: choithrams_mt.parse_page(choithrams_html, 1),
+        'carrefour.first_load': lambda: extractor.first_load(carrefour_html),
+        'carrefour.network_capture': capture_responses,
+        'stage_writer.write': stage_page,
+    }
+
+
+def measure(func, min_seconds=0.5, repeat=5):
+    """
+    Function to time `func` and return its best ops/sec over `repeat`
+    rounds of at least `min_seconds` / `repeat` each
+    """
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_seconds / repeat:
+            break
+        loops *= 2
+    best = elapsed / loops
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        best = min(best, (time.perf_counter() - start) / loops)
+    return 1 / best
+
+
+def allocations(func):
+    """
+    Function to return the number of allocated blocks and the peak traced
+    memory (KB) of one call of `func`
+    """
+    func()  # warm up caches and lazy imports
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        result = func()
+        _, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    del result
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, 'filename') if stat.count_diff > 0)
+    return blocks, peak / 1024
+
+
+def run_suite(cases, min_seconds=0.5, repeat=5):
+    results = {}
+    for name, func in cases.items():
+        blocks, peak_kb = allocations(func)
+        results[name] = {
+            'ops_per_second': round(measure(func, min_seconds, repeat), 2),
+            'allocated_blocks': blocks,
+            'peak_kb': round(peak_kb, 1),
+        }
+        logger.info(f"{name}: {results[name]['ops_per_second']:.1f} ops/s, peak {results[name]['peak_kb']:.0f} KB")
+    return results
+
+
+def compare(results, baseline, max_slowdown=0.2, max_alloc_growth=0.2):
+    """
+    Function to return the regressions of `results` against `baseline`:
+    ops/sec lower by more than `max_slowdown` or peak memory higher by
+    more than `max_alloc_growth`
+    """
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if reference is None:
+            continue
+        if result['ops_per_second'] < reference['ops_per_second'] * (1 - max_slowdown):
+            regressions.append(
+                f"{name}: {result['ops_per_second']:.1f} ops/s vs {reference['ops_per_second']:.1f} baseline"
+            )
+        if result['peak_kb'] > reference['peak_kb'] * (1 + max_alloc_growth):
+            regressions.append(
+                f"{name}: peak {result['peak_kb']:.0f} KB vs {reference['peak_kb']:.0f} KB baseline"
+            )
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro-benchmark the parsers on saved pages")
+    parser.add_argument('--pages', default=PAGES_DIR, help="folder of saved pages")
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true', help="store these results as the new baseline")
+    parser.add_argument('--max-slowdown', type=float, default=0.2)
+    parser.add_argument('--max-alloc-growth', type=float, default=0.2)
+    parser.add_argument('--min-seconds', type=float, default=0.5)
+    parser.add_argument('--only', nargs='*', help="run only the cases starting with these names")
+    args = parser.parse_args()
+
+    cases = build_cases(args.pages)
+    if args.only:
+        cases = {name: func for name, func in cases.items() if name.startswith(tuple(args.only))}
+    results = run_suite(cases, min_seconds=args.min_seconds)
+
+    print(f"{'case':<34}{'ops/s':>12}{'blocks':>10}{'peak KB':>10}")
+    for name, result in results.items():
+        print(f"{name:<34}{result['ops_per_second']:>12}{result['allocated_blocks']:>10}{result['peak_kb']:>10}")
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=4)
+        print(f"Baseline saved to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.max_slowdown, args.max_alloc_growth)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        sys.exit(1 if regressions else 0)
+    else:
+        print(f"No baseline at {args.baseline}, run with --save-baseline to create one")
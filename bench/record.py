@@ -0,0 +1,61 @@
+import argparse
+
+from bench.fixtures import FixtureStore
+from utils.logger import setup_logging
+
+logger = setup_logging('FIXTURE-RECORDER')
+
+
+def record_catalogue(store, module, pages):
+    """
+    Function to record the landing page (pagination) and the first `pages`
+    catalogue pages of a requests based scraper module
+    """
+    response = module.client.get(module.BASE_URL)
+    store.save(response.url, response)
+    for page in range(1, pages + 1):
+        response = module.client.get(module.BASE_URL, params={'page': page})
+        store.save(response.url, response)
+    logger.info(f"Recorded {pages + 1} pages of {module.BASE_URL}")
+
+
+def record_carrefour(store, categories, pages):
+    """
+    Function to record the Carrefour menu and up to `pages` API pages of
+    the first `categories` categories of the menu
+    """
+    from carrefour import carrefour_api_mt_json as api
+    from carrefour.category_index import MENU_URL, MENU_PARAMS, CategoryIndex, flatten_menu
+
+    response = api.client.get(MENU_URL, params=MENU_PARAMS)
+    store.save(response.url, response)
+    index = CategoryIndex.from_rows(flatten_menu(response.json()))
+    for cat in index.children(api.categories, 'L3')[:categories]:
+        url = f'https://www.carrefouruae.com/api/v8/categories/{cat}'
+        page_size = api.page_size_for(cat)
+        response = api.client.get(url, params=api.request_params(0, page_size))
+        api.check_refused(response, cat)
+        store.save(response.url, response)
+        for page in range(1, min(int(response.json().get('numOfPages', 1)), pages)):
+            response = api.client.get(url, params=api.request_params(page, page_size))
+            store.save(response.url, response)
+    logger.info(f"Recorded the menu and {categories} categories of the Carrefour API")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Record live responses into replay fixtures")
+    parser.add_argument('--fixtures', default='fixtures')
+    parser.add_argument('--pages', type=int, default=5, help="catalogue/API pages recorded per site or category")
+    parser.add_argument('--carrefour-categories', type=int, default=3)
+    parser.add_argument('--retailers', nargs='+', default=['spinneys', 'choithrams', 'carrefour'])
+    args = parser.parse_args()
+
+    store = FixtureStore(args.fixtures)
+    if 'spinneys' in args.retailers:
+        from spinneys import spinneys_mt
+        record_catalogue(store, spinneys_mt, args.pages)
+    if 'choithrams' in args.retailers:
+        from choithrams import choithrams_mt
+        record_catalogue(store, choithrams_mt, args.pages)
+    if 'carrefour' in args.retailers:
+        record_carrefour(store, args.carrefour_categories, args.pages)
@@ -0,0 +1,177 @@
+import time
+import json
+import random
+import hashlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+from email.utils import parsedate_to_datetime
+
+from bench.fixtures import FixtureStore
+from utils.logger import setup_logging
+
+logger = setup_logging('REPLAY-SERVER')
+
+
+def etag(body):
+    """Function to return the ETag of a recorded body that came without one"""
+    return f'"{hashlib.md5(body).hexdigest()}"'
+
+
+def not_modified(request_headers, headers):
+    """
+    Function to check the conditional headers of a request against the
+    validators of the recorded response. If-None-Match takes precedence
+    over If-Modified-Since, as in RFC 9110
+    """
+    if_none_match = request_headers.get('If-None-Match')
+    if if_none_match is not None:
+        # Weak comparison, W/"x" matches "x"
+        tags = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+        return '*' in tags or (headers.get('ETag') or '').removeprefix('W/') in tags
+    if_modified_since = request_headers.get('If-Modified-Since')
+    if if_modified_since and headers.get('Last-Modified'):
+        try:
+            return parsedate_to_datetime(headers['Last-Modified']) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+class ReplayServer:
+    """
+    Local stand-in for the retailer sites serving recorded fixtures.
+
+    Requests are expected as /<host>/<path>?<query> (see origin_overrides).
+    Every response is delayed by `latency_ms` +/- `jitter_ms`, and a share
+    of the requests is answered with a 429 (`rate_429`) or a 503
+    (`error_rate`) instead, to exercise the retry and rate control paths.
+
+    Recorded 200 responses carry their recorded ETag (or one derived from
+    the body when the site sent none) and conditional requests matching it,
+    or the recorded Last-Modified, are answered with a 304 Not Modified,
+    so a second run with the HTTP cache replays its cache hits.
+    """
+    def __init__(self, fixtures_dir, host='127.0.0.1', port=0, latency_ms=0, jitter_ms=0,
+                 error_rate=0.0, rate_429=0.0, seed=None):
+        self.store = FixtureStore(fixtures_dir)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.rate_429 = rate_429
+        self.random = random.Random(seed)
+        self.stats = {'requests': 0, 'served': 0, 'not_modified': 0, 'missing': 0, 'injected_429': 0, 'injected_errors': 0}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def address(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def origin_overrides(self, hosts=None):
+        """Return the ORIGIN_OVERRIDES mapping the recorded hosts to this server."""
+        return {f'https://{host}': f'{self.address}/{host}' for host in (hosts or self.store.hosts())}
+
+    def _count(self, stat):
+        with self._lock:
+            self.stats[stat] += 1
+
+    def _draw(self):
+        with self._lock:
+            delay = max(0.0, self.latency_ms + self.random.uniform(-self.jitter_ms, self.jitter_ms)) / 1000
+            roll = self.random.random()
+        if roll < self.rate_429:
+            return delay, 429
+        if roll < self.rate_429 + self.error_rate:
+            return delay, 503
+        return delay, None
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                server._count('requests')
+                delay, injected = server._draw()
+                time.sleep(delay)
+
+                parts = urlsplit(self.path)
+                host, _, path = parts.path.lstrip('/').partition('/')
+                if injected is not None:
+                    server._count('injected_429' if injected == 429 else 'injected_errors')
+                    self._reply(injected, {'Content-Type': 'text/plain', 'Retry-After': '0'}, b'injected')
+                    return
+
+                recorded = server.store.lookup(host, '/' + path, parts.query)
+                if recorded is None:
+                    server._count('missing')
+                    self._reply(404, {'Content-Type': 'text/plain'}, b'not recorded')
+                    return
+                status, headers, body = recorded
+                if status == 200:
+                    headers = {**headers, 'ETag': headers.get('ETag') or etag(body)}
+                    if not_modified(self.headers, headers):
+                        server._count('not_modified')
+                        validators = {name: headers[name] for name in ('ETag', 'Last-Modified') if name in headers}
+                        self._reply(304, validators, b'')
+                        return
+                server._count('served')
+                self._reply(status, headers, body)
+
+            def _reply(self, status, headers, body):
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        logger.info(f"Replaying {', '.join(self.store.hosts()) or 'no fixtures'} on {self.address}")
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve recorded fixtures in place of the retailer sites")
+    parser.add_argument('--fixtures', default='fixtures')
+    parser.add_argument('--port', type=int, default=8800)
+    parser.add_argument('--latency-ms', type=float, default=0)
+    parser.add_argument('--jitter-ms', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--rate-429', type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = ReplayServer(
+        args.fixtures, port=args.port, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate, rate_429=args.rate_429
+        )
+    server.start()
+    print(f"SCRAPER_ORIGIN_OVERRIDES='{json.dumps(server.origin_overrides())}'")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
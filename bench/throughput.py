@@ -0,0 +1,145 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import multiprocessing
+
+from bench.replay_server import ReplayServer
+from utils.logger import setup_logging
+
+logger = setup_logging('BENCHMARK')
+
+RETAILERS = ('spinneys', 'choithrams', 'carrefour')
+
+
+def percentile(values, q):
+    """Function to return the q-th percentile (0-100) of a list of values"""
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(q / 100 * (len(values) - 1)))))
+    return values[index]
+
+
+def peak_rss_mb():
+    """Function to return the peak resident memory of the current process in MB"""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports kilobytes, macOS bytes
+        return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+    except ImportError:
+        import psutil
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss) / 1024 ** 2
+
+
+def count_staged_items(stage_path):
+    items = 0
+    for file_name in os.listdir(stage_path):
+        with open(os.path.join(stage_path, file_name), 'rb') as f:
+            items += sum(1 for _ in f)
+    return items
+
+
+def run_retailer(name, workers, carrefour_categories, results):
+    """
+    Run one scraper against the replay server inside a fresh process and
+    put its measurements on the `results` queue
+    """
+    from utils import http_client
+
+    latencies = []
+    http_client.RESPONSE_HOOKS.append(lambda response, *args, **kwargs: latencies.append(response.elapsed.total_seconds()))
+    stage_path = tempfile.mkdtemp(prefix=f'bench_{name}_')
+
+    start = time.perf_counter()
+    if name == 'spinneys':
+        from spinneys.spinneys_mt import main
+        succeeded = main(local_stage=stage_path, num_workers=workers)
+    elif name == 'choithrams':
+        from choithrams.choithrams_mt import main
+        succeeded = main(local_stage=stage_path, num_workers=workers)
+    elif name == 'carrefour':
+        from carrefour import carrefour_api_mt_json as api
+        from carrefour.category_index import fetch_category_index
+        # The menu is served by the replay server, keep the index of the run off disk
+        index = fetch_category_index(api.client)
+        api.subcategories = index.children(api.categories, 'L3')
+        if carrefour_categories:
+            api.subcategories = api.subcategories[:carrefour_categories]
+        succeeded = api.main(local_stage=stage_path, num_workers=workers)
+    else:
+        raise ValueError(f"Please enter one of {', '.join(RETAILERS)} for argument name")
+    seconds = time.perf_counter() - start
+
+    items = count_staged_items(stage_path)
+    results.put({
+        'retailer': name,
+        'succeeded': bool(succeeded),
+        'seconds': round(seconds, 3),
+        'pages': len(latencies),
+        'items': items,
+        'pages_per_second': round(len(latencies) / seconds, 2) if seconds else None,
+        'items_per_second': round(items / seconds, 2) if seconds else None,
+        'p50_latency_ms': round(percentile(latencies, 50) * 1000, 1) if latencies else None,
+        'p99_latency_ms': round(percentile(latencies, 99) * 1000, 1) if latencies else None,
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+    })
+
+
+def run_benchmark(fixtures, retailers=RETAILERS, workers=16, carrefour_categories=20, **server_settings):
+    """
+    Function to start the replay server and benchmark each retailer in its
+    own process against it. Returns the measurements per retailer
+    """
+    context = multiprocessing.get_context('spawn')
+    report = {'server': dict(server_settings), 'workers': workers, 'retailers': {}}
+    with ReplayServer(fixtures, **server_settings) as server:
+        # Inherited by the spawned processes and read by utils.http_client at import
+        os.environ['SCRAPER_ORIGIN_OVERRIDES'] = json.dumps(server.origin_overrides())
+        for name in retailers:
+            results = context.Queue()
+            process = context.Process(target=run_retailer, args=(name, workers, carrefour_categories, results))
+            process.start()
+            process.join()
+            if process.exitcode != 0:
+                logger.error(f"Benchmark of {name} exited with code {process.exitcode}")
+                report['retailers'][name] = {'retailer': name, 'succeeded': False}
+                continue
+            report['retailers'][name] = results.get()
+        report['server']['stats'] = dict(server.stats)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the scrapers against recorded fixtures")
+    parser.add_argument('--fixtures', default='fixtures')
+    parser.add_argument('--retailers', nargs='+', default=list(RETAILERS), choices=RETAILERS)
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--carrefour-categories', type=int, default=20, help="0 benchmarks every category of the menu")
+    parser.add_argument('--latency-ms', type=float, default=50)
+    parser.add_argument('--jitter-ms', type=float, default=20)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--rate-429', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help="write the report as json to this file")
+    args = parser.parse_args()
+
+    report = run_benchmark(
+        args.fixtures, args.retailers, workers=args.workers, carrefour_categories=args.carrefour_categories,
+        latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate,
+        rate_429=args.rate_429, seed=args.seed
+        )
+
+    columns = ('pages', 'items', 'seconds', 'pages_per_second', 'items_per_second', 'p50_latency_ms', 'p99_latency_ms', 'peak_rss_mb')
+    print(f"{'retailer':<12}" + ''.join(f'{column:>18}' for column in columns))
+    for name, result in report['retailers'].items():
+        print(f'{name:<12}' + ''.join(f"{str(result.get(column, '-')):>18}" for column in columns))
+    print(f"server: {report['server']['stats']}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
@@ -0,0 +1,5 @@
+from utils.retailer_fields import CARREFOUR_FIELDS
+
+# Top level product fields projected into Snowflake, hashed by the stage
+# writer to detect changed rows for incremental loads
+HASH_FIELDS = CARREFOUR_FIELDS.root_keys
@@ -1,23 +1,31 @@
 import os
 import json
-import requests
-import pandas as pd
+import time
 from tqdm import tqdm 
 from utils.logger import setup_logging
+from utils.http_client import HttpClient
+from utils.stage_writer import JsonlStageWriter
+from utils.http_cache import cached_fetch
+from carrefour import HASH_FIELDS
+from carrefour.category_index import load_category_index
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
 logger = setup_logging('Carrefour-MT-JSON')
 
-category_master = pd.read_csv('menu.csv')
-
 categories = [
     'F1600000','F11600000','F1700000','F1500000','F6000000',
     'F1610000','F1200000','NF3000000','NF2000000','F1000000'
     ]
 
-subcategories = category_master[
-    category_master['L1_ID'].isin(categories)
-    ]['L3_ID'].to_list()
+# L3 categories to extract, looked up in the category index when main runs
+# unless set beforehand (e.g. to a subset by the benchmarks)
+subcategories = None
+
+# Default page size of the category API, categories listed in
+# CATEGORY_PAGE_SIZES (filled from CARREFOUR_PAGE_SIZES by main) are
+# requested with their own page size
+DEFAULT_PAGE_SIZE = 60
+CATEGORY_PAGE_SIZES = {}
 
 params = {
     'filter': '',
@@ -47,7 +55,6 @@ headers = {
     'Credentials': 'include',
     'Deviceid': '1298535093.1704889303',
     'Env': 'prod',
-    # 'If-Modified-Since': 'Wed, 10 Jan 2024 12:21:55 GMT',
     'Intent': 'NOW',
     'Referer': 'https://www.carrefouruae.com',
     'Sec-Ch-Ua': '"Not_A Brand";v="8", "Chromium";v="120", "Google Chrome";v="120"',
@@ -62,49 +69,151 @@ headers = {
     'Userid': '2127C657-51AB-0352-DE99-EA65C2F3CC1D'
 }
 
+client = HttpClient(headers=headers)
+
+# Statuses the bot protection answers with once the session is no longer trusted
+REFUSED_STATUS_CODES = (401, 403, 429)
+
+
+class ApiRefusedError(Exception):
+    """Raised when the category API refuses the request (blocked or challenged)."""
+
+
+class CategoryFetchError(Exception):
+    """
+    Raised when pages of a category could not be fetched, `pages` holds the
+    products of the pages that were and `failed_pages` the page numbers lost.
+    """
+    def __init__(self, cat, pages, failed_pages):
+        super().__init__(f"Category {cat}: {len(failed_pages)} pages failed ({', '.join(map(str, failed_pages))})")
+        self.cat = cat
+        self.pages = pages
+        self.failed_pages = failed_pages
+
+
+def check_refused(response, cat):
+    """
+    Function to raise ApiRefusedError when the API blocked the request or
+    answered with a challenge page instead of json
+    """
+    content_type = response.headers.get('Content-Type', '')
+    if response.status_code in REFUSED_STATUS_CODES or 'json' not in content_type:
+        raise ApiRefusedError(f"Category {cat} refused with status {response.status_code} ({content_type})")
+
+
 
-def fetch_category_data(cat):
+def page_size_for(cat):
+    """Function to return the page size used for a category"""
+    return CATEGORY_PAGE_SIZES.get(cat, DEFAULT_PAGE_SIZE)
+
+
+def request_params(page, page_size):
+    """
+    Function to build the query parameters of one request, the module level
+    params are only used as defaults and never mutated
+    """
+    return {**params, 'currentPage': page, 'pageSize': page_size}
+
+
+def fetch_page(cat, page, page_size, cache=None):
+    """
+    Function to fetch one page of a category and return its json, logging
+    a one line summary of the request. With an HttpCache the request is
+    conditional and an unmodified page is served from the cache
+    """
     url = f'https://www.carrefouruae.com/api/v8/categories/{cat}'
-    params['currentPage'] = 0
-    response = requests.get(url, headers=headers, params=params)
-    print(response.status_code)
-    print(response.headers)
-    print(response.text)
+    start = time.perf_counter()
+    response_json, response = cached_fetch(
+        client, cache, url, json.loads, 
+        params=request_params(page, page_size), 
+        check=lambda response: check_refused(response, cat)
+        )
+    logger.debug(
+        f"{cat} page {page}: {response.status_code if response is not None else 'cached'}, "
+        f"{len(response_json.get('products', []))} products, "
+        f"{len(response.content) if response is not None else 0} bytes in {time.perf_counter() - start:.2f}s"
+    )
+    return response_json
+
+
+def fetch_category_data(cat, page_executor=None, page_size=None, cache=None):
+    """
+    Function to fetch every page of a category. Page 0 reports numOfPages,
+    the remaining pages are then fanned out on `page_executor` (or fetched
+    one after another when no executor is given).
+    The executor must not be the one running this function, otherwise its
+    workers can end up waiting on each other.
+    A refusal is raised as is, other errors raise CategoryFetchError once every
+    page is done, with the products of the pages that succeeded.
+    """
+    page_size = page_size or page_size_for(cat)
+    start = time.perf_counter()
     df_list = []
+    failed_pages = []
     try:
-        response_json = response.json()
-        if 'products' in response_json:
-            df_list.append(response_json['products'])
-        for page in range(1, int(response_json.get('numOfPages', 1))):
-            params['currentPage'] = page
-            response = requests.get(url, headers=headers, params=params)
-            response_json = response.json()
-            df_list.append(response_json['products'])
-        return df_list if df_list else []
+        response_json = fetch_page(cat, 0, page_size, cache)
+    except ApiRefusedError:
+        raise
     except Exception as e:
         logger.error(f"Error processing category {cat}: {e}")
-        return []
-
-def main(local_stage, num_workers=5):
-    results = []
-    with ThreadPoolExecutor(max_workers=num_workers) as executor:
-        future_to_cat = {executor.submit(fetch_category_data, cat): cat for cat in subcategories}
-        for future in tqdm(as_completed(future_to_cat), total=len(future_to_cat)):
-            cat_results = future.result()
-            results.extend(cat_results)  # Extend the lists from the responses
-
-    if results:  # Check if the list is not empty
-        ls = [subeach for each in results for subeach in each]
-        logger.info(f"Total Items Scraped {len(ls)}")
-        with open(os.path.join(local_stage,'carrefour.json'), 'w') as f:
-            json.dump(ls, f)
+        raise CategoryFetchError(cat, [], [0]) from e
+    if 'products' in response_json:
+        df_list.append(response_json['products'])
+
+    pages = range(1, int(response_json.get('numOfPages', 1)))
+    if page_executor is None:
+        results = ((page, lambda page=page: fetch_page(cat, page, page_size, cache)) for page in pages)
+    else:
+        futures = {page: page_executor.submit(fetch_page, cat, page, page_size, cache) for page in pages}
+        results = ((page, future.result) for page, future in futures.items())
+    for page, result in results:
+        try:
+            df_list.append(result()['products'])
+        except ApiRefusedError:
+            raise
+        except Exception as e:
+            logger.error(f"Error processing page {page} of category {cat}: {e}")
+            failed_pages.append(page)
+
+    logger.info(
+        f"Category {cat}: {len(df_list)} pages, {sum(len(products) for products in df_list)} products "
+        f"in {time.perf_counter() - start:.1f}s"
+    )
+    if failed_pages:
+        raise CategoryFetchError(cat, df_list, failed_pages)
+    return df_list
+
+def main(local_stage, num_workers=5, cache=None):
+    client.configure(pool_size=num_workers)
+    cats = subcategories if subcategories is not None else load_category_index().children(categories, 'L3')
+    with JsonlStageWriter(local_stage, 'carrefour', hash_fields=HASH_FIELDS) as writer:
+        # Category workers fetch page 0 and hand the remaining pages to the
+        # page workers, so large categories are not fetched serially
+        with ThreadPoolExecutor(max_workers=num_workers) as executor, \
+                ThreadPoolExecutor(max_workers=num_workers) as page_executor:
+            future_to_cat = {executor.submit(fetch_category_data, cat, page_executor, None, cache): cat for cat in cats}
+            for future in tqdm(as_completed(future_to_cat), total=len(future_to_cat)):
+                try:
+                    cat_results = future.result()
+                except ApiRefusedError as e:
+                    logger.error(str(e))
+                    continue
+                except CategoryFetchError as e:
+                    # Keep the pages that were fetched
+                    logger.error(str(e))
+                    cat_results = e.pages
+                for page_products in cat_results:
+                    writer.write(page_products)
+
+    if writer.items_written:  # Check if anything was staged
+        logger.info(f"Total Items Scraped {writer.items_written}")
         return True
     else:
         return False
 
 if __name__ == "__main__":
-    # pass
+    pass
 
     # Test Cases
-    print(fetch_category_data('F21630400'))
+    # print(fetch_category_data('F21630400'))
     # main(local_stage='./data', num_workers=5)
@@ -0,0 +1,146 @@
+import os
+import threading
+import traceback
+from random import shuffle
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from utils.logger import setup_logging
+from utils.stage_writer import JsonlStageWriter
+from carrefour.driver_pool import DriverPool
+from carrefour import carrefour_api_mt_json as api
+from carrefour import HASH_FIELDS
+from carrefour.category_index import load_category_index
+
+logger = setup_logging(name="CARREFOUR-HYBRID")
+
+class BrowserSession:
+    """
+    Single Chrome session used only to get past the bot protection. The
+    cookies and user agent of the browser are handed to the pooled HTTP
+    client of the API scraper, the browser is visited again only when the
+    API starts refusing requests.
+    """
+    def __init__(self, client, base_headers, max_bootstraps=3):
+        self.client = client
+        self.base_headers = dict(base_headers)
+        self.max_bootstraps = max_bootstraps
+        self.bootstraps = 0
+        self.generation = 0
+        self._pool = DriverPool(size=1, max_uses=max_bootstraps + 1)
+        self._lock = threading.Lock()
+
+    def bootstrap(self, category):
+        """
+        Load a category page in the browser and copy its cookies and user
+        agent to the HTTP client
+        """
+        with self._pool.lease() as pooled:
+            pooled.driver.get(f"https://www.carrefouruae.com/mafuae/en/c/{category}")
+            cookies = {cookie['name']: cookie['value'] for cookie in pooled.driver.get_cookies()}
+            user_agent = pooled.driver.execute_script("return navigator.userAgent;")
+        headers = {**self.base_headers, 'User-Agent': user_agent.replace('HeadlessChrome', 'Chrome')}
+        self.client.configure(cookies=cookies, headers=headers)
+        self.bootstraps += 1
+        self.generation += 1
+        logger.info(f"Browser bootstrap {self.bootstraps} handed {len(cookies)} cookies to the API client")
+
+    def refresh(self, seen_generation, category):
+        """
+        Bootstrap again after a refusal, unless another worker already did
+        since `seen_generation`. Returns False once the bootstrap budget is spent.
+        """
+        with self._lock:
+            if self.generation != seen_generation:
+                return True
+            if self.bootstraps >= self.max_bootstraps:
+                return False
+            self.bootstrap(category)
+            return True
+
+    def close(self):
+        self._pool.close()
+
+def fetch_with_session(cat, session, page_executor=None, cache=None):
+    """
+    Function to fetch every page of a category through the API, going back
+    to the browser when the API refuses the request. Returns None when the
+    category is still refused once the bootstrap budget is spent, a category
+    without products returns an empty list
+    """
+    while True:
+        seen_generation = session.generation
+        try:
+            return api.fetch_category_data(cat, page_executor, cache=cache)
+        except api.ApiRefusedError as e:
+            logger.warning(f"{e}, refreshing the browser session")
+            if not session.refresh(seen_generation, cat):
+                logger.error(f"Giving up on category {cat}, bootstrap budget spent")
+                return None
+
+def run_hybrid_extraction(categories, stage_path, num_workers=8, max_bootstraps=3, ledger=None, cache=None):
+    """
+    Extract the categories through the JSON API with a pooled HTTP client,
+    using a single browser session for the bot protection cookies. Produces
+    the same product json as run_parallel_extraction.
+    With a WorkLedger only the categories not done by an earlier attempt are fetched,
+    with an HttpCache unmodified API pages are served from the cache.
+    """
+    session = BrowserSession(api.client, api.headers, max_bootstraps=max_bootstraps)
+    try:
+        subcategories = load_category_index().children(categories, 'L2')
+
+        shuffle(subcategories) # quick shuffle to break pattern
+
+        if ledger is not None:
+            subcategories = ledger.remaining('carrefour-category', subcategories)
+            if not subcategories:
+                return True
+
+        api.client.configure(pool_size=num_workers)
+        session.bootstrap(subcategories[0])
+
+        logger.info(f"Extracting {len(subcategories)} categories over the API with {num_workers} workers")
+        with JsonlStageWriter(stage_path, 'carrefour', hash_fields=HASH_FIELDS) as writer:
+            with ThreadPoolExecutor(max_workers=num_workers) as executor, \
+                    ThreadPoolExecutor(max_workers=num_workers) as page_executor:
+                future_to_cat = {executor.submit(fetch_with_session, cat, session, page_executor, cache): cat for cat in subcategories}
+                for future in as_completed(future_to_cat):
+                    cat = future_to_cat[future]
+                    try:
+                        cat_results = future.result()
+                    except api.CategoryFetchError as e:
+                        logger.error(str(e))
+                        # With a ledger the whole category is fetched again on resume,
+                        # writing its partial pages now would stage them twice
+                        if ledger is None:
+                            for page_products in e.pages:
+                                writer.write(page_products)
+                        cat_results = None
+                    except Exception as e:
+                        logger.error(f"Error processing category {cat}: {e}")
+                        cat_results = None
+                    for page_products in cat_results or []:
+                        writer.write(page_products)
+                    if ledger is not None:
+                        # None when the category failed or stayed refused, an empty list is a valid result
+                        ledger.mark('carrefour-category', cat, 'failed' if cat_results is None else 'done')
+
+        logger.info(f"Total Items Scraped {writer.items_written} with {session.bootstraps} browser bootstraps")
+        if ledger is not None and ledger.remaining('carrefour-category', subcategories):
+            logger.error("Some categories failed, they are retried when the run is resumed")
+            return False
+        return writer.items_written > 0
+    except Exception as e:
+        logger.error(f"Exeption {e} was raised while running hybrid extraction")
+        logger.error(traceback.format_exc())
+        return False
+    finally:
+        session.close()
+
+if __name__ == "__main__":
+    pass
+    # categories = [
+    #     'F1600000','F11600000','F1700000','F1500000','F6000000',
+    #     'F1610000','F1200000','NF3000000','NF2000000','F1000000'
+    #     ]
+    # run_hybrid_extraction(categories, os.path.join(os.getcwd(), 'data', 'CARREFOUR'))
@@ -1,9 +1,7 @@
 import os
 import time
 import json
-import pandas as pd
 from random import shuffle
-from bs4 import BeautifulSoup
 import traceback
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from selenium import webdriver
@@ -15,35 +13,36 @@ from selenium.common.exceptions import TimeoutException, WebDriverException
 
 from utils.utils import create_directory
 from utils.logger import setup_logging
+from utils.html_parser import make_soup
+from utils.stage_writer import JsonlStageWriter, remove_stage_files
+from carrefour.driver_pool import DriverPool, configure_browser_options
+from carrefour.network_capture import NetworkCapture
+from carrefour import HASH_FIELDS
+from carrefour.category_index import load_category_index
 
 
 logger = setup_logging(name="CARREFOUR-SEL")
 
 class CarrefourCatExtractor:
-    def __init__(self, category, stage_path):
+    def __init__(self, category, stage_path, driver=None, cookie_consent=False):
         self.extraction_category = category
         self.local_stage_path = stage_path
         self.search_url = f'/api/v8/categories/{self.extraction_category}'
         self.call_url = f"https://www.carrefouruae.com/mafuae/en/c/{self.extraction_category}"
-        self.driver = webdriver.Chrome(options=self.configure_browser_options())
-        self.cookie_consent = False
+        # A driver leased from a DriverPool is reused, otherwise the extractor 
+        # starts its own browser and quits it once done
+        self.owns_driver = driver is None
+        self.driver = driver or webdriver.Chrome(options=self.configure_browser_options())
+        self.cookie_consent = cookie_consent
         self.first_load_page = False
+        self.capture = NetworkCapture(self.driver, self.search_url)
 
     def configure_browser_options(self):
         """Configure and return Chrome browser options."""
-        options = webdriver.ChromeOptions()
-        options.add_argument('--headless')  # Runs Chrome in headless mode.
-        options.add_argument('--log-level=3')  # Suppresses all logs except for critical errors in the console
-        options.set_capability('goog:loggingPrefs', {'performance': 'ALL'})
-        options.add_argument('--disable-blink-features=AutomationControlled')
-        options.add_argument('--start-maximized')
-        options.add_argument('--disable-extensions')
-        options.add_argument('--no-sandbox')
-        options.add_experimental_option('excludeSwitches', ['enable-logging'])
-        return options
+        return configure_browser_options()
     
-    def first_load(self, page_source):
-        page_source = BeautifulSoup(page_source,'html.parser')
+    def first_load(self, page_source, backend=None):
+        page_source = make_soup(page_source, 'carrefour', backend)
         tag = page_source.find('script', {"type": "application/json"})
         try:
             json_data = json.loads(tag.string)
@@ -52,27 +51,9 @@ class CarrefourCatExtractor:
             products = []
         return products
     
-    def get_search_responses(self, logs):
-        """Extract response body from network logs for a specific target URL."""
-        for log in logs:
-            message = json.loads(log["message"])
-            message_params = message.get("message", {}).get("params", {})
-
-            response = message_params.get("response")
-            if response and self.search_url in response.get("url", ""):
-                request_id = message_params.get("requestId")
-                if request_id:
-                    try:
-                        body = self.driver.execute_cdp_cmd('Network.getResponseBody', {'requestId': request_id})
-                        return body
-                    except Exception as e:
-                        logger.error(f"Error retrieving response body: {e} for {self.extraction_category}")
-        return None
-
-    def stage_json(self,json_obj, file_path):
+    def stage_json(self, json_obj, writer):
         try:
-            with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump(json_obj, f, ensure_ascii=False, indent=4)
+            writer.write(json_obj)
             return True
         except Exception as e:
             logger.error(f"Exception {e} occured while staging the json object for {self.extraction_category}")
@@ -87,7 +68,6 @@ class CarrefourCatExtractor:
                 cookie_button = wait.until(
                     EC.element_to_be_clickable((By.ID, "onetrust-accept-btn-handler"))
                 )
-                time.sleep(1)
                 cookie_button.click()
                 logger.info("Cookie consent accepted.")
                 self.cookie_consent = True
@@ -107,16 +87,15 @@ class CarrefourCatExtractor:
             )
             action = ActionChains(self.driver)
             action.move_to_element(load_more_button).perform()
-            time.sleep(1)
+            # Forget earlier responses so the wait below returns this click's page
+            self.capture.drain()
             load_more_button.click()
-            time.sleep(1)
         except TimeoutException:
             logger.warning("Load More Button Not found")
             return None 
 
-        # Get Logs parse responses and save it as products to return
-        logs = self.driver.get_log("performance")
-        response_body = self.get_search_responses(logs=logs)
+        # Wait exactly until the next page of the search API has been received
+        response_body = self.capture.wait_for_response(timeout=10)
 
         if response_body and 'body' in response_body:
             response_body = json.loads(response_body['body'])
@@ -125,7 +104,8 @@ class CarrefourCatExtractor:
         return products    
     
     def main(self):
-        products = []
+        writer = JsonlStageWriter(self.local_stage_path, f'{self.extraction_category}_products', hash_fields=HASH_FIELDS)
+        staged = True
         try:
             self.driver.get(self.call_url)
             while True:
@@ -133,49 +113,69 @@ class CarrefourCatExtractor:
                 if output is None:
                     break
                 else:
-                    products.extend(output)
+                    # Stage every batch as it arrives so a crash keeps what was loaded
+                    staged = self.stage_json(json_obj=output, writer=writer) and staged
         finally:
-            if self.stage_json(
-                json_obj = products, 
-                file_path=os.path.join(
-                    self.local_stage_path,
-                    f'{self.extraction_category}_products.json'
-                    )
-                    ):
-                logger.info("Data successfully staged")
+            writer.close()
+            if staged:
+                logger.info(f"Data successfully staged {writer.items_written} items for {self.extraction_category}")
             else:
                 logger.error("Data stage issue")
 
-            self.driver.close()
-            self.driver.quit()
+            if self.owns_driver:
+                self.driver.close()
+                self.driver.quit()
 
         return None
 
-def scrape_category(category, stage_path):
+def scrape_category(category, stage_path, pool=None, ledger=None):
     """Function to initiate scraping for a specific category."""
-    extractor = CarrefourCatExtractor(
-        category=category, 
-        stage_path=stage_path
-        )
-    extractor.main()
-
-def run_parallel_extraction(categories, stage_path):
-    """Run the extraction in parallel across multiple categories."""
+    if ledger is not None:
+        # Drop whatever an interrupted attempt staged for this category
+        if remove_stage_files(stage_path, f'{category}_products'):
+            logger.info(f"Removed partial stage files of {category}")
     try:
-        category_master = pd.read_csv(
-            os.path.join(os.getcwd(), 'menu.csv')
-            )
-
-        subcategories = set(category_master[
-            category_master['L1_ID'].isin(categories)
-            ]['L2_ID'].to_list())
-
-        subcategories = list(subcategories)
+        if pool is None:
+            extractor = CarrefourCatExtractor(
+                category=category, 
+                stage_path=stage_path
+                )
+            extractor.main()
+        else:
+            with pool.lease() as pooled:
+                extractor = CarrefourCatExtractor(
+                    category=category, 
+                    stage_path=stage_path,
+                    driver=pooled.driver,
+                    cookie_consent=pooled.cookie_consent
+                    )
+                extractor.main()
+                pooled.cookie_consent = extractor.cookie_consent
+    except Exception as e:
+        if ledger is not None:
+            ledger.mark('carrefour-category', category, 'failed', detail=str(e))
+        raise
+    if ledger is not None:
+        ledger.mark('carrefour-category', category, 'done')
+
+def run_parallel_extraction(categories, stage_path, max_workers=None, max_uses=10, ledger=None):
+    """
+    Run the extraction in parallel across multiple categories on a pool of 
+    warm browsers, sized from the available memory unless `max_workers` is given.
+    With a WorkLedger only the categories not done by an earlier attempt are scraped.
+    """
+    pool = DriverPool(size=max_workers, max_uses=max_uses)
+    try:
+        subcategories = load_category_index().children(categories, 'L2')
 
         shuffle(subcategories) # quick shuffle to break pattern
 
-        with ThreadPoolExecutor(max_workers=2) as executor:
-            futures = [executor.submit(scrape_category, cat, stage_path) for cat in subcategories]
+        if ledger is not None:
+            subcategories = ledger.remaining('carrefour-category', subcategories)
+
+        logger.info(f"Extracting {len(subcategories)} categories on {pool.size} browsers")
+        with ThreadPoolExecutor(max_workers=pool.size) as executor:
+            futures = [executor.submit(scrape_category, cat, stage_path, pool, ledger) for cat in subcategories]
             for future in as_completed(futures):
                 future.result()  # This will raise any exceptions caught during the thread execution.
 
@@ -184,6 +184,8 @@ def run_parallel_extraction(categories, stage_path):
         logger.error(f"Exeption {e} was raised while running parallel extraction")
         logger.error(traceback.format_exc())
         return False
+    finally:
+        pool.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,217 @@
+import os
+import csv
+import json
+import time
+import threading
+from utils.logger import setup_logging
+
+logger = setup_logging('CARREFOUR-CATEGORIES')
+
+MENU_URL = 'https://www.carrefouruae.com/api/v1/menu'
+MENU_PARAMS = {
+    'latitude': '25.2321031',
+    'longitude': '55.2772914',
+    'lang': 'en',
+    'displayCurr': 'AED'
+}
+MENU_HEADERS = {
+    'Appid': 'Reactweb',
+    'Env': 'prod',
+    'Lang': 'en',
+    'Langcode': 'en',
+    'Referer': 'https://www.carrefouruae.com',
+    'Sec-Ch-Ua': '"Chromium";v="122", "Not(A:Brand";v="24", "Google Chrome";v="122"',
+    'Sec-Ch-Ua-Mobile': '?0',
+    'Sec-Ch-Ua-Platform': '"Windows"',
+    'Storeid': 'mafuae',
+    'Token': 'undefined',
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36',
+    'Userid': 'anonymous',
+    'X-Requested-With': 'XMLHttpRequest'
+}
+
+DEFAULT_INDEX_PATH = os.path.join(os.getcwd(), 'state', 'carrefour_categories.json')
+DEFAULT_TTL_HOURS = 24
+# Hand maintained export of the menu, only used when the menu API cannot be
+# reached and there is no index on disk yet
+SEED_CSV_PATH = os.path.join(os.getcwd(), 'menu.csv')
+
+LEVELS = ('L2', 'L3')
+
+
+def flatten_menu(menu):
+    """
+    Function to flatten the /api/v1/menu tree into (L1_ID, L1_Name, L2_ID,
+    L2_Name, L3_ID, L3_Name) rows, None for the levels a branch does not have
+    """
+    rows = []
+    for l1 in menu[0]['children']:
+        if not l1.get('children'):
+            rows.append((l1['id'], l1['name'], None, None, None, None))
+            continue
+        for l2 in l1['children']:
+            if not l2.get('children'):
+                rows.append((l1['id'], l1['name'], l2['id'], l2['name'], None, None))
+                continue
+            for l3 in l2['children']:
+                rows.append((l1['id'], l1['name'], l2['id'], l2['name'], l3['id'], l3['name']))
+    return rows
+
+
+class CategoryIndex:
+    """
+    Compact L1 -> L2 -> L3 lookup of the Carrefour category tree.
+
+    The ids below every L1 are precomputed per level at load time, so
+    selecting the categories of a run is a handful of dict lookups.
+    """
+    def __init__(self, tree, names, fetched=None):
+        self.tree = tree
+        self.names = names
+        self.fetched = fetched if fetched is not None else time.time()
+        self._children = {
+            l1_id: {
+                'L2': tuple(l2_children),
+                'L3': tuple(l3_id for l3_children in l2_children.values() for l3_id in l3_children),
+            }
+            for l1_id, l2_children in tree.items()
+        }
+
+    @classmethod
+    def from_rows(cls, rows, fetched=None):
+        """Build the index from flattened (L1_ID, L1_Name, ..., L3_Name) rows."""
+        tree, names = {}, {}
+        for l1_id, l1_name, l2_id, l2_name, l3_id, l3_name in rows:
+            names[l1_id] = l1_name
+            l2_children = tree.setdefault(l1_id, {})
+            if l2_id:
+                names[l2_id] = l2_name
+                l3_children = l2_children.setdefault(l2_id, [])
+                if l3_id:
+                    names[l3_id] = l3_name
+                    l3_children.append(l3_id)
+        return cls(tree, names, fetched)
+
+    def __len__(self):
+        return len(self.names)
+
+    def age_hours(self):
+        return (time.time() - self.fetched) / 3600
+
+    def children(self, l1_ids, level='L2'):
+        """
+        Return the L2 or L3 ids under the given L1 ids, in menu order and
+        without duplicates. Unknown L1 ids are skipped with a warning
+        """
+        if level not in LEVELS:
+            raise ValueError("Please enter either L2 or L3 for argument level")
+        ids = []
+        for l1_id in l1_ids:
+            children = self._children.get(l1_id)
+            if children is None:
+                logger.warning(f"Category {l1_id} is not in the Carrefour menu")
+                continue
+            ids.extend(children[level])
+        return list(dict.fromkeys(ids))
+
+    def rows(self):
+        for l1_id, l2_children in self.tree.items():
+            if not l2_children:
+                yield l1_id, self.names[l1_id], None, None, None, None
+            for l2_id, l3_children in l2_children.items():
+                if not l3_children:
+                    yield l1_id, self.names[l1_id], l2_id, self.names[l2_id], None, None
+                for l3_id in l3_children:
+                    yield l1_id, self.names[l1_id], l2_id, self.names[l2_id], l3_id, self.names[l3_id]
+
+    def save(self, path=DEFAULT_INDEX_PATH):
+        """Write the index as compact json, atomically."""
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'fetched': self.fetched, 'names': self.names, 'tree': self.tree}, f, separators=(',', ':'), ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=DEFAULT_INDEX_PATH):
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        return cls(data['tree'], data['names'], data['fetched'])
+
+    @classmethod
+    def from_csv(cls, path=SEED_CSV_PATH):
+        """Build the index from a menu.csv export (fetched time set to its modification time)."""
+        with open(path, newline='', encoding='utf-8') as f:
+            rows = [
+                tuple(row[column] or None for column in ('L1_ID', 'L1_Name', 'L2_ID', 'L2_Name', 'L3_ID', 'L3_Name'))
+                for row in csv.DictReader(f)
+            ]
+        return cls.from_rows(rows, fetched=os.path.getmtime(path))
+
+    def to_csv(self, path):
+        """Export the index in the menu.csv layout."""
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['', 'L1_ID', 'L1_Name', 'L2_ID', 'L2_Name', 'L3_ID', 'L3_Name'])
+            for number, row in enumerate(self.rows()):
+                writer.writerow([number, *row])
+
+
+def fetch_category_index(client=None):
+    """
+    Function to fetch the menu tree from the Carrefour API and return it as a CategoryIndex
+    """
+    if client is None:
+        from utils.http_client import HttpClient
+        client = HttpClient(headers=MENU_HEADERS, pool_size=1)
+    response = client.get(MENU_URL, params=MENU_PARAMS)
+    response.raise_for_status()
+    return CategoryIndex.from_rows(flatten_menu(response.json()))
+
+
+# Minimum time between two refresh attempts of a process once the menu API failed
+RETRY_SECONDS = 3600
+
+_index = None
+_failed_at = None
+_index_lock = threading.Lock()
+
+
+def load_category_index(path=DEFAULT_INDEX_PATH, ttl_hours=DEFAULT_TTL_HOURS, client=None, refresh=False):
+    """
+    Function to return the category index of the process: the index on
+    disk while it is younger than `ttl_hours`, otherwise a fresh copy of the
+    menu API saved to `path`. When the API cannot be reached a stale index
+    (or the menu.csv seed) is used rather than failing the run
+    """
+    global _index, _failed_at
+    with _index_lock:
+        if _index is not None and not refresh:
+            if _index.age_hours() < ttl_hours or (_failed_at is not None and time.time() - _failed_at < RETRY_SECONDS):
+                return _index
+
+        stale = None
+        if os.path.exists(path):
+            try:
+                stale = CategoryIndex.load(path)
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"Unreadable category index {path}: {e}")
+        if stale is not None and not refresh and stale.age_hours() < ttl_hours:
+            _index = stale
+            return _index
+
+        try:
+            _index = fetch_category_index(client)
+            _index.save(path)
+            _failed_at = None
+            logger.info(f"Category index refreshed from the menu API: {len(_index)} categories")
+        except Exception as e:
+            if stale is None and not os.path.exists(SEED_CSV_PATH):
+                raise
+            _index = stale if stale is not None else CategoryIndex.from_csv(SEED_CSV_PATH)
+            _failed_at = time.time()
+            logger.warning(
+                f"Menu API unavailable ({e}), using the {'stale index' if stale is not None else 'menu.csv seed'} "
+                f"from {_index.age_hours():.0f}h ago"
+            )
+        return _index
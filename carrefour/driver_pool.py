@@ -0,0 +1,166 @@
+import os
+import queue
+import threading
+from contextlib import contextmanager
+from selenium import webdriver
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.wait import WebDriverWait
+from selenium.common.exceptions import TimeoutException, WebDriverException
+
+from utils.logger import setup_logging
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+logger = setup_logging(name="CARREFOUR-DRIVER-POOL")
+
+HOME_URL = 'https://www.carrefouruae.com/mafuae/en/'
+
+# Rough resident memory of one headless Chrome rendering a category page
+BROWSER_MEMORY_MB = 600
+
+
+def configure_browser_options():
+    """Configure and return Chrome browser options."""
+    options = webdriver.ChromeOptions()
+    options.add_argument('--headless')  # Runs Chrome in headless mode.
+    options.add_argument('--log-level=3')  # Suppresses all logs except for critical errors in the console
+    options.set_capability('goog:loggingPrefs', {'performance': 'ALL'})
+    options.add_argument('--disable-blink-features=AutomationControlled')
+    options.add_argument('--start-maximized')
+    options.add_argument('--disable-extensions')
+    options.add_argument('--no-sandbox')
+    options.add_experimental_option('excludeSwitches', ['enable-logging'])
+    return options
+
+
+def pool_size_from_memory(browser_memory_mb=BROWSER_MEMORY_MB, reserve_mb=1024, max_size=None):
+    """
+    Function to size the pool from the memory currently available, keeping
+    `reserve_mb` free for the rest of the pipeline
+    """
+    max_size = max_size or os.cpu_count() or 2
+    if psutil is None:
+        logger.warning("psutil is not installed, defaulting to a pool of 2 browsers")
+        return 2
+    available_mb = psutil.virtual_memory().available / 1024 ** 2
+    return max(1, min(max_size, int((available_mb - reserve_mb) // browser_memory_mb)))
+
+
+class PooledDriver:
+    """A Chrome driver together with its pool bookkeeping."""
+    def __init__(self, driver):
+        self.driver = driver
+        self.uses = 0
+        self.cookie_consent = False
+
+
+class DriverPool:
+    """
+    Pool of warm headless Chrome browsers. Browsers are started lazily up to
+    `size`, warmed up on the Carrefour home page with the cookie consent
+    accepted, leased for one category at a time and recycled after
+    `max_uses` categories or as soon as a lease ends with an exception.
+    """
+    def __init__(self, size=None, max_uses=10):
+        self.size = size or pool_size_from_memory()
+        self.max_uses = max_uses
+        self._idle = queue.Queue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _start_driver(self):
+        pooled = PooledDriver(webdriver.Chrome(options=configure_browser_options()))
+        try:
+            pooled.driver.get(HOME_URL)
+            cookie_button = WebDriverWait(pooled.driver, 10).until(
+                EC.element_to_be_clickable((By.ID, "onetrust-accept-btn-handler"))
+            )
+            cookie_button.click()
+            pooled.cookie_consent = True
+            logger.info("Warm browser started with cookie consent accepted.")
+        except TimeoutException:
+            logger.warning("No cookie consent button found while warming up the browser.")
+        except WebDriverException:
+            # Do not leak the Chrome process of a browser that failed to warm up
+            try:
+                pooled.driver.quit()
+            except WebDriverException as e:
+                logger.warning(f"Error {e} while quitting a browser that failed to warm up")
+            raise
+        return pooled
+
+    def _discard(self, pooled):
+        with self._lock:
+            self._created -= 1
+        try:
+            pooled.driver.quit()
+        except WebDriverException as e:
+            logger.warning(f"Error {e} while quitting a recycled browser")
+
+    def _acquire(self):
+        while True:
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                pass
+            with self._lock:
+                can_start = self._created < self.size
+                if can_start:
+                    self._created += 1
+            if can_start:
+                try:
+                    return self._start_driver()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            # Wait for a browser to be returned, re-checking capacity in case
+            # a recycled browser freed a slot in the meantime
+            try:
+                return self._idle.get(timeout=1)
+            except queue.Empty:
+                continue
+
+    @contextmanager
+    def lease(self):
+        """
+        Lease a warm browser for the duration of the with block
+        """
+        while True:
+            pooled = self._acquire()
+            try:
+                # Drop the performance log entries left over from the previous lease
+                pooled.driver.get_log("performance")
+                break
+            except WebDriverException:
+                logger.warning("Idle browser is no longer responsive, starting a new one")
+                self._discard(pooled)
+        crashed = False
+        try:
+            yield pooled
+        except Exception:
+            crashed = True
+            raise
+        finally:
+            pooled.uses += 1
+            if crashed or self._closed or pooled.uses >= self.max_uses:
+                logger.info(f"Recycling browser after {pooled.uses} uses{' (crashed)' if crashed else ''}")
+                self._discard(pooled)
+            else:
+                self._idle.put(pooled)
+
+    def close(self):
+        """Quit every idle browser, leased ones are quit when returned."""
+        self._closed = True
+        while True:
+            try:
+                pooled = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(pooled)
+        logger.info("Driver pool closed")
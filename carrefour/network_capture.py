@@ -0,0 +1,67 @@
+import json
+import time
+
+from utils.logger import setup_logging
+
+logger = setup_logging(name="CARREFOUR-NETWORK")
+
+
+class NetworkCapture:
+    """
+    Incremental cursor over the Chrome performance log that waits for the
+    next response whose URL contains `url_substring` to finish loading.
+
+    Only log lines that mention the URL (or a request already being tracked)
+    are json decoded, everything else is skipped on a substring check.
+    """
+    def __init__(self, driver, url_substring):
+        self.driver = driver
+        self.url_substring = url_substring
+        self.pending = set()
+        self.finished = []
+
+    def _consume(self, logs):
+        for log in logs:
+            raw = log["message"]
+            if self.url_substring in raw:
+                params = json.loads(raw).get("message", {}).get("params", {})
+                response = params.get("response")
+                if response and self.url_substring in response.get("url", ""):
+                    self.pending.add(params.get("requestId"))
+            elif self.pending and 'Network.loadingFinished' in raw:
+                message = json.loads(raw).get("message", {})
+                request_id = message.get("params", {}).get("requestId")
+                if request_id in self.pending:
+                    self.pending.discard(request_id)
+                    self.finished.append(request_id)
+
+    def poll(self):
+        """Read the log entries recorded since the last poll."""
+        self._consume(self.driver.get_log("performance"))
+
+    def drain(self):
+        """Forget everything captured so far, e.g. right before a click."""
+        self.poll()
+        self.pending.clear()
+        self.finished.clear()
+
+    def wait_for_response(self, timeout=10, poll_interval=0.05):
+        """
+        Block until the next matching response has finished loading and
+        return its body (as returned by Network.getResponseBody), or None
+        if nothing arrived within `timeout` seconds
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            self.poll()
+            if self.finished:
+                request_id = self.finished.pop(0)
+                try:
+                    return self.driver.execute_cdp_cmd('Network.getResponseBody', {'requestId': request_id})
+                except Exception as e:
+                    logger.error(f"Error retrieving response body: {e} for {self.url_substring}")
+                    return None
+            if time.monotonic() >= deadline:
+                logger.warning(f"No response for {self.url_substring} within {timeout}s")
+                return None
+            time.sleep(poll_interval)
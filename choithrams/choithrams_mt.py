@@ -2,12 +2,17 @@ import re
 import os
 import sys
 import json
-import requests
 from tqdm import tqdm
-from bs4 import BeautifulSoup
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from utils.logger import setup_logging
+from utils.http_client import HttpClient
+from utils.html_parser import make_soup
+from utils.parse_pipeline import run_pipeline
+from utils.stage_writer import JsonlStageWriter
+from utils.http_cache import cached_fetch
+from utils.telemetry import PARSE_SECONDS
+from utils.retailer_fields import CHOITHRAMS_FIELDS
 
 logger = setup_logging('CHOITHRAMS')
 
@@ -21,6 +26,18 @@ HEADERS = {
 
 }
 
+# Fields projected into Snowflake, hashed to detect changed rows
+HASH_FIELDS = CHOITHRAMS_FIELDS.root_keys
+
+client = HttpClient(headers=HEADERS)
+
+# Extract JSON-like part from the <script> tag
+ECOMMERCE_PATTERN = re.compile(r'"ecommerce": (\{.*?\})\s*\}', re.DOTALL)
+UNQUOTED_PROPERTY = re.compile(r'\s{2,}(\b\w+\b):\s')
+
+# Bump whenever parse_page changes so pages served from the HTTP cache are re-parsed
+PARSER_VERSION = '1'
+
 def check_script(script):
     """
     Function to check the list of script tags for the relevant script
@@ -45,8 +62,8 @@ def get_final_page_number():
     """
     Function to call the base url and extract the final page number
     """
-    response = requests.get(url = BASE_URL, headers=HEADERS)
-    soup = BeautifulSoup(response.text, 'html.parser')
+    response = client.get(BASE_URL)
+    soup = make_soup(response.text, 'choithrams-pagination')
         
     page_num_tag = soup.find('div', {'class': 'page-buttons'}).find_all('a')
     page_num_tag = page_num_tag[-2].text
@@ -54,73 +71,124 @@ def get_final_page_number():
 
     return final_page_number
 
-def process_page(page):
+def extract_items(script_string, page):
     """
-    Function to process extract data from a given page number input
+    Function to extract the ecommerce items from the view_item_list script,
+    quoting the JavaScript property names and fixing entities and None values
     """
+    match = ECOMMERCE_PATTERN.search(script_string)
+    if not match:
+        logger.error(f"Could not find the JavaScript object in the script content for page {page}")
+        return []
 
-    params = {
-        'page': page
-    }
+    json_string = match.group(1)
 
-    items = []
+    # Replace JavaScript-style property names (without quotes) with quoted names
+    json_string = UNQUOTED_PROPERTY.sub(r'"\1":', json_string)
 
-    # Step 1: Call URL with necessary headers
-    response = requests.get(url=BASE_URL, headers=HEADERS, params=params)
+    # Decode HTML entities
+    json_string = json_string.replace("&gt;", ">").replace("&amp;", "&")
+
+    # Replace Python None with JSON null
+    json_string = json_string.replace("None", "null")
 
+    # Parse JSON
+    try:
+        data = json.loads(json_string)
+        return data['items']
+    except json.JSONDecodeError as e:
+        logger.error(f"Error parsing JSON: {e} for page: {page}")
+        error_position = e.pos  # Using the exception's position attribute if available
+        snippet = print_near_error(json_string, error_position)
+        logger.error(snippet)
+        return []
+
+def parse_page(html, page, backend=None):
+    """
+    Function to extract the items from the html of a given catalogue page
+    """
     # Step 2: Parse the response into a soup object
-    soup = BeautifulSoup(response.text, 'html.parser')
+    if isinstance(html, bytes):
+        html = html.decode('utf-8', errors='replace')
+    soup = make_soup(html, 'choithrams', backend=backend)
 
     # Step 3.1: Extracting the items json file stored in the script tag
     script = soup.find_all('script')
     script_string = list(filter(lambda x: check_script(x), script))[0].text
 
-    # Extract JSON-like part from the <script> tag
-    pattern = r'"ecommerce": (\{.*?\})\s*\}'
-    match = re.search(pattern, script_string, re.DOTALL)
+    return extract_items(script_string, page)
 
-    if match:
-        json_string = match.group(1)
+def fetch_page(page):
+    """
+    Function to fetch the raw html of a given catalogue page
+    """
 
-        # Replace JavaScript-style property names (without quotes) with quoted names
-        json_string = re.sub(r'\s{2,}(\b\w+\b):\s', r'"\1":', json_string)
+    params = {
+        'page': page
+    }
 
-        # Decode HTML entities
-        json_string = json_string.replace("&gt;", ">").replace("&amp;", "&")
+    # Step 1: Call URL with necessary headers
+    response = client.get(BASE_URL, params=params)
 
-        # Replace Python None with JSON null
-        json_string = json_string.replace("None", "null")
-
-        # Parse JSON
-        try:
-            data = json.loads(json_string)
-            items = data['items']
-        except json.JSONDecodeError as e:
-            logger.error(f"Error parsing JSON: {e} for page: {page}")
-            error_position = e.pos  # Using the exception's position attribute if available
-            snippet = print_near_error(json_string, error_position)
-            logger.error(snippet)
-            return items
-    else:
-        logger.error(f"Could not find the JavaScript object in the script content for page {page}")
+    return response.content
 
+def process_page(page, cache=None):
+    """
+    Function to process extract data from a given page number input, reusing
+    the items of the previous run when the cached page was not modified
+    """
+    def extract(content):
+        with PARSE_SECONDS.time(retailer='choithrams'):
+            return parse_page(content, page)
+
+    items, _ = cached_fetch(
+        client, cache, BASE_URL, 
+        extract, 
+        params={'page': page}, 
+        version=PARSER_VERSION
+        )
     return items
     
 
-def main(local_stage, num_workers=5):
-    all_items = []
+def main(local_stage, num_workers=5, mode='thread', concurrency=32, parse_workers=None, ledger=None, cache=None):
+    """
+    Scrape the full catalogue and stream it into jsonl stage files.
+    `mode='thread'` fetches pages on a pool of `num_workers` threads,
+    `mode='async'` keeps up to `concurrency` requests in flight on a single
+    asyncio event loop and `mode='process'` fetches on `num_workers` threads
+    while parsing on a pool of `parse_workers` processes.
+    With a WorkLedger the pages already staged by an interrupted run are skipped,
+    with an HttpCache (thread mode) pages are requested conditionally
+    """
+    client.configure(pool_size=num_workers)
     final_page_number = get_final_page_number() 
+    pages = range(1, final_page_number + 1)
+    if ledger is not None:
+        pages = ledger.remaining('choithrams-page', pages)
     
-    with ThreadPoolExecutor(max_workers=num_workers) as executor:
-            future_to_page = {executor.submit(process_page, page): page for page in range(1, final_page_number + 1)}
-            for future in tqdm(as_completed(future_to_page), total=len(future_to_page)):
-                page_results = future.result()
-                all_items.extend(page_results)
-
-    if all_items:
-        logger.info(f"Total Items Scraped {len(all_items)}")
-        with open(os.path.join(local_stage,'choithrams.json'), 'w') as f:
-            json.dump(all_items, f)
+    with JsonlStageWriter(local_stage, 'choithrams', hash_fields=HASH_FIELDS) as writer:
+
+        def stage_page(items, page):
+            writer.write(items)
+            if ledger is not None:
+                ledger.mark('choithrams-page', page, 'done')
+
+        if mode == 'async':
+            # aiohttp is only imported by the runs that use it
+            from utils.async_crawler import crawl_pages
+            crawl_pages(BASE_URL, pages, HEADERS, parse_page, concurrency=concurrency, on_page=stage_page)
+        elif mode == 'process':
+            run_pipeline(fetch_page, parse_page, pages, fetch_workers=num_workers, parse_workers=parse_workers, on_page=stage_page)
+        elif mode == 'thread':
+            with ThreadPoolExecutor(max_workers=num_workers) as executor:
+                    future_to_page = {executor.submit(process_page, page, cache): page for page in pages}
+                    for future in tqdm(as_completed(future_to_page), total=len(future_to_page)):
+                        stage_page(future.result(), future_to_page[future])
+        else:
+            raise ValueError("Please enter either thread, async or process for argument mode")
+
+    if writer.items_written or (ledger is not None and not pages):
+        logger.info(f"Total Items Scraped {writer.items_written}")
         return True
     else:
         return False
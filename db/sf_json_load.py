@@ -1,10 +1,18 @@
+import os
+import time
 import datetime as dt
 import snowflake.connector
 from contextlib import contextmanager
-from typing import Tuple, Dict, Optional
+from typing import Tuple, Dict, List, Optional
 
 from utils.utils import has_json_files
+from utils.stage_writer import (
+    STAGE_EXTENSION, COMPRESSION_EXTENSIONS, SOURCE_COMPRESSION, DEFAULT_MAX_BYTES, compress_stage_folder
+)
 from utils.logger import setup_logging
+from utils.telemetry import telemetry, QUERY_SECONDS
+from utils.field_mapping import SNOWFLAKE_TYPES, FieldSpec
+from utils.parquet_stage import PARQUET_EXTENSION, LOAD_TIMESTAMP, ROW_HASH, has_pyarrow, write_parquet_stage
 from credentials.credential_manager import CredentialManager
 
 # Set up logging
@@ -16,7 +24,14 @@ class jsonDataLoader:
     improved error handling, and a Pythonic approach to resource 
     management and documentation.
     """
-    def __init__(self) -> None:
+    def __init__(
+            self, 
+            conn: Optional[snowflake.connector.SnowflakeConnection] = None,
+            compression: str = 'gzip',
+            chunk_bytes: int = DEFAULT_MAX_BYTES,
+            put_parallel: int = 8,
+            parquet_compression: str = 'zstd'
+            ) -> None:
 
         # Initializing helper objects
         self.credentials = CredentialManager()
@@ -26,10 +41,32 @@ class jsonDataLoader:
         self.timestamp = dt.datetime.now().strftime("%Y%m%d%H%M%S")
         self.stage_name: Optional[str] = None
         self.table_name: Optional[str] = None
+        self.history_table_name: Optional[str] = None
         self.snowflake_database = self.conn_details['database'].upper()
         self.snowflake_schema = self.conn_details['schema'].upper()
-        self.file_format = 'JSON_LOAD_FORMAT'
-        
+        self.file_format = 'NDJSON_LOAD_FORMAT'
+        self.parquet_file_format = 'PARQUET_LOAD_FORMAT'
+
+        # Stage files are split into chunks of `chunk_bytes`, compressed 
+        # locally and PUT with `put_parallel` upload threads
+        self.compression = compression
+        self.chunk_bytes = chunk_bytes
+        self.put_parallel = put_parallel
+        self.parquet_compression = parquet_compression
+        self.put_stats: Dict[str, float] = {}
+        # Drift of the last Parquet stage against its field spec
+        self.drift: Dict[str, object] = {}
+
+        # One session is kept for the lifetime of the loader. A connection
+        # passed in by the caller is shared and left open on close()
+        self._conn = conn
+        self._owns_conn = conn is None
+
+    def __enter__(self) -> "jsonDataLoader":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
 
     def prepare_conn_details(self) -> Dict[str, str]:
         """
@@ -48,26 +85,38 @@ class jsonDataLoader:
         )
         return details
 
+    @property
+    def connection(self) -> snowflake.connector.SnowflakeConnection:
+        """
+        The persistent Snowflake session of the loader, opened on first 
+        use and re-opened if it has been closed in the meantime.
+        """
+        if self._conn is None or self._conn.is_closed():
+            self._conn = snowflake.connector.connect(
+                user=self.conn_details['user'],
+                password=self.conn_details['password'],
+                account=self.conn_details['account'],
+                warehouse=self.conn_details['warehouse'],
+                database=self.conn_details['database'],
+                schema=self.conn_details['schema'],
+                role=self.conn_details['role'],
+                client_session_keep_alive=True,
+            )
+        return self._conn
+
     @contextmanager
     def snowflake_connection(self):
         """
-        Context manager for Snowflake connection, 
-        ensuring it's closed after use.
+        Context manager handing out the persistent Snowflake session,
+        the session stays open until close() is called.
         """
-        
-        conn = snowflake.connector.connect(
-            user=self.conn_details['user'],
-            password=self.conn_details['password'],
-            account=self.conn_details['account'],
-            warehouse=self.conn_details['warehouse'],
-            database=self.conn_details['database'],
-            schema=self.conn_details['schema'],
-            role=self.conn_details['role'],
-        )
-        try:
-            yield conn
-        finally:
-            conn.close()
+        yield self.connection
+
+    def close(self) -> None:
+        """Close the Snowflake session if it is owned by this loader."""
+        if self._owns_conn and self._conn is not None:
+            self._conn.close()
+            self._conn = None
 
     def execute_query(self, query: str) -> str:
         """
@@ -75,12 +124,20 @@ class jsonDataLoader:
         Snowflake database and return the query ID.
         """
 
+        statement = query.split(None, 1)[0].upper() if query.strip() else ''
         with self.snowflake_connection() as conn:
             cursor = conn.cursor()
+            start = time.perf_counter()
             try:
                 cursor.execute(query)
                 return cursor.sfqid
             finally:
+                elapsed = time.perf_counter() - start
+                QUERY_SECONDS.observe(elapsed, statement=statement)
+                telemetry.event(
+                    'snowflake_query', statement=statement, query_id=cursor.sfqid, 
+                    table=self.table_name, seconds=round(elapsed, 3)
+                    )
                 cursor.close()
 
     def table_exists(self, table_name: str) -> bool:
@@ -100,6 +157,37 @@ class jsonDataLoader:
             finally:
                 cursor.close()
 
+    def table_columns(self, table_name: str) -> List[str]:
+        """
+        Return the column names of a table in the Snowflake schema
+        """
+        query = f"""SELECT COLUMN_NAME FROM INFORMATION_SCHEMA.COLUMNS 
+                    WHERE TABLE_SCHEMA = '{self.snowflake_schema.upper()}' 
+                    AND TABLE_NAME = '{table_name.upper()}';"""
+        with self.snowflake_connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(query)
+                return [row[0] for row in cursor.fetchall()]
+            finally:
+                cursor.close()
+
+    def add_missing_columns(self, table_name: str, spec: FieldSpec) -> List[str]:
+        """
+        Add the fields of the spec an existing table does not have yet (e.g. a
+        field added to the spec after the table was created), so they are not
+        dropped by the load. Returns the added column names.
+        """
+        existing = {column.upper() for column in self.table_columns(table_name)}
+        missing = [f for f in spec if f.name.upper() not in existing]
+        if missing:
+            definitions = ', '.join(f'{f.name} {SNOWFLAKE_TYPES[f.type]}' for f in missing)
+            self.execute_query(
+                f"ALTER TABLE {self.snowflake_database}.{self.snowflake_schema}.{table_name} ADD COLUMN IF NOT EXISTS {definitions}"
+                )
+            logger.info(f"Added the columns {', '.join(f.name for f in missing)} to {table_name}")
+        return [f.name for f in missing]
+
     def local_stage_sf_stage(self, name: str, local_stage_path: str, replace: bool = False) -> str:
         """
         Create or replace a Snowflake stage, load data 
@@ -116,34 +204,139 @@ class jsonDataLoader:
             stage_create = f"""CREATE OR REPLACE STAGE {self.snowflake_database+'.'+self.snowflake_schema+'.'+stage_name}"""
             self.execute_query(stage_create)
 
-            local_stage_path = local_stage_path.replace('\\', '/')
-            put_command = f"PUT file://{local_stage_path}/*.json @{stage_name};" if ' ' not in local_stage_path else f"PUT 'file://{local_stage_path}/*.json' @{stage_name};"
-            put_qid = self.execute_query(put_command)
+            # The chunks are written to a sub folder, the jsonl files may be
+            # archived to Spaces at the same time
+            compression, compressed_path, files = compress_stage_folder(
+                stage_path=local_stage_path,
+                compression=self.compression,
+                chunk_bytes=self.chunk_bytes,
+                workers=self.put_parallel
+                )
+            extension = STAGE_EXTENSION + COMPRESSION_EXTENSIONS[compression]
+            put_options = f"PARALLEL = {self.put_parallel} SOURCE_COMPRESSION = {SOURCE_COMPRESSION[compression]} AUTO_COMPRESS = FALSE"
+            put_qid = self.put_files(stage_name, compressed_path, files, extension, put_options, compression)
 
-            self.stage_name = stage_name
-            self.table_name = table_name
+            self.use_stage(name, stage_name)
 
             return put_qid
         else:
-            logger.warning("No CSV files in the local stage folder")
+            logger.warning("No jsonl stage files in the local stage folder")
             return ""
 
+    def put_files(self, stage_name: str, folder: str, files: List[str], extension: str, put_options: str, label: str) -> str:
+        """PUT the `extension` files of a local folder to a stage, record the PUT stats and return the query ID."""
+        upload_bytes = sum(os.path.getsize(f) for f in files)
+        folder = folder.replace('\\', '/')
+        put_command = f"PUT file://{folder}/*{extension} @{stage_name} {put_options};" if ' ' not in folder else f"PUT 'file://{folder}/*{extension}' @{stage_name} {put_options};"
+        start = time.perf_counter()
+        put_qid = self.execute_query(put_command)
+        elapsed = time.perf_counter() - start
+
+        self.put_stats = {
+            'files': len(files),
+            'bytes': upload_bytes,
+            'seconds': elapsed,
+            'mb_per_second': upload_bytes / elapsed / 1024 ** 2 if elapsed else 0.0
+        }
+        telemetry.event('snowflake_put', stage=stage_name, query_id=put_qid, **self.put_stats)
+        logger.info(
+            f"PUT {len(files)} files ({upload_bytes / 1024 ** 2:.1f} MB {label}) "
+            f"to {stage_name} in {elapsed:.1f}s ({self.put_stats['mb_per_second']:.2f} MB/s)"
+            )
+        return put_qid
+
+    def local_stage_parquet(self, name: str, local_stage_path: str, spec: FieldSpec, replace: bool = False) -> str:
+        """
+        Create or replace a Snowflake stage, normalize the local jsonl stage
+        files with the field spec into typed Parquet files and PUT them. 
+        Returns the put query ID.
+        """
+        name = name.upper()
+        stage_name = f'{name}_STAGE'
+        if replace:
+            stage_name += f'_{self.timestamp}'
+
+        if not has_json_files(folder_path=local_stage_path):
+            logger.warning("No jsonl stage files in the local stage folder")
+            return ""
+
+        stage_create = f"""CREATE OR REPLACE STAGE {self.snowflake_database+'.'+self.snowflake_schema+'.'+stage_name}"""
+        self.execute_query(stage_create)
+        parquet_path, files, drift = write_parquet_stage(local_stage_path, spec, compression=self.parquet_compression)
+        self.drift = drift.as_dict()
+        # Parquet pages are compressed already, PUT them as they are
+        put_options = f"PARALLEL = {self.put_parallel} SOURCE_COMPRESSION = NONE AUTO_COMPRESS = FALSE"
+        put_qid = self.put_files(stage_name, parquet_path, files, PARQUET_EXTENSION, put_options, f'{self.parquet_compression} parquet')
+        self.use_stage(name, stage_name)
+        return put_qid
+
+    def use_stage(self, name: str, stage_name: Optional[str] = None) -> None:
+        """Point the loader at the stage and tables of `name`, e.g. when the PUT was done by an earlier attempt."""
+        name = name.upper()
+        self.stage_name = stage_name or f'{name}_STAGE'
+        self.table_name = f'{name}_TABLE'
+        self.history_table_name = f'{name}_HISTORY_TABLE'
+
     def create_file_format(self) -> str:
-        """Create or replace the file format for CSV uploads and return the query ID."""
+        """Create or replace the newline delimited json file format and return the query ID."""
         file_format_handling = f'''
             CREATE OR REPLACE FILE FORMAT {self.file_format}
             TYPE=JSON
-            STRIP_OUTER_ARRAY = TRUE
             '''
         return self.execute_query(file_format_handling)
 
-    def create_or_insert(self,  select_statement: str, type: str) -> Tuple[bool, str]:
-        """Create a table in Snowflake and return the query ID and table name."""
+    def create_parquet_file_format(self) -> str:
+        """Create or replace the Parquet file format and return the query ID."""
+        file_format_handling = f'''
+            CREATE OR REPLACE FILE FORMAT {self.parquet_file_format}
+            TYPE=PARQUET
+            USE_LOGICAL_TYPE=TRUE
+            '''
+        return self.execute_query(file_format_handling)
+
+    def column_definitions(self, spec: FieldSpec, row_hash: bool = False) -> str:
+        """Return the column definitions of a table holding the fields of a spec."""
+        definitions = [f'{f.name} {SNOWFLAKE_TYPES[f.type]}' for f in spec]
+        definitions.append(f'{LOAD_TIMESTAMP} TIMESTAMP_LTZ')
+        if row_hash:
+            definitions.append(f'{ROW_HASH} STRING')
+        return ', '.join(definitions)
+
+    def copy_parquet_query(self, table: str) -> str:
+        """
+        Return the COPY of the Parquet stage into `table`, matching the file
+        columns to the table columns by name (file columns the table does not
+        have are ignored)
+        """
+        return f'''COPY INTO {table}
+        FROM @{self.stage_name}
+        FILE_FORMAT = (FORMAT_NAME = '{self.parquet_file_format}')
+        MATCH_BY_COLUMN_NAME = CASE_INSENSITIVE
+        '''
+
+    def create_or_copy(self, spec: FieldSpec) -> Tuple[bool, str]:
+        """Create the table if needed and COPY the Parquet stage into it, return the status and query ID."""
+        table = f'{self.snowflake_database}.{self.snowflake_schema}.{self.table_name}'
+        try:
+            self.execute_query(f"CREATE TABLE IF NOT EXISTS {table} ({self.column_definitions(spec)})")
+            self.add_missing_columns(self.table_name, spec)
+            return True, self.execute_query(self.copy_parquet_query(table))
+        except Exception as e:
+            logger.error(f"Error {e} has occured while copying into {self.table_name}")
+            return False, ""
+
+    def create_or_insert(self,  select_statement: str, type: str, columns: Optional[List[str]] = None) -> Tuple[bool, str]:
+        """
+        Create a table in Snowflake (or insert into it) and return the status and query ID.
+        An INSERT names `columns`, the output columns of `select_statement`, when given.
+        """
         
         if type.upper() == 'CREATE':
             action_query = f'''CREATE OR REPLACE TABLE {self.snowflake_database}.{self.snowflake_schema}.{self.table_name} AS '''
         elif type.upper() == 'INSERT':
             action_query = f'''INSERT INTO {self.snowflake_database}.{self.snowflake_schema}.{self.table_name}'''
+            if columns:
+                action_query += f" ({', '.join(columns)})"
         else:
             raise ValueError('Please enter either INSERT or CREATE for arugument type')
         
@@ -166,38 +359,223 @@ class jsonDataLoader:
             logger.error(f"Error {e} has occured while creating the table")
             return False, ""
 
+    def merge_incremental(
+            self, 
+            select_statement: str, 
+            key_columns: List[str], 
+            close_missing: bool = False, 
+            spec: Optional[FieldSpec] = None,
+            stage_format: str = 'json'
+            ) -> Tuple[bool, str]:
+        """
+        Incrementally load the stage into an SCD-2 history table.
+
+        Rows are deduplicated on `key_columns` and compared on the ROW_HASH
+        computed client side by the stage writer (`_row_hash`). Current rows 
+        whose hash changed are closed (VALID_TO, IS_CURRENT = FALSE) by a MERGE 
+        and only new or changed rows are inserted, so unchanged products 
+        write nothing. With `close_missing` products absent from the stage 
+        are closed as well. With `spec` (the spec `select_statement` was 
+        generated from, or of the Parquet files) fields missing from the 
+        history table are added to it and rows are inserted by column name. 
+        With `stage_format` 'parquet' the stage holds Parquet files which are 
+        copied by column name instead of projected with `select_statement`.
+        Returns the status and the insert query ID.
+        """
+        history = f'{self.snowflake_database}.{self.snowflake_schema}.{self.history_table_name}'
+        incoming = f'{self.history_table_name}_INCOMING'
+        keys_join = ' AND '.join(f't.{key} = s.{key}' for key in key_columns)
+        keys_not_null = ' AND '.join(f'{key} IS NOT NULL' for key in key_columns)
+
+        incoming_query = f'''CREATE OR REPLACE TEMPORARY TABLE {incoming} AS
+        WITH 
+        STAGE_READ AS 
+        (
+            SELECT t.$1 as JSON_DATA
+            FROM @{self.stage_name} (file_format => '{self.file_format}') t    
+        )
+        SELECT 
+        {select_statement.rstrip()},
+        JSON_DATA:"_row_hash"::STRING as ROW_HASH
+        FROM STAGE_READ
+        WHERE {keys_not_null}
+        QUALIFY ROW_NUMBER() OVER (PARTITION BY {', '.join(key_columns)} ORDER BY ROW_HASH) = 1
+        '''
+        incoming_queries = [incoming_query]
+        if stage_format == 'parquet':
+            raw = f'{incoming}_RAW'
+            incoming_queries = [
+                f"CREATE OR REPLACE TEMPORARY TABLE {raw} ({self.column_definitions(spec, row_hash=True)})",
+                self.copy_parquet_query(raw),
+                f'''CREATE OR REPLACE TEMPORARY TABLE {incoming} AS
+                SELECT * FROM {raw}
+                WHERE {keys_not_null}
+                QUALIFY ROW_NUMBER() OVER (PARTITION BY {', '.join(key_columns)} ORDER BY ROW_HASH) = 1
+                '''
+            ]
+        history_create = f'''CREATE TABLE IF NOT EXISTS {history} AS
+        SELECT *, CURRENT_TIMESTAMP() as VALID_FROM, NULL::TIMESTAMP_LTZ as VALID_TO, TRUE as IS_CURRENT
+        FROM {incoming} 
+        WHERE FALSE
+        '''
+        close_changed = f'''MERGE INTO {history} t
+        USING {incoming} s
+        ON {keys_join} AND t.IS_CURRENT
+        WHEN MATCHED AND t.ROW_HASH IS DISTINCT FROM s.ROW_HASH THEN 
+            UPDATE SET VALID_TO = $LOAD_TS, IS_CURRENT = FALSE
+        '''
+        close_absent = f'''UPDATE {history} t
+        SET VALID_TO = $LOAD_TS, IS_CURRENT = FALSE
+        WHERE t.IS_CURRENT 
+        AND NOT EXISTS (SELECT 1 FROM {incoming} s WHERE {keys_join})
+        '''
+        insert_columns, select_columns = '', 's.*'
+        if spec is not None:
+            columns = [f.name for f in spec] + [LOAD_TIMESTAMP, ROW_HASH]
+            insert_columns = f" ({', '.join(columns)}, VALID_FROM, VALID_TO, IS_CURRENT)"
+            select_columns = ', '.join(f's.{column}' for column in columns)
+        insert_changed = f'''INSERT INTO {history}{insert_columns}
+        SELECT {select_columns}, $LOAD_TS, NULL, TRUE
+        FROM {incoming} s
+        WHERE NOT EXISTS (SELECT 1 FROM {history} t WHERE {keys_join} AND t.IS_CURRENT)
+        '''
+
+        try:
+            # DDL commits implicitly in Snowflake so it runs before the transaction
+            for query in incoming_queries:
+                self.execute_query(query)
+            self.execute_query(history_create)
+            if spec is not None:
+                self.add_missing_columns(self.history_table_name, spec)
+            self.execute_query("BEGIN")
+            self.execute_query("SET LOAD_TS = CURRENT_TIMESTAMP()")
+            merge_qid = self.execute_query(close_changed)
+            if close_missing:
+                self.execute_query(close_absent)
+            insert_qid = self.execute_query(insert_changed)
+            self.execute_query("COMMIT")
+            logger.info(f"Incremental load of {self.history_table_name} merged {merge_qid} inserted {insert_qid}")
+            return True, insert_qid
+        except Exception as e:
+            logger.error(f"Error {e} has occured while merging into {self.history_table_name}")
+            self.execute_query("ROLLBACK")
+            return False, ""
+
     def truncate_table(self) -> str:
         """Truncate the table in Snowflake and return the query ID."""
         truncate_query = f"TRUNCATE TABLE {self.snowflake_database}.{self.snowflake_schema}.{self.table_name};"
         return self.execute_query(truncate_query)
 
-    def manage_data_loading(self,name: str,  local_stage_path: str, select_statement:str, truncate: bool = False) -> None:
+    def manage_data_loading(
+            self, 
+            name: str,  
+            local_stage_path: str, 
+            select_statement: Optional[str] = None, 
+            truncate: bool = False,
+            mode: str = 'snapshot',
+            key_columns: Optional[List[str]] = None,
+            close_missing: bool = False,
+            ledger=None,
+            stage_format: str = 'json',
+            spec: Optional[FieldSpec] = None
+            ) -> Optional[bool]:
         """
-        Manages data loading by checking if the table exists, and based on the operation type,
-        it either truncates, inserts, or creates a new table and loads data into it.
+        Manages data loading: PUTs the local stage files to a Snowflake stage,
+        then appends them to the table (creating it if needed) or merges them
+        into the SCD-2 history table. Returns True once loaded.
 
         Parameters:
-        - local_stage_path: The local directory path containing CSV files to load.
-        - col_def_str: Column definition string for creating a new table, if necessary.
-        - load_type: The type of load operation ('truncate', 'insert'). Defaults to 'insert'.
+        - name: Name of the retailer, used for the stage and the ledger steps.
+        - local_stage_path: The local directory path containing the jsonl stage files to load.
+        - select_statement: Projection of JSON_DATA into the table columns for the
+          json stage format, generated from `spec` when not given.
+        - truncate: Truncate the table before a snapshot load. Defaults to False.
+        - mode: 'snapshot' appends the full stage, 'incremental' merges it into 
+          the SCD-2 history table keyed on `key_columns`.
+        - key_columns: Columns identifying a product, required for an incremental load.
+        - close_missing: Close the current rows of products missing from the stage (incremental only).
+        - ledger: optional WorkLedger, the PUT and the table load are recorded as
+          load steps so a resumed run does not PUT or insert the same files twice.
+        - stage_format: 'json' PUTs the compressed jsonl files and projects them
+          with `select_statement`, 'parquet' normalizes them client side with
+          `spec` into typed Parquet files loaded with COPY INTO ... MATCH_BY_COLUMN_NAME.
+        - spec: FieldSpec of the retailer, its generated projection is used when
+          no `select_statement` is given and missing columns are added to an existing table.
         """
 
-        self.local_stage_sf_stage(name=name, local_stage_path=local_stage_path)
-        # self.create_file_format()
+        if mode not in ('snapshot', 'incremental'):
+            raise ValueError('Please enter either snapshot or incremental for argument mode')
+        if mode == 'incremental' and not key_columns:
+            raise ValueError('Please provide key_columns for an incremental load')
+        if stage_format not in ('json', 'parquet'):
+            raise ValueError('Please enter either json or parquet for argument stage_format')
+        if stage_format == 'parquet' and spec is None:
+            raise ValueError('Please provide spec for a parquet load')
+        if select_statement is None and spec is None:
+            raise ValueError('Please provide either select_statement or spec')
+        if stage_format == 'parquet' and not has_pyarrow():
+            logger.warning("pyarrow is not installed, falling back to the json stage format")
+            stage_format = 'json'
+        # The spec describes the loaded columns when the projection is its own
+        column_spec = spec if stage_format == 'parquet' or select_statement is None else None
+        if select_statement is None:
+            select_statement = spec.select_statement()
+
+        put_step, load_step = f'{name}.put', f'{name}.{mode}'
+        if ledger is not None and ledger.is_done('load-step', load_step):
+            logger.info(f"Skipping {load_step}, already loaded in run {ledger.run_id}")
+            return True
+
+        if ledger is not None and ledger.is_done('load-step', put_step):
+            logger.info(f"Skipping {put_step}, files already staged in run {ledger.run_id}")
+            self.use_stage(name)
+        elif stage_format == 'parquet':
+            self.local_stage_parquet(name=name, local_stage_path=local_stage_path, spec=spec)
+            if ledger is not None:
+                ledger.mark('load-step', put_step, 'done')
+        else:
+            self.local_stage_sf_stage(name=name, local_stage_path=local_stage_path)
+            if ledger is not None:
+                ledger.mark('load-step', put_step, 'done')
+
+        if stage_format == 'parquet':
+            self.create_parquet_file_format()
+        else:
+            self.create_file_format()
 
+        if mode == 'incremental':
+            status, action_id = self.merge_incremental(
+                select_statement=select_statement, 
+                key_columns=key_columns, 
+                close_missing=close_missing,
+                spec=column_spec,
+                stage_format=stage_format
+                )
+        elif stage_format == 'parquet':
+            if truncate and self.table_exists(self.table_name):
+                logger.info(f"Truncating table {self.table_name} before loading data.")
+                self.truncate_table()
+            status, action_id = self.create_or_copy(spec)
         # Check if the table exists
-        if self.table_exists(self.table_name):
+        elif self.table_exists(self.table_name):
             if truncate:
                 # Truncate the table before loading data
                 logger.info(f"Truncating table {self.table_name} before loading data.")
-                trun_qid = self.truncate_table()
+                self.truncate_table()
 
-            status, action_id = self.create_or_insert(select_statement=select_statement, type='INSERT')
+            columns = None
+            if column_spec is not None:
+                self.add_missing_columns(self.table_name, column_spec)
+                columns = [f.name for f in column_spec] + [LOAD_TIMESTAMP]
+            status, action_id = self.create_or_insert(select_statement=select_statement, type='INSERT', columns=columns)
         else:
             # Table does not exist, create it and then load data
             logger.info(f"Table {self.table_name} does not exist. Creating table and loading data.")
             status, action_id = self.create_or_insert(select_statement=select_statement, type='CREATE')
         
+        if ledger is not None:
+            ledger.mark('load-step', load_step, 'done' if status else 'failed', detail=action_id)
+
         if status:
             logger.info(f"Data load completed successfully {action_id}")
             return True
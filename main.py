@@ -1,162 +1,415 @@
 import os
+import sys
+import json
+import argparse
+import threading
 from datetime import datetime as dt
-from spinneys.spinneys_mt import main as spinneys_main
-from choithrams.choithrams_mt import main as choithrams_main
-from carrefour.carrefour_sel_mp_json import run_parallel_extraction as carrefour_main
 from utils.utils import create_directory, delete_folder_contents
 from utils.logger import setup_logging
-from utils.spaces_upload import FolderUploader
-from db.sf_json_load import jsonDataLoader as JSONDataLoader
+from utils.orchestrator import Pipeline
+from utils.adaptive_limiter import limiter_metrics
+from utils.work_ledger import WorkLedger, DEFAULT_LEDGER_PATH
+from utils.telemetry import telemetry, STAGE_SECONDS, STAGE_SUCCESS
+from utils.retailer_fields import SPINNEYS_FIELDS, CHOITHRAMS_FIELDS, CARREFOUR_FIELDS
+
+# Scrapers, the Snowflake loader and the Spaces uploader are imported (and
+# their clients built) only by the stages that use them, so a single retailer
+# run does not pay for selenium, pandas, boto3 or the Snowflake connector
 
 # Initializing helper classes and functions
 logger = setup_logging('main')
-uploader = FolderUploader('config.ini')
-
 
 # Path Dependencies
 data_stage_folder = os.path.join(os.getcwd(), 'data')
-create_directory(data_stage_folder)
 
-# CARREFOUR
-def preprocess_and_upload_carrefour(name = 'CARREFOUR'):
+# 'snapshot' appends the full catalogue to <NAME>_TABLE, 'incremental' only
+# writes new/changed rows into the SCD-2 <NAME>_HISTORY_TABLE
+load_mode = os.environ.get('LOAD_MODE', 'snapshot')
+
+# 'json' PUTs the compressed jsonl stage files for Snowflake to project with
+# the retailer's field spec, 'parquet' normalizes them with the spec into
+# typed Parquet files (PARQUET_COMPRESSION zstd or snappy) loaded by column name
+stage_format = os.environ.get('STAGE_FORMAT', 'json')
+parquet_compression = os.environ.get('PARQUET_COMPRESSION', 'zstd')
+
+# Global concurrency budget of the pipeline, each stage weighs roughly the
+# number of threads it keeps busy
+pipeline_budget = int(os.environ.get('PIPELINE_BUDGET', 16))
+
+# Upper bound on the fetch threads of the requests based scrapers, the
+# per host adaptive limiter decides how many of them are actually in flight
+max_fetch_workers = int(os.environ.get('MAX_FETCH_WORKERS', 16))
+
+CARREFOUR_CATEGORIES = [
+    'F1600000','F11600000','F1700000','F1500000','F6000000',
+    'F1610000','F1200000','NF3000000','NF2000000','F1000000'
+    ]
+
+# 'selenium' renders every category in a pool of browsers, 'hybrid' only uses
+# a browser for the bot protection cookies and fetches the category API directly
+carrefour_mode = os.environ.get('CARREFOUR_MODE', 'selenium')
+
+# Page size of the category API for the largest categories in hybrid mode,
+# e.g. CARREFOUR_PAGE_SIZES='{"F1610000": 120}', the others use 60 per page
+carrefour_page_sizes = {
+    cat: int(size) for cat, size in json.loads(os.environ.get('CARREFOUR_PAGE_SIZES', '{}')).items()
+    }
+
+# Work ledger of the run: an unfinished run younger than RESUME_MAX_AGE_HOURS
+# is resumed (RESUME=0 always starts over, RUN_ID picks a run explicitly)
+ledger_path = os.environ.get('LEDGER_PATH', DEFAULT_LEDGER_PATH)
+resume_run = os.environ.get('RESUME', '1') == '1'
+resume_max_age_hours = float(os.environ.get('RESUME_MAX_AGE_HOURS', 12))
+
+# Prometheus textfile (for the node exporter textfile collector) and json
+# report of the run's telemetry, written next to the logs by default
+metrics_textfile = os.environ.get('METRICS_TEXTFILE', os.path.join(os.getcwd(), 'scraper.prom'))
+run_report_path = os.environ.get('RUN_REPORT', os.path.join(os.getcwd(), 'run_report.json'))
+
+# Opt-in CPU/memory profiling of every pipeline stage (PROFILE=1 or --profile),
+# written to PROFILE_DIR/<run id> next to the logs. PROFILER=pyinstrument
+# replaces cProfile when pyinstrument is installed
+profile_stages = os.environ.get('PROFILE', '0') == '1'
+profiler_name = os.environ.get('PROFILER', 'cprofile')
+profile_dir = os.environ.get('PROFILE_DIR', os.path.join(os.getcwd(), 'profiles'))
+
+# Conditional request cache of catalogue pages and API responses (HTTP_CACHE=0 disables it)
+use_http_cache = os.environ.get('HTTP_CACHE', '1') == '1'
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def shared_client(name, factory):
     """
-    Function to invoke the multi-threaded scrape script and load 
-    data into Snowflake
+    Function to return the client `name` of the run, built by `factory()`
+    the first time a stage asks for it
+    """
+    with _clients_lock:
+        if name not in _clients:
+            _clients[name] = factory()
+        return _clients[name]
+
+
+def http_cache():
+    """
+    Function to return the HttpCache of the run, None when HTTP_CACHE=0
+    """
+    if not use_http_cache:
+        return None
+
+    def factory():
+        from utils.http_cache import HttpCache
+        return HttpCache(
+            max_bytes=int(os.environ.get('HTTP_CACHE_MAX_MB', 512)) * 1024 ** 2,
+            max_age_days=float(os.environ.get('HTTP_CACHE_MAX_AGE_DAYS', 7))
+            )
+    return shared_client('http_cache', factory)
+
+
+def uploader():
     """
+    Function to return the Spaces uploader of the run
+    """
+    def factory():
+        from utils.spaces_upload import FolderUploader
+        return FolderUploader('config.ini')
+    return shared_client('uploader', factory)
+
+
+def data_loader():
+    """
+    Function to create a Snowflake loader with its own session
+    """
+    from db.sf_json_load import jsonDataLoader as JSONDataLoader
+    return JSONDataLoader(parquet_compression=parquet_compression)
+
+def spinneys_scrape(local_stage, ledger=None):
+    from spinneys.spinneys_mt import main as spinneys_main
+    return spinneys_main(local_stage=local_stage, num_workers=max_fetch_workers, ledger=ledger, cache=http_cache())
+
+
+def choithrams_scrape(local_stage, ledger=None):
+    from choithrams.choithrams_mt import main as choithrams_main
+    return choithrams_main(local_stage=local_stage, num_workers=max_fetch_workers, ledger=ledger, cache=http_cache())
+
+
+def carrefour_scrape(local_stage, ledger=None):
+    """
+    Function to run the Carrefour extraction in the configured CARREFOUR_MODE
+    """
+    if carrefour_mode == 'hybrid':
+        from carrefour import carrefour_api_mt_json as api
+        from carrefour.carrefour_hybrid import run_hybrid_extraction
+        api.CATEGORY_PAGE_SIZES.update(carrefour_page_sizes)
+        return run_hybrid_extraction(categories=CARREFOUR_CATEGORIES, stage_path=local_stage, ledger=ledger, cache=http_cache())
+    elif carrefour_mode == 'selenium':
+        from carrefour.carrefour_sel_mp_json import run_parallel_extraction as carrefour_main
+        return carrefour_main(categories=CARREFOUR_CATEGORIES, stage_path=local_stage, ledger=ledger)
+    else:
+        raise ValueError("Please enter either selenium or hybrid for CARREFOUR_MODE")
 
-    categories = [
-        'F1600000','F11600000','F1700000','F1500000','F6000000',
-        'F1610000','F1200000','NF3000000','NF2000000','F1000000'
-        ]
 
-    # Initializing helper classes
+# Per retailer scrape entry point, field spec and merge keys
+RETAILERS = {
+    'SPINNEYS': {
+        'scrape': spinneys_scrape,
+        'fields': SPINNEYS_FIELDS,
+        'key_columns': ['EAN'],
+        'weight': 7
+    },
+    'CHOITHRAMS': {
+        'scrape': choithrams_scrape,
+        'fields': CHOITHRAMS_FIELDS,
+        'key_columns': ['EAN'],
+        'weight': 7
+    },
+    'CARREFOUR': {
+        'scrape': carrefour_scrape,
+        'fields': CARREFOUR_FIELDS,
+        'key_columns': ['ID'],
+        'weight': 2
+    },
+}
+
+
+def stage_folder(name):
+    """
+    Function to return (and create) the local stage folder of a retailer
+    """
     local_stage = os.path.join(data_stage_folder,f'{name}')
     create_directory(local_stage)
-    dc = JSONDataLoader()
-    
-    # Extraction and loading 
-    if carrefour_main(categories= categories, stage_path=local_stage):
-        statement = '''
-        JSON_DATA:"ean"::STRING as EAN,
-        COALESCE(JSON_DATA:"id"::STRING, JSON_DATA:"productId"::STRING) as ID,
-        JSON_DATA:"name"::STRING as NAME,
-        JSON_DATA:"type"::STRING as TYPE,
-        COALESCE(JSON_DATA:"category"[0]:"name"::STRING, JSON_DATA:"categories"[0]:"name"::STRING)  as CATEGORY_L1,
-        COALESCE(JSON_DATA:"category"[1]:"name"::STRING, JSON_DATA:"categories"[1]:"name"::STRING)  as CATEGORY_L2,
-        COALESCE(JSON_DATA:"category"[2]:"name"::STRING, JSON_DATA:"categories"[2]:"name"::STRING)  as CATEGORY_L3,
-        JSON_DATA:"brand":"id"::STRING as BRAND_ID,
-        COALESCE(JSON_DATA:"brand":"name"::STRING, JSON_DATA:"brand"::STRING)  as BRAND_NAME,
-        JSON_DATA:"foodType"::STRING as FOOD_TYPE,
-        COALESCE(JSON_DATA:"price":"price"::FLOAT, JSON_DATA:"applicablePrice"::FLOAT) as PRICE,
-        COALESCE(JSON_DATA:"price":"discount":"endDate"::STRING, JSON_DATA:"discount":"endDate"::STRING) as DISCOUNT_END_DATE,
-        COALESCE(JSON_DATA:"price":"discount":"price"::FLOAT, JSON_DATA:"discount":"price"::FLOAT) as DISCOUNT_PRICE,
-        JSON_DATA:"size"::STRING as SIZE,
-        COALESCE(JSON_DATA:"unit":"itemsPerUnit"::STRING, JSON_DATA:"itemsPerUnit"::STRING) as ITEMS_PER_UNIT,
-        COALESCE(JSON_DATA:"unit":"unitOfMeasure"::STRING, JSON_DATA:"unitOfMeasure"::STRING) as UNIT_OF_MEASURE,
-        JSON_DATA:"isMarketPlace"::STRING  as IS_MARKETPLACE,
-        JSON_DATA:"productOrigin"::STRING as PRODUCT_ORIGIN,
-        JSON_DATA:"promoBadges"[0]:"text":"boldText"::STRING as PROMO_BADGE_1,
-        JSON_DATA:"promoBadges"[1]:"text":"boldText"::STRING as PROMO_BADGE_2,
-        JSON_DATA:"promoBadges"[2]:"text":"boldText"::STRING as PROMO_BADGE_3,
-        JSON_DATA:"stock":"stockLevelStatus"::STRING as STOCK_LEVEL_STATUS,
-        JSON_DATA:"availability":"isAvailable"::STRING as IS_AVAILABLE,
-        CURRENT_TIMESTAMP() as LOAD_TIMESTAMP
-        '''
-        dc.manage_data_loading(
-        name=name, 
-        local_stage_path=local_stage,
-        select_statement=statement
-        )
-        uploader.upload_folder(local_stage, 'ecommerceScraping', f'{name}/{dt.strftime(dt.now(), "%Y%m%d")}')
-        delete_folder_contents(folder_path=local_stage)
-        logger.info(f"Extraction, Preprocessing & Upload of {name} has been completed.")
+    return local_stage
+
+
+def scrape(name, ledger=None):
+    """
+    Function to invoke the multi-threaded scrape script of a retailer
+    """
+    if RETAILERS[name]['scrape'](stage_folder(name), ledger=ledger):
         return True
-    else:
-        logger.error("Extraction Not Completed")
-        return False
-    
+    logger.error(f"Extraction of {name} Not Completed")
+    return False
 
-# SPINNEYS
-def preprocess_and_upload_spinneys(name = 'SPINNEYS'):
+
+def load(name, dc, ledger=None):
     """
-    Function to invoke the multi-threaded scrape script and load 
-    data into Snowflake
+    Function to load the stage folder of a retailer into Snowflake
     """
-    
-    # Initializing helper classes
-    local_stage = local_stage = os.path.join(data_stage_folder,f'{name}')
-    create_directory(local_stage)
-    dc = JSONDataLoader()
-
-    # Extraction and loading 
-    if spinneys_main(local_stage=local_stage, num_workers=7):
-        statement = '''
-        JSON_DATA:"id"::STRING as EAN,
-        JSON_DATA:"item_name"::STRING as NAME,
-        JSON_DATA:"item_price"::FLOAT as PRICE,
-        JSON_DATA:"item_link"::STRING as LINK,
-        JSON_DATA:"item_quantity"::STRING as QUANTITY,
-        CURRENT_TIMESTAMP() as LOAD_TIMESTAMP
-        '''
-        dc.manage_data_loading(
+    return bool(dc.manage_data_loading(
         name=name, 
-        local_stage_path=local_stage,
-        select_statement=statement
-        )
-        uploader.upload_folder(local_stage, 'ecommerceScraping', f'{name}/{dt.strftime(dt.now(), "%Y%m%d")}')
-        delete_folder_contents(folder_path=local_stage)
-        logger.info(f"Extraction, Preprocessing & Upload of {name} has been completed.")
+        local_stage_path=stage_folder(name),
+        mode=load_mode,
+        key_columns=RETAILERS[name]['key_columns'],
+        ledger=ledger,
+        stage_format=stage_format,
+        spec=RETAILERS[name]['fields']
+        ))
+
+
+def upload(name, ledger=None):
+    """
+    Function to archive the stage folder of a retailer to Spaces
+    """
+    # A resumed run keeps archiving under the date the run started
+    run_date = dt.strftime(ledger.started if ledger is not None else dt.now(), "%Y%m%d")
+    subfolder = f'{name}/{run_date}'
+    result = uploader().upload_folder(stage_folder(name), 'ecommerceScraping', subfolder)
+    if ledger is not None:
+        # Files are recorded under their Spaces key, so a file that failed
+        # once is marked done by the attempt that uploads it
+        for key in result['uploaded'] + result['skipped']:
+            ledger.mark('stage-file', key, 'done')
+        for file_path, error in result['failed'].items():
+            ledger.mark('stage-file', f'{subfolder}/{os.path.basename(file_path)}', 'failed', detail=error)
+    return not result['failed']
+
+
+def cleanup(name):
+    """
+    Function to empty the stage folder of a retailer
+    """
+    delete_folder_contents(folder_path=stage_folder(name))
+    logger.info(f"Extraction, Preprocessing & Upload of {name} has been completed.")
+    return True
+
+
+def preprocess_and_upload(name, dc = None):
+    """
+    Function to invoke the multi-threaded scrape script and load 
+    data into Snowflake, reusing the Snowflake session of `dc` if given
+    """
+    dc = dc or data_loader()
+    if scrape(name):
+        load(name, dc)
+        upload(name)
+        cleanup(name)
         return True
     else:
-        logger.error("Extraction Not Completed")
         return False
-    
+
+
+# CARREFOUR
+def preprocess_and_upload_carrefour(name = 'CARREFOUR', dc = None):
+    return preprocess_and_upload(name, dc)
+
+
+# SPINNEYS
+def preprocess_and_upload_spinneys(name = 'SPINNEYS', dc = None):
+    return preprocess_and_upload(name, dc)
+
 
 # CHOITHRAMS
-def preprocess_and_upload_choithrams(name = 'CHOITHRAMS'):
+def preprocess_and_upload_choithrams(name = 'CHOITHRAMS', dc = None):
+    return preprocess_and_upload(name, dc)
+
+
+def build_pipeline(names, loaders, budget=pipeline_budget, ledger=None, profiler=None):
     """
-    Function to invoke the multi-threaded scrape script and load 
-    data into Snowflake
+    Build the run DAG: retailers are independent of each other, and within
+    a retailer the Snowflake load and the Spaces upload of the stage folder
+    run in parallel once the scrape is done, followed by the cleanup.
+    With a ledger, stages already done by an earlier attempt of the run are skipped,
+    with a StageProfiler every stage that runs is profiled
     """
-    
-    # Initializing helper classes
-    local_stage = local_stage = os.path.join(data_stage_folder,f'{name}')
-    create_directory(local_stage)
-    dc = JSONDataLoader()
-
-    # Extraction and loading 
-    if choithrams_main(local_stage=local_stage,num_workers=7):
-        statement = '''
-        JSON_DATA:"item_id"::STRING as EAN,
-        JSON_DATA:"item_name"::STRING as NAME,
-        JSON_DATA:"price"::FLOAT as PRICE,
-        JSON_DATA:"item_category"::STRING as CATEGORY,
-        JSON_DATA:"item_brand"::STRING as BRAND,
-        JSON_DATA:"quantity"::FLOAT as QUANTITY,
-        CURRENT_TIMESTAMP() as LOAD_TIMESTAMP
-        '''
-        dc.manage_data_loading(
-        name=name, 
-        local_stage_path=local_stage,
-        select_statement=statement
+    pipeline = Pipeline(budget=budget)
+
+    def add(stage, func, depends_on=(), weight=1):
+        if profiler is not None:
+            func = profiler.wrap(stage, func)
+        if ledger is not None:
+            func = lambda stage=stage, func=func: ledger.run_step('stage', stage, func)
+        return pipeline.add(stage, func, depends_on=depends_on, weight=weight)
+
+    for name in names:
+        scraped = add(f'{name}.scrape', lambda name=name: scrape(name, ledger), weight=RETAILERS[name]['weight'])
+        loaded = add(f'{name}.load', lambda name=name: load(name, loaders[name], ledger), depends_on=[scraped])
+        uploaded = add(f'{name}.upload', lambda name=name: upload(name, ledger), depends_on=[scraped])
+        add(f'{name}.cleanup', lambda name=name: cleanup(name), depends_on=[loaded, uploaded])
+    return pipeline
+
+
+def run(names, profile=profile_stages):
+    """
+    Function to run the full pipeline of the given retailers and write the
+    run summary, telemetry and profiles. Returns True when every stage succeeded
+    """
+    ledger = WorkLedger(
+        ledger_path, 
+        run_id=os.environ.get('RUN_ID'), 
+        resume=resume_run, 
+        max_age_hours=resume_max_age_hours
         )
-        uploader.upload_folder(local_stage, 'ecommerceScraping', f'{name}/{dt.strftime(dt.now(), "%Y%m%d")}')
-        delete_folder_contents(folder_path=local_stage)
-        logger.info(f"Extraction, Preprocessing & Upload of {name} has been completed.")
-        return True
-    else:
-        logger.error("Extraction Not Completed")
-        return False
+    if ledger.attempt == 1:
+        # Fresh run, leftovers of an abandoned run must not be loaded with it
+        for name in names:
+            delete_folder_contents(folder_path=stage_folder(name))
 
+    # One Snowflake session per retailer, loads run concurrently and each
+    # keeps its own stage/transaction state
+    loaders = {name: data_loader() for name in names}
+    profiler = None
+    if profile:
+        from utils.profiling import StageProfiler
+        profiler = StageProfiler(os.path.join(profile_dir, ledger.run_id), profiler=profiler_name)
+    pipeline = build_pipeline(names, loaders, ledger=ledger, profiler=profiler)
+    try:
+        summary = pipeline.run()
+    finally:
+        for dc in loaders.values():
+            dc.close()
+        # The run stays open (and is resumed by the next run) until every
+        # retailer it was started for has been cleaned up
+        succeeded = pipeline.succeeded and all(ledger.is_done('stage', f'{name}.cleanup') for name in names)
+        ledger.finish(succeeded)
+        if 'http_cache' in _clients:
+            _clients['http_cache'].close()
+
+    summary['run_id'] = ledger.run_id
+    summary['attempt'] = ledger.attempt
+    summary['retailers'] = names
+    summary['work'] = ledger.summary()
+    if 'http_cache' in _clients:
+        summary['http_cache'] = _clients['http_cache'].stats
+    ledger.close()
+
+    for stage, details in summary['stages'].items():
+        logger.info(f"{stage}: {details['status']} in {details['seconds']}s")
+    logger.info(f"Pipeline finished in {summary['seconds']}s")
+    if profiler is not None:
+        summary['profiles'] = profiler.results
+    summary['limiters'] = limiter_metrics()
+    for host, metrics in summary['limiters'].items():
+        logger.info(f"{host}: concurrency limit {metrics['limit']}, {metrics['overloads']} overloads in {metrics['requests']} requests")
+    with open(os.path.join(os.getcwd(), 'run_summary.json'), 'w') as f:
+        json.dump(summary, f, indent=4)
+
+    for stage, details in summary['stages'].items():
+        if details['seconds'] is not None:
+            STAGE_SECONDS.set(details['seconds'], stage=stage)
+        STAGE_SUCCESS.set(int(details['status'] == 'done'), stage=stage)
+    telemetry.write_prometheus(metrics_textfile)
+    telemetry.write_report(run_report_path, run_id=summary['run_id'], attempt=summary['attempt'], seconds=summary['seconds'])
+    logger.info(f"Telemetry written to {metrics_textfile} and {run_report_path}")
+    return pipeline.succeeded
 
-if __name__ == "__main__":
-    if preprocess_and_upload_spinneys():
-        logger.info("Spinneys loaded!")
 
-    if preprocess_and_upload_choithrams():
-        logger.info("Choithrams Loaded!")
+def run_stage(command, names):
+    """
+    Function to run a single stage (scrape, load or upload) of the given
+    retailers one after the other, outside of the pipeline and the ledger
+    """
+    succeeded = True
+    for name in names:
+        if command == 'scrape':
+            succeeded &= scrape(name)
+        elif command == 'load':
+            dc = data_loader()
+            try:
+                succeeded &= load(name, dc)
+            finally:
+                dc.close()
+        elif command == 'upload':
+            succeeded &= upload(name)
+        else:
+            raise ValueError("Please enter either scrape, load or upload for argument command")
+    if 'http_cache' in _clients:
+        _clients['http_cache'].close()
+    return succeeded
+
 
-    if preprocess_and_upload_carrefour():
-        logger.info("Carrefour loaded")
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Scrape, load and archive the retailer catalogues")
+    subparsers = parser.add_subparsers(dest='command')
+    commands = {
+        'run': "scrape, load, upload and clean up (the default)",
+        'scrape': "only scrape into the local stage folder",
+        'load': "only load the local stage folder into Snowflake",
+        'upload': "only archive the local stage folder to Spaces",
+    }
+    for command, help in commands.items():
+        subparser = subparsers.add_parser(command, help=help)
+        subparser.add_argument(
+            '--retailer', action='append', choices=[name.lower() for name in RETAILERS],
+            help="retailer to process, repeat for several (default: all)"
+            )
+        if command == 'run':
+            subparser.add_argument('--profile', action='store_true', default=profile_stages, help="profile every pipeline stage")
+    args = parser.parse_args(argv)
+    # `python main.py` without a command keeps running every retailer
+    args.command = args.command or 'run'
+    args.retailer = getattr(args, 'retailer', None)
+    args.profile = getattr(args, 'profile', profile_stages)
+    return args
 
 
+def main(argv=None):
+    args = parse_args(argv)
+    names = [name.upper() for name in args.retailer] if args.retailer else list(RETAILERS)
+    if args.command == 'run':
+        return run(names, profile=args.profile)
+    return run_stage(args.command, names)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
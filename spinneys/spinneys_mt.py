@@ -1,11 +1,16 @@
 import os
 import re
 import json
-import requests
 from tqdm import tqdm
-from bs4 import BeautifulSoup
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from utils.logger import setup_logging
+from utils.http_client import HttpClient
+from utils.html_parser import make_soup
+from utils.parse_pipeline import run_pipeline
+from utils.stage_writer import JsonlStageWriter
+from utils.http_cache import cached_fetch
+from utils.telemetry import PARSE_SECONDS
+from utils.retailer_fields import SPINNEYS_FIELDS
 
 logger = setup_logging('SPINNEYS')
 
@@ -19,6 +24,19 @@ HEADERS = {
 
 }
 
+# Fields projected into Snowflake, hashed to detect changed rows
+HASH_FIELDS = SPINNEYS_FIELDS.root_keys
+
+client = HttpClient(headers=HEADERS)
+
+# Extract JSON-like part from the <script> tag
+IMPRESSIONS_PATTERN = re.compile(r"dataLayer\.push\((\{.*?\})\);", re.DOTALL)
+TRAILING_COMMA_OBJECT = re.compile(r',\s*}')
+TRAILING_COMMA_LIST = re.compile(r',\s*\]')
+
+# Bump whenever parse_page changes so pages served from the HTTP cache are re-parsed
+PARSER_VERSION = '1'
+
 def check_script(script):
     """
     Function to check the list of script tags for the relevant script
@@ -59,8 +77,8 @@ def get_final_page_number():
     """
     Function to call the base url and extract the final page number
     """
-    response = requests.get(url = BASE_URL, headers=HEADERS)
-    soup = BeautifulSoup(response.text, 'html.parser')
+    response = client.get(BASE_URL)
+    soup = make_soup(response.text, 'spinneys-pagination')
         
     page_num_tag = soup.find('div', {'class': 'page-numbers'}).find_all('a')
     page_num_tag = page_num_tag[-2].find('div', {'class': 'page-no-bx'}).text
@@ -68,51 +86,56 @@ def get_final_page_number():
 
     return final_page_number
 
-def process_page(page):
-    
-    params = {
-            'page':page
-        }
+def extract_impressions(script_string, page):
+    """
+    Function to extract the product impressions from the dataLayer.push
+    script, fixing the quotes and trailing commas of the JavaScript object.
+    Returns None when the object is not valid json
+    """
+    match = IMPRESSIONS_PATTERN.search(script_string)
+    if not match:
+        logger.error(f"Could not find the JavaScript object in the script content for page {page}")
+        return []
+
+    json_string = match.group(1)
+
+    # Replace single quotes with double quotes
+    json_string = json_string.replace("'", '"')
+
+    # Remove potential trailing commas in lists or objects
+    json_string = TRAILING_COMMA_OBJECT.sub('}', json_string)
+    json_string = TRAILING_COMMA_LIST.sub(']', json_string)
 
+    # Parse JSON
+    try:
+        data = json.loads(json_string)
+        return data['ecommerce']['impressions']
+    except json.JSONDecodeError as e:
+        logger.error(f"Error parsing JSON: {e} for page: {page}")
+        error_position = e.pos  # Using the exception's position attribute if available
+        snippet = print_near_error(json_string, error_position)
+        logger.error(f"Section of the JSON with issues \n {snippet}")
+        return None
+
+def parse_page(html, page, backend=None):
+    """
+    Function to extract the items from the html of a given catalogue page
+    """
     items = []
     item_ids = []
 
-    ## Step 1: Call URL with necessary headers
-    response = requests.get(url = BASE_URL, headers=HEADERS, params=params )
-
     ## Step 2: Part the response into a soup object
-    soup = BeautifulSoup(response.text, 'html.parser')
+    if isinstance(html, bytes):
+        html = html.decode('utf-8', errors='replace')
+    soup = make_soup(html, 'spinneys', backend=backend)
 
     ## Step 3.1: Extracting the Barcodes stores in the script tag
     script = soup.find_all('script')
     script_string = list(filter(lambda x: check_script(x), script))[0].text
     
-    # Extract JSON-like part from the <script> tag
-    pattern = r"dataLayer\.push\((\{.*?\})\);"
-    match = re.search(pattern, script_string, re.DOTALL)
-
-    if match:
-        json_string = match.group(1)
-
-        # Replace single quotes with double quotes
-        json_string = json_string.replace("'", '"')
-
-        # Remove potential trailing commas in lists or objects
-        json_string = re.sub(r',\s*}', '}', json_string)
-        json_string = re.sub(r',\s*\]', ']', json_string)
-
-        # Parse JSON
-        try:
-            data = json.loads(json_string)
-            item_ids = data['ecommerce']['impressions']
-        except json.JSONDecodeError as e:
-            logger.error(f"Error parsing JSON: {e} for page: {page}")
-            error_position = e.pos  # Using the exception's position attribute if available
-            snippet = print_near_error(json_string, error_position)
-            logger.error(f"Section of the JSON with issues \n {snippet}")
-            return items
-    else:
-        logger.error(f"Could not find the JavaScript object in the script content for page {page}")
+    item_ids = extract_impressions(script_string, page)
+    if item_ids is None:
+        return items
 
     ## Step 3.2: Extracting products from the grid
     grid = soup.find('div', {'class': 'arc-grid'}).find_all('div', {'class': 'js-product-wrapper product-bx'})
@@ -123,21 +146,76 @@ def process_page(page):
     items = [{**x, **y} for x, y in zip(item_ids, items[0])]
 
     return items
+
+def fetch_page(page):
+    """
+    Function to fetch the raw html of a given catalogue page
+    """
+    params = {
+            'page':page
+        }
+
+    ## Step 1: Call URL with necessary headers
+    response = client.get(BASE_URL, params=params)
+
+    return response.content
+
+def process_page(page, cache=None):
+    """
+    Function to fetch and parse a given catalogue page, reusing the items
+    of the previous run when the cached page was not modified
+    """
+    def extract(content):
+        with PARSE_SECONDS.time(retailer='spinneys'):
+            return parse_page(content, page)
+
+    items, _ = cached_fetch(
+        client, cache, BASE_URL, 
+        extract, 
+        params={'page': page}, 
+        version=PARSER_VERSION
+        )
+    return items
     
-def main(local_stage, num_workers=5):
-    all_items = []
+def main(local_stage, num_workers=5, mode='thread', concurrency=32, parse_workers=None, ledger=None, cache=None):
+    """
+    Scrape the full catalogue and stream it into jsonl stage files.
+    `mode='thread'` fetches pages on a pool of `num_workers` threads,
+    `mode='async'` keeps up to `concurrency` requests in flight on a single
+    asyncio event loop and `mode='process'` fetches on `num_workers` threads
+    while parsing on a pool of `parse_workers` processes.
+    With a WorkLedger the pages already staged by an interrupted run are skipped,
+    with an HttpCache (thread mode) pages are requested conditionally
+    """
+    client.configure(pool_size=num_workers)
     final_page_number = get_final_page_number() 
+    pages = range(1, final_page_number + 1)
+    if ledger is not None:
+        pages = ledger.remaining('spinneys-page', pages)
     
-    with ThreadPoolExecutor(max_workers=num_workers) as executor:
-            future_to_page = {executor.submit(process_page, page): page for page in range(1, final_page_number + 1)}
-            for future in tqdm(as_completed(future_to_page), total=len(future_to_page)):
-                page_results = future.result()
-                all_items.extend(page_results)
-
-    if all_items:
-        logger.info(f"Total Items Scraped {len(all_items)}")
-        with open(os.path.join(local_stage,'spinneys.json'), 'w') as f:
-            json.dump(all_items, f)
+    with JsonlStageWriter(local_stage, 'spinneys', hash_fields=HASH_FIELDS) as writer:
+
+        def stage_page(items, page):
+            writer.write(items)
+            if ledger is not None:
+                ledger.mark('spinneys-page', page, 'done')
+
+        if mode == 'async':
+            # aiohttp is only imported by the runs that use it
+            from utils.async_crawler import crawl_pages
+            crawl_pages(BASE_URL, pages, HEADERS, parse_page, concurrency=concurrency, on_page=stage_page)
+        elif mode == 'process':
+            run_pipeline(fetch_page, parse_page, pages, fetch_workers=num_workers, parse_workers=parse_workers, on_page=stage_page)
+        elif mode == 'thread':
+            with ThreadPoolExecutor(max_workers=num_workers) as executor:
+                    future_to_page = {executor.submit(process_page, page, cache): page for page in pages}
+                    for future in tqdm(as_completed(future_to_page), total=len(future_to_page)):
+                        stage_page(future.result(), future_to_page[future])
+        else:
+            raise ValueError("Please enter either thread, async or process for argument mode")
+
+    if writer.items_written or (ledger is not None and not pages):
+        logger.info(f"Total Items Scraped {writer.items_written}")
         return True
     else:
         return False
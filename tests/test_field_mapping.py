@@ -0,0 +1,224 @@
+import os
+import re
+import json
+import math
+import pytest
+import pandas as pd
+
+from utils.field_mapping import PARSERS, QUANTITY_PATTERN, DriftReport, FieldSpec, cast, field
+from utils.retailer_fields import CARREFOUR_FIELDS, SPINNEYS_FIELDS, CHOITHRAMS_FIELDS
+from spinneys.spinneys_mt import parse_page as spinneys_parse_page
+from choithrams.choithrams_mt import parse_page as choithrams_parse_page
+
+PAGES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bench', 'pages')
+
+
+def read_page(name):
+    with open(os.path.join(PAGES_DIR, name), 'rb') as f:
+        return f.read()
+
+
+def page_items(retailer):
+    if retailer == 'spinneys':
+        return spinneys_parse_page(read_page('spinneys_page.html'), 1)
+    if retailer == 'choithrams':
+        return choithrams_parse_page(read_page('choithrams_page.html'), 1)
+    return json.loads(read_page('carrefour_api_page.json'))['products']
+
+
+def values(series):
+    # NaN and None compare equal as "no value"
+    return [None if value is None or (isinstance(value, float) and math.isnan(value)) else value for value in series]
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('AED 12.50', 12.5),
+    ('AED 1,299.50', 1299.5),
+    (42, 42.0),
+    ('Price on request', None),
+])
+def test_parse_price(text, expected):
+    assert values(PARSERS['price']['parse'](pd.Series([text], dtype=object))) == [expected]
+
+
+@pytest.mark.parametrize('text, value, unit, pack_count', [
+    ('500 g', 500.0, 'g', 1.0),
+    ('1.5L', 1.5, 'l', 1.0),
+    ('6 x 330 ml', 330.0, 'ml', 6.0),
+    ('12X1 KG', 1.0, 'kg', 12.0),
+    ('each', None, None, None),
+    (None, None, None, None),
+])
+def test_parse_quantity(text, value, unit, pack_count):
+    raw = pd.Series([text], dtype=object)
+    assert values(PARSERS['quantity_value']['parse'](raw)) == [value]
+    assert values(PARSERS['quantity_unit']['parse'](raw)) == [unit]
+    assert values(PARSERS['pack_count']['parse'](raw)) == [pack_count]
+
+
+@pytest.mark.parametrize('parse', ['quantity_value', 'quantity_unit'])
+@pytest.mark.parametrize('text', ['500 g', '1.5L', '6 x 330 ml', '12X1 KG'])
+def test_quantity_sql_reads_the_same_group(parse, text):
+    # The Snowflake projection extracts a group of QUANTITY_PATTERN by number
+    group = int(re.search(r"'e', ([0-9]+)\)", PARSERS[parse]['sql']).group(1))
+    expected = re.search(QUANTITY_PATTERN, text).group(group)
+    if parse == 'quantity_value':
+        expected = float(expected)
+    else:
+        expected = expected.lower()
+    assert values(PARSERS[parse]['parse'](pd.Series([text], dtype=object))) == [expected]
+
+
+def test_cast_string():
+    raw = pd.Series(['a', 1, 2.5, True, {'id': 1}, ['x'], None], dtype=object)
+    assert values(cast(raw, 'string')) == ['a', '1', '2.5', 'true', '{"id":1}', '["x"]', None]
+
+
+def test_cast_numbers_to_string():
+    assert values(cast(pd.Series([1, 2, None], dtype=object), 'string')) == ['1', '2', None]
+
+
+def test_cast_float():
+    raw = pd.Series(['1.5', 2, 'n/a', None], dtype=object)
+    assert values(cast(raw, 'float')) == [1.5, 2.0, None, None]
+
+
+def test_cast_boolean():
+    raw = pd.Series([True, 'false', 'TRUE', 'maybe', None], dtype=object)
+    assert values(cast(raw, 'boolean')) == [True, False, True, None, None]
+
+
+def test_field_rejects_a_parser_of_another_type():
+    with pytest.raises(ValueError):
+        field('PRICE', 'string', 'price', parse='price')
+    with pytest.raises(ValueError):
+        field('PRICE', 'decimal', 'price')
+
+
+def test_spinneys_page():
+    items = page_items('spinneys')
+    drift = DriftReport(SPINNEYS_FIELDS)
+    df = SPINNEYS_FIELDS.normalize(items, drift)
+
+    assert list(df.columns) == [f.name for f in SPINNEYS_FIELDS]
+    assert len(df) == len(items) == 24
+    for column in ('PRICE', 'QUANTITY_VALUE', 'PACK_COUNT'):
+        assert df[column].dtype == 'float64'
+    first = df.iloc[0]
+    assert first['EAN'] == '6200000000000'
+    assert first['PRICE'] == 42.19
+    assert (first['QUANTITY'], first['QUANTITY_VALUE'], first['QUANTITY_UNIT'], first['PACK_COUNT']) == ('1 kg', 1.0, 'kg', 1.0)
+    pack = df[df['QUANTITY'] == '6 x 200 ml'].iloc[0]
+    assert (pack['QUANTITY_VALUE'], pack['QUANTITY_UNIT'], pack['PACK_COUNT']) == (200.0, 'ml', 6.0)
+    assert drift.as_dict() == {'rows': 24, 'missing': [], 'invalid': {}, 'invalid_samples': {}, 'unknown': {}}
+
+
+def test_choithrams_page():
+    items = page_items('choithrams')
+    drift = DriftReport(CHOITHRAMS_FIELDS)
+    df = CHOITHRAMS_FIELDS.normalize(items, drift)
+
+    assert len(df) == len(items) == 48
+    assert df['PRICE'].dtype == 'float64'
+    assert df['QUANTITY'].dtype == 'float64'
+    assert df.iloc[0].to_dict() == {
+        'EAN': '0', 'NAME': 'Organic Bananas & Apples 0', 'PRICE': 0.25,
+        'CATEGORY': 'Fruits > Fresh', 'BRAND': 'Brand 0', 'QUANTITY': 1.0,
+    }
+    assert drift.as_dict() == {'rows': 48, 'missing': [], 'invalid': {}, 'invalid_samples': {}, 'unknown': {}}
+
+
+def test_carrefour_page():
+    items = page_items('carrefour')
+    drift = DriftReport(CARREFOUR_FIELDS)
+    df = CARREFOUR_FIELDS.normalize(items, drift)
+
+    assert len(df) == len(items) == 60
+    first = df.iloc[0]
+    assert first['ID'] == '100000'
+    assert (first['CATEGORY_L1'], first['CATEGORY_L2'], first['CATEGORY_L3']) == ('Fresh Food', 'Dairy & Eggs', 'Milk & Laban')
+    assert (first['BRAND_ID'], first['BRAND_NAME']) == ('B0', 'Brand 0')
+    assert (first['PRICE'], first['DISCOUNT_PRICE']) == (19.26, 76.21)
+    assert first['ITEMS_PER_UNIT'] == '1'
+    # The recorded page has no marketplace, origin, promo badge or availability data
+    report = drift.as_dict()
+    assert report['missing'] == [
+        'IS_MARKETPLACE', 'PRODUCT_ORIGIN', 'PROMO_BADGE_1', 'PROMO_BADGE_2', 'PROMO_BADGE_3', 'IS_AVAILABLE'
+    ]
+    assert report['invalid'] == {}
+    assert report['unknown'] == {}
+
+
+def test_drift_of_a_closed_spec():
+    items = page_items('spinneys')
+    items[0] = dict(items[0], item_price='Price on request', badge='new')
+    items[1] = dict(items[1], badge='new')
+    drift = DriftReport(SPINNEYS_FIELDS)
+    df = SPINNEYS_FIELDS.normalize(items, drift)
+
+    assert values(df['PRICE'])[0] is None
+    assert drift.invalid == {'PRICE': 1}
+    assert drift.samples == {'PRICE': 'Price on request'}
+    assert drift.unknown == {'badge': 2}
+
+
+def test_drift_accumulates_over_batches():
+    items = page_items('choithrams')
+    drift = DriftReport(CHOITHRAMS_FIELDS)
+    CHOITHRAMS_FIELDS.normalize(items[:10], drift)
+    CHOITHRAMS_FIELDS.normalize([dict(item, price='n/a') for item in items[10:]], drift)
+    assert drift.rows == 48
+    assert drift.invalid == {'PRICE': 38}
+
+
+def test_open_spec_reports_missing_fields_only():
+    spec = FieldSpec('OPEN', [field('EAN', 'string', 'id'), field('COLOUR', 'string', 'colour')])
+    drift = DriftReport(spec)
+    spec.normalize(page_items('spinneys'), drift)
+    assert drift.missing() == ['COLOUR']
+    assert drift.unknown == {}
+
+
+def test_select_statement_matches_the_spec():
+    statement = CARREFOUR_FIELDS.select_statement()
+    names = re.findall(r' as (\w+)', statement)
+    assert names == [f.name for f in CARREFOUR_FIELDS] + ['LOAD_TIMESTAMP']
+    assert 'JSON_DATA:"ean"::STRING as EAN' in statement
+    assert 'COALESCE(JSON_DATA:"category"[0]:"name"::STRING, JSON_DATA:"categories"[0]:"name"::STRING) as CATEGORY_L1' in statement
+    assert 'COALESCE(JSON_DATA:"price":"price"::FLOAT, JSON_DATA:"applicablePrice"::FLOAT) as PRICE' in statement
+
+
+def test_select_statement_of_parsed_fields():
+    statement = SPINNEYS_FIELDS.select_statement()
+    text = 'JSON_DATA:"item_quantity"::STRING'
+    for name in ('QUANTITY_VALUE', 'QUANTITY_UNIT', 'PACK_COUNT'):
+        parse = next(f.parse for f in SPINNEYS_FIELDS if f.name == name)
+        assert f"{PARSERS[parse]['sql'].format(text=text)} as {name}" in statement
+    assert f"""{PARSERS['price']['sql'].format(text='JSON_DATA:"item_price"::STRING')} as PRICE""" in statement
+
+
+def test_spinneys_table_gains_the_quantity_columns(monkeypatch):
+    pytest.importorskip('snowflake.connector')
+    from db.sf_json_load import jsonDataLoader
+
+    loader = jsonDataLoader.__new__(jsonDataLoader)
+    loader.snowflake_database, loader.snowflake_schema = 'ECOM', 'RAW'
+    queries = []
+    monkeypatch.setattr(loader, 'table_columns', lambda table_name: ['EAN', 'NAME', 'PRICE', 'LINK', 'QUANTITY', 'LOAD_TIMESTAMP'])
+    monkeypatch.setattr(loader, 'execute_query', queries.append)
+
+    assert loader.add_missing_columns('SPINNEYS', SPINNEYS_FIELDS) == ['QUANTITY_VALUE', 'QUANTITY_UNIT', 'PACK_COUNT']
+    assert queries == [
+        'ALTER TABLE ECOM.RAW.SPINNEYS ADD COLUMN IF NOT EXISTS QUANTITY_VALUE FLOAT, QUANTITY_UNIT STRING, PACK_COUNT FLOAT'
+    ]
+
+    queries.clear()
+    monkeypatch.setattr(loader, 'table_columns', lambda table_name: [f.name for f in SPINNEYS_FIELDS])
+    assert loader.add_missing_columns('SPINNEYS', SPINNEYS_FIELDS) == []
+    assert queries == []
+
+
+def test_root_keys_keep_the_field_order():
+    # The scrapers hash these keys in this order, reordering them changes every row hash
+    assert SPINNEYS_FIELDS.root_keys == ['id', 'item_name', 'item_price', 'item_link', 'item_quantity']
+    assert CHOITHRAMS_FIELDS.root_keys == ['item_id', 'item_name', 'price', 'item_category', 'item_brand', 'quantity']
@@ -0,0 +1,58 @@
+import os
+import glob
+import pytest
+
+from utils.html_parser import BACKENDS, LXML_AVAILABLE, compare_backends
+from spinneys.spinneys_mt import parse_page as spinneys_parse_page
+from choithrams.choithrams_mt import parse_page as choithrams_parse_page
+from carrefour.carrefour_sel_mp_json import CarrefourCatExtractor
+
+PAGES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bench', 'pages')
+
+
+def carrefour_parse_page(html, page, backend=None):
+    # The products of the first page are embedded in the category page, no browser is needed
+    extractor = CarrefourCatExtractor('F21630500', PAGES_DIR, driver=object())
+    return extractor.first_load(html, backend=backend)
+
+
+PARSERS = {
+    'spinneys': spinneys_parse_page,
+    'choithrams': choithrams_parse_page,
+    'carrefour': carrefour_parse_page,
+}
+
+CASES = [
+    (retailer, path)
+    for retailer in PARSERS
+    for path in sorted(glob.glob(os.path.join(PAGES_DIR, f'{retailer}*.html')))
+]
+
+
+def read_page(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_every_retailer_has_a_page():
+    assert {retailer for retailer, _ in CASES} == set(PARSERS)
+
+
+@pytest.mark.parametrize('retailer, path', CASES, ids=[os.path.basename(path) for _, path in CASES])
+@pytest.mark.parametrize('backend', [
+    backend if backend != 'lxml' else pytest.param(
+        backend, marks=pytest.mark.skipif(not LXML_AVAILABLE, reason="lxml is not installed")
+        )
+    for backend in BACKENDS
+])
+def test_backend_matches_html_parser(retailer, path, backend):
+    parse_page = PARSERS[retailer]
+    html = read_page(path)
+    reference = parse_page(html, 1, backend='html.parser')
+    assert reference, f"{path} gives no items with html.parser"
+    assert parse_page(html, 1, backend=backend) == reference
+
+
+@pytest.mark.parametrize('retailer, path', CASES, ids=[os.path.basename(path) for _, path in CASES])
+def test_compare_backends_reports_no_mismatch(retailer, path):
+    assert compare_backends(PARSERS[retailer], read_page(path)) == {}
@@ -0,0 +1,78 @@
+import json
+import pytest
+import requests
+
+from bench.fixtures import FixtureStore
+from bench.replay_server import ReplayServer
+from utils.http_cache import HttpCache, cached_fetch
+
+HOST = 'www.choithrams.com'
+LAST_MODIFIED = 'Wed, 01 May 2024 08:00:00 GMT'
+
+
+class RecordedResponse:
+    def __init__(self, body, headers):
+        self.status_code = 200
+        self.content = body
+        self.headers = headers
+
+
+@pytest.fixture
+def server(tmp_path):
+    store = FixtureStore(str(tmp_path / 'fixtures'))
+    # One page recorded without validators, one with the site's ETag and Last-Modified
+    store.save(f'https://{HOST}/en/catalogue/?page=1', RecordedResponse(b'{"page": 1}', {'Content-Type': 'application/json'}))
+    store.save(f'https://{HOST}/en/catalogue/?page=2', RecordedResponse(
+        b'{"page": 2}', {'Content-Type': 'application/json', 'ETag': '"page-2"', 'Last-Modified': LAST_MODIFIED}
+        ))
+    with ReplayServer(str(tmp_path / 'fixtures')) as server:
+        yield server
+
+
+def url(server):
+    return f'{server.address}/{HOST}/en/catalogue/'
+
+
+def test_recorded_etag_is_honoured(server):
+    response = requests.get(url(server), params={'page': 2})
+    assert response.status_code == 200
+    assert response.headers['ETag'] == '"page-2"'
+
+    response = requests.get(url(server), params={'page': 2}, headers={'If-None-Match': '"page-2"'})
+    assert response.status_code == 304
+    assert response.content == b''
+    assert response.headers['ETag'] == '"page-2"'
+
+    response = requests.get(url(server), params={'page': 2}, headers={'If-None-Match': '"older"'})
+    assert response.status_code == 200
+    assert server.stats['not_modified'] == 1
+
+
+def test_if_modified_since(server):
+    response = requests.get(url(server), params={'page': 2}, headers={'If-Modified-Since': LAST_MODIFIED})
+    assert response.status_code == 304
+    response = requests.get(url(server), params={'page': 2}, headers={'If-Modified-Since': 'Tue, 30 Apr 2024 08:00:00 GMT'})
+    assert response.status_code == 200
+
+
+def test_body_etag_when_none_was_recorded(server):
+    first = requests.get(url(server), params={'page': 1})
+    assert first.headers['ETag']
+    second = requests.get(url(server), params={'page': 1}, headers={'If-None-Match': first.headers['ETag']})
+    assert second.status_code == 304
+
+
+def test_cached_fetch_hits_on_the_second_run(server, tmp_path):
+    with requests.Session() as client:
+        for run in range(2):
+            with HttpCache(str(tmp_path / 'http_cache.db')) as cache:
+                for page in (1, 2):
+                    items, _ = cached_fetch(client, cache, url(server), json.loads, params={'page': page})
+                    assert items == {'page': page}
+                stats = dict(cache.stats)
+            if run == 0:
+                assert (stats['hits'], stats['misses'], stats['stored']) == (0, 2, 2)
+            else:
+                assert (stats['hits'], stats['misses']) == (2, 0)
+                assert stats['bytes_saved'] == len(b'{"page": 1}') + len(b'{"page": 2}')
+    assert server.stats['not_modified'] == 2
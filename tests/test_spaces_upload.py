@@ -0,0 +1,95 @@
+import os
+import boto3
+import pytest
+from moto import mock_aws
+
+from utils.spaces_upload import FolderUploader, local_etag, MB
+
+BUCKET = 'ecommerce-scraping-test'
+PART_SIZE = 5 * MB  # smallest part S3 accepts
+
+
+@pytest.fixture
+def s3_client(monkeypatch):
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    with mock_aws():
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+@pytest.fixture
+def uploader(s3_client):
+    return FolderUploader(
+        'config.ini', s3_client=s3_client,
+        multipart_threshold=PART_SIZE, multipart_chunksize=PART_SIZE
+        )
+
+
+@pytest.fixture
+def stage(tmp_path):
+    (tmp_path / 'spinneys_0000.jsonl').write_bytes(b'{"id": "1"}\n' * 100)
+    (tmp_path / 'spinneys_0001.jsonl').write_bytes(b'{"id": "2"}\n' * 200)
+    # Larger than the multipart threshold, uploaded in 3 parts
+    (tmp_path / 'spinneys_large.jsonl').write_bytes(os.urandom(2 * PART_SIZE + MB))
+    # Sub folders (compressed/, parquet/) are not archived
+    (tmp_path / 'compressed').mkdir()
+    (tmp_path / 'compressed' / 'spinneys_0000.jsonl.gz').write_bytes(b'gz')
+    return tmp_path
+
+
+def test_first_upload(uploader, s3_client, stage):
+    result = uploader.upload_folder(stage, BUCKET, 'SPINNEYS/20240501')
+
+    assert set(result) == {'uploaded', 'skipped', 'failed', 'bytes', 'seconds'}
+    assert sorted(result['uploaded']) == [
+        'SPINNEYS/20240501/spinneys_0000.jsonl',
+        'SPINNEYS/20240501/spinneys_0001.jsonl',
+        'SPINNEYS/20240501/spinneys_large.jsonl',
+    ]
+    assert result['skipped'] == []
+    assert result['failed'] == {}
+    assert result['bytes'] == sum(path.stat().st_size for path in stage.iterdir() if path.is_file())
+    assert result['seconds'] > 0
+
+    listed = s3_client.list_objects_v2(Bucket=BUCKET, Prefix='SPINNEYS/20240501/')
+    assert sorted(item['Key'] for item in listed['Contents']) == sorted(result['uploaded'])
+
+
+def test_multipart_etag_matches_local_etag(uploader, s3_client, stage):
+    uploader.upload_folder(stage, BUCKET, 'SPINNEYS/20240501')
+
+    remote = s3_client.head_object(Bucket=BUCKET, Key='SPINNEYS/20240501/spinneys_large.jsonl')
+    assert remote['ETag'].endswith('-3"')
+    assert remote['ETag'] == local_etag(stage / 'spinneys_large.jsonl', PART_SIZE, PART_SIZE)
+
+
+def test_second_run_skips_unchanged_files(uploader, stage):
+    uploader.upload_folder(stage, BUCKET, 'SPINNEYS/20240501')
+    (stage / 'spinneys_0001.jsonl').write_bytes(b'{"id": "3"}\n' * 200)
+
+    result = uploader.upload_folder(stage, BUCKET, 'SPINNEYS/20240501')
+
+    assert result['uploaded'] == ['SPINNEYS/20240501/spinneys_0001.jsonl']
+    assert sorted(result['skipped']) == [
+        'SPINNEYS/20240501/spinneys_0000.jsonl',
+        'SPINNEYS/20240501/spinneys_large.jsonl',
+    ]
+    assert result['bytes'] == (stage / 'spinneys_0001.jsonl').stat().st_size
+
+
+def test_skip_unchanged_disabled_uploads_again(uploader, stage):
+    uploader.upload_folder(stage, BUCKET, 'SPINNEYS/20240501')
+
+    result = uploader.upload_folder(stage, BUCKET, 'SPINNEYS/20240501', skip_unchanged=False)
+
+    assert len(result['uploaded']) == 3
+    assert result['skipped'] == []
+
+
+def test_failed_uploads_are_reported(uploader, stage):
+    result = uploader.upload_folder(stage, 'missing-bucket', 'SPINNEYS/20240501')
+
+    assert result['uploaded'] == []
+    assert sorted(result['failed']) == sorted(str(path) for path in stage.iterdir() if path.is_file())
@@ -0,0 +1,48 @@
+import os
+import json
+
+from utils.stage_writer import JsonlStageWriter, truncate_partial_line
+
+
+def read_lines(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+
+def test_truncate_partial_line(tmp_path):
+    path = tmp_path / 'spinneys_0000.jsonl'
+    path.write_bytes(b'{"id": 1}\n{"id": 2}\n{"id": 3, "na')
+    assert truncate_partial_line(str(path)) == len(b'{"id": 3, "na')
+    assert path.read_bytes() == b'{"id": 1}\n{"id": 2}\n'
+    assert truncate_partial_line(str(path)) == 0
+
+
+def test_truncate_partial_line_across_blocks(tmp_path):
+    path = tmp_path / 'spinneys_0000.jsonl'
+    path.write_bytes(b'{"id": 1}\n' + b'x' * 100)
+    assert truncate_partial_line(str(path), block_size=16) == 100
+    assert path.read_bytes() == b'{"id": 1}\n'
+
+    path.write_bytes(b'x' * 100)
+    assert truncate_partial_line(str(path), block_size=16) == 100
+    assert path.read_bytes() == b''
+
+
+def test_resumed_writer_repairs_its_files(tmp_path):
+    with JsonlStageWriter(str(tmp_path), 'spinneys') as writer:
+        writer.write([{'id': 1}, {'id': 2}])
+    interrupted = writer.files[0]
+    with open(interrupted, 'ab') as f:
+        f.write(b'{"id": 3, "item_na')
+    # Another writer's file in the same folder is left alone
+    other = tmp_path / 'choithrams_0000.jsonl'
+    other.write_bytes(b'{"item_id": 1')
+
+    with JsonlStageWriter(str(tmp_path), 'spinneys') as writer:
+        writer.write([{'id': 3}])
+
+    assert read_lines(interrupted) == [{'id': 1}, {'id': 2}]
+    assert writer.files[0] != interrupted
+    assert read_lines(writer.files[0]) == [{'id': 3}]
+    assert other.read_bytes() == b'{"item_id": 1'
+    assert sorted(os.listdir(tmp_path)) == ['choithrams_0000.jsonl', 'spinneys_0000.jsonl', 'spinneys_0001.jsonl']
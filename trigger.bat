@@ -1,4 +1,4 @@
 @echo off
 cd /d "c:\Users\Sachin.bm\Documents\Data Loaders\Ecommerce-Scraper"
-"c:\Users\Sachin.bm\Documents\Data Loaders\Ecommerce-Scraper\venv\Scripts\python.exe" "c:\Users\Sachin.bm\Documents\Data Loaders\Ecommerce-Scraper\main.py"
-exit 0
\ No newline at end of file
+"c:\Users\Sachin.bm\Documents\Data Loaders\Ecommerce-Scraper\venv\Scripts\python.exe" "c:\Users\Sachin.bm\Documents\Data Loaders\Ecommerce-Scraper\main.py" %*
+exit /b %ERRORLEVEL%
\ No newline at end of file
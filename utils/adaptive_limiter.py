@@ -0,0 +1,155 @@
+import time
+import asyncio
+import threading
+from collections import deque
+from .logger import setup_logging
+
+logger = setup_logging(__name__)
+
+# Responses telling us the site wants us to slow down
+OVERLOAD_STATUS_CODES = (429, 503)
+
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limit for one host.
+
+    The limit grows by one request per window of `limit` healthy responses
+    while the workers keep it saturated, and is multiplied by `decrease` on a
+    429/503 (including ones urllib3 retried internally), a failed request or
+    a response slower than `latency_tolerance` times the baseline latency
+    (responses under `latency_floor` seconds never count as slow).
+    Decreases are spaced by at least one smoothed latency so a burst of
+    failures from the same window only counts once.
+    """
+    def __init__(self, host, initial=4, min_limit=1, max_limit=64, decrease=0.5,
+                 latency_tolerance=3.0, latency_floor=0.5, baseline_decay=0.01, history=50):
+        self.host = host
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease = decrease
+        self.latency_tolerance = latency_tolerance
+        self.latency_floor = latency_floor
+        self.baseline_decay = baseline_decay
+        self.in_flight = 0
+        self.requests = 0
+        self.overloads = 0
+        self.latency_ewma = None
+        self.latency_baseline = None
+        self.decisions = deque(maxlen=history)
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    @property
+    def current_limit(self):
+        return max(self.min_limit, int(self.limit))
+
+    def try_acquire(self):
+        """Take a slot if one is free, without blocking."""
+        with self._cond:
+            if self.in_flight < self.current_limit:
+                self.in_flight += 1
+                return True
+            return False
+
+    def acquire(self):
+        """Block until a slot is free and take it."""
+        with self._cond:
+            while self.in_flight >= self.current_limit:
+                self._cond.wait()
+            self.in_flight += 1
+
+    async def acquire_async(self, poll_interval=0.01):
+        """Wait for a free slot without blocking the event loop."""
+        while not self.try_acquire():
+            await asyncio.sleep(poll_interval)
+
+    def release(self, latency, status=None, retried_statuses=()):
+        """
+        Give the slot back and adjust the limit from the outcome of the
+        request. `status` is None when the request raised.
+        """
+        with self._cond:
+            self.in_flight -= 1
+            self.requests += 1
+            saturated = self.in_flight + 1 >= self.current_limit
+
+            reason = None
+            if status is None:
+                reason = 'error'
+            elif status in OVERLOAD_STATUS_CODES or any(s in OVERLOAD_STATUS_CODES for s in retried_statuses):
+                reason = f'status {status}' if status in OVERLOAD_STATUS_CODES else 'retried'
+            else:
+                self._observe_latency(latency)
+                if latency > max(self.latency_floor, self.latency_tolerance * self.latency_baseline):
+                    reason = f'latency {latency:.2f}s'
+
+            if reason is not None:
+                self.overloads += 1
+                now = time.monotonic()
+                if now - self._last_decrease >= (self.latency_ewma or 0):
+                    self._last_decrease = now
+                    self._set_limit(self.limit * self.decrease, 'decrease', reason)
+            elif saturated and self.limit < self.max_limit:
+                self._set_limit(self.limit + 1 / self.current_limit, 'increase', 'healthy')
+
+            self._cond.notify_all()
+
+    def _observe_latency(self, latency):
+        if self.latency_ewma is None:
+            self.latency_ewma = self.latency_baseline = latency
+            return
+        self.latency_ewma = 0.8 * self.latency_ewma + 0.2 * latency
+        # The baseline follows the fastest responses and slowly drifts up so
+        # a permanently slower site does not keep the limit pinned down
+        self.latency_baseline = min(latency, self.latency_baseline * (1 + self.baseline_decay))
+
+    def _set_limit(self, limit, action, reason):
+        before = self.current_limit
+        self.limit = min(float(self.max_limit), max(float(self.min_limit), limit))
+        if self.current_limit != before:
+            self.decisions.append({
+                'time': time.time(),
+                'action': action,
+                'reason': reason,
+                'limit': self.current_limit,
+            })
+            log = logger.warning if action == 'decrease' else logger.info
+            log(f"{self.host}: concurrency {before} -> {self.current_limit} ({reason})")
+
+    def metrics(self):
+        """Return the current limit, counters and recent decisions."""
+        with self._cond:
+            return {
+                'host': self.host,
+                'limit': self.current_limit,
+                'in_flight': self.in_flight,
+                'requests': self.requests,
+                'overloads': self.overloads,
+                'latency_ewma': self.latency_ewma,
+                'latency_baseline': self.latency_baseline,
+                'decisions': list(self.decisions),
+            }
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(host, **settings):
+    """
+    Function to return the limiter shared by every fetcher of `host`,
+    `settings` are only used when the limiter is created
+    """
+    with _limiters_lock:
+        if host not in _limiters:
+            _limiters[host] = AdaptiveLimiter(host, **settings)
+        return _limiters[host]
+
+
+def limiter_metrics():
+    """Function to return the metrics of every limiter created so far"""
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {limiter.host: limiter.metrics() for limiter in limiters}
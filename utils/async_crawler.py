@@ -0,0 +1,95 @@
+import time
+import asyncio
+import aiohttp
+from urllib.parse import urlsplit
+from tqdm import tqdm
+from .logger import setup_logging
+from .http_client import ACCEPT_ENCODING, RETRY_STATUS_CODES, resolve_url
+from .adaptive_limiter import get_limiter
+from .telemetry import record_request, PARSE_SECONDS
+
+logger = setup_logging(__name__)
+
+
+async def fetch_page(session, semaphore, url, params, retries=3, backoff_factor=0.5):
+    """
+    Fetch a single page while holding a slot of the semaphore and of the
+    host's adaptive limiter, retrying on connection errors and on the same
+    status codes as the HTTP client
+    """
+    url = resolve_url(url)
+    host = urlsplit(url).netloc
+    limiter = get_limiter(host)
+    async with semaphore:
+        for attempt in range(retries + 1):
+            await limiter.acquire_async()
+            start = time.perf_counter()
+            status, size = None, 0
+            try:
+                async with session.get(url, params=params) as response:
+                    status = response.status
+                    if response.status in RETRY_STATUS_CODES and attempt < retries:
+                        logger.warning(f"Status {response.status} for {url} {params}, retrying")
+                    else:
+                        body = await response.text()
+                        size = len(body)
+                        return body
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt == retries:
+                    raise
+                logger.warning(f"Error {e} for {url} {params}, retrying")
+            finally:
+                latency = time.perf_counter() - start
+                limiter.release(latency, status)
+                record_request(host, status, latency, size)
+            await asyncio.sleep(backoff_factor * (2 ** attempt))
+
+
+async def crawl(url, pages, headers, parse_page, concurrency, timeout, retries, on_page):
+    """
+    Keep up to `concurrency` page requests in flight on a single event loop
+    and parse every page as soon as its body arrives, in the loop's default
+    executor so parsing does not hold up the requests in flight
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    headers = {**headers, 'Accept-Encoding': ACCEPT_ENCODING}
+    connector = aiohttp.TCPConnector(limit=concurrency, ttl_dns_cache=300)
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+
+    retailer = parse_page.__module__.split('.')[0]
+
+    loop = asyncio.get_running_loop()
+
+    def timed_parse(html, page):
+        with PARSE_SECONDS.time(retailer=retailer):
+            return parse_page(html, page)
+
+    async with aiohttp.ClientSession(headers=headers, connector=connector, timeout=client_timeout) as session:
+
+        async def process(page):
+            html = await fetch_page(session, semaphore, url, {'page': page}, retries=retries)
+            return await loop.run_in_executor(None, timed_parse, html, page), page
+
+        all_items = []
+        tasks = [asyncio.create_task(process(page)) for page in pages]
+        try:
+            for task in tqdm(asyncio.as_completed(tasks), total=len(tasks)):
+                items, page = await task
+                if on_page is None:
+                    all_items.extend(items)
+                else:
+                    on_page(items, page)
+        finally:
+            for task in tasks:
+                task.cancel()
+        return all_items
+
+
+def crawl_pages(url, pages, headers, parse_page, concurrency=32, timeout=30, retries=3, on_page=None):
+    """
+    Function to crawl a paginated catalogue with asyncio and return the
+    items produced by `parse_page(html, page)` for every page. When
+    `on_page` is given each page's items are handed to `on_page(items, page)`
+    as soon as they are parsed instead of being accumulated
+    """
+    return asyncio.run(crawl(url, list(pages), headers, parse_page, concurrency, timeout, retries, on_page))
@@ -0,0 +1,280 @@
+import json
+from collections import namedtuple, Counter
+from .logger import setup_logging
+from .telemetry import telemetry, FIELD_DRIFT
+
+logger = setup_logging(__name__)
+
+# Field types and the matching Snowflake column type
+SNOWFLAKE_TYPES = {'string': 'STRING', 'float': 'FLOAT', 'boolean': 'BOOLEAN', 'timestamp': 'TIMESTAMP_LTZ'}
+
+# Patterns shared by the pandas parsers and their Snowflake fallbacks, so they
+# stay POSIX (no \d, no non capturing groups). QUANTITY_PATTERN reads texts such
+# as '500 g', '1.5L' or '6 x 330 ml': pack count, value and unit
+PRICE_PATTERN = '[0-9]+([.][0-9]+)?'
+QUANTITY_PATTERN = '^ *(([0-9]+) *[xX] *)?([0-9]+([.][0-9]+)?) *([A-Za-z]+)'
+
+Field = namedtuple('Field', ['name', 'type', 'paths', 'parse'])
+
+
+def parse_path(path):
+    """
+    Function to split a dotted json path such as 'category.0.name' into
+    its keys, digits being list indices
+    """
+    return tuple(int(part) if part.isdigit() else part for part in path.split('.'))
+
+
+def sql_path(path):
+    """Function to return the Snowflake accessor of a parsed json path, e.g. JSON_DATA:"category"[0]:"name" """
+    return 'JSON_DATA' + ''.join(f'[{key}]' if isinstance(key, int) else f':"{key}"' for key in path)
+
+
+def _numbers(text):
+    import pandas as pd
+    return pd.to_numeric(text, errors='coerce').astype('float64')
+
+
+def _quantity(raw):
+    return raw.astype('string').str.extract(QUANTITY_PATTERN)
+
+
+def parse_price(raw):
+    """Function to read prices such as 'AED 1,299.50' (or plain numbers) as floats"""
+    text = raw.astype('string').str.replace(',', '', regex=False)
+    return _numbers(text.str.extract(f'({PRICE_PATTERN})')[0])
+
+
+def parse_quantity_value(raw):
+    return _numbers(_quantity(raw)[2])
+
+
+def parse_quantity_unit(raw):
+    unit = _quantity(raw)[4].str.lower()
+    # None like the other string columns, not pd.NA
+    return unit.astype(object).where(unit.notna(), None)
+
+
+def parse_pack_count(raw):
+    parts = _quantity(raw)
+    # '500 g' is a pack of one
+    return _numbers(parts[1]).fillna(1).where(parts[2].notna())
+
+
+# Named parsers of a field: the vectorized parser of the normalizer, the type
+# it returns and the Snowflake expression of the json stage format, {text}
+# being the field's json value as a string
+PARSERS = {
+    'price': {
+        'type': 'float',
+        'parse': parse_price,
+        'sql': f"TRY_TO_DOUBLE(REGEXP_SUBSTR(REPLACE({{text}}, ',', ''), '{PRICE_PATTERN}'))",
+    },
+    'quantity_value': {
+        'type': 'float',
+        'parse': parse_quantity_value,
+        'sql': f"TRY_TO_DOUBLE(REGEXP_SUBSTR({{text}}, '{QUANTITY_PATTERN}', 1, 1, 'e', 3))",
+    },
+    'quantity_unit': {
+        'type': 'string',
+        'parse': parse_quantity_unit,
+        'sql': f"LOWER(REGEXP_SUBSTR({{text}}, '{QUANTITY_PATTERN}', 1, 1, 'e', 5))",
+    },
+    'pack_count': {
+        'type': 'float',
+        'parse': parse_pack_count,
+        'sql': (
+            f"IFF(REGEXP_SUBSTR({{text}}, '{QUANTITY_PATTERN}', 1, 1, 'e', 3) IS NULL, NULL, "
+            f"COALESCE(TRY_TO_DOUBLE(REGEXP_SUBSTR({{text}}, '{QUANTITY_PATTERN}', 1, 1, 'e', 2)), 1))"
+        ),
+    },
+}
+
+
+def field(name, type, *paths, parse=None):
+    """
+    Function to declare a field of a retailer: the first of `paths` present
+    in an item gives its value (like COALESCE over the json paths), cast to
+    `type` or read by the named `parse` parser
+    """
+    if type not in SNOWFLAKE_TYPES:
+        raise ValueError(f"Please enter one of {', '.join(SNOWFLAKE_TYPES)} for argument type")
+    if parse is not None:
+        if parse not in PARSERS:
+            raise ValueError(f"Please enter one of {', '.join(PARSERS)} for argument parse")
+        if PARSERS[parse]['type'] != type:
+            raise ValueError(f"The {parse} parser returns {PARSERS[parse]['type']} values, not {type}")
+    return Field(name, type, tuple(parse_path(path) for path in paths), parse)
+
+
+def _get(values, key):
+    if isinstance(key, int):
+        return [value[key] if isinstance(value, list) and key < len(value) else None for value in values]
+    return [value.get(key) if isinstance(value, dict) else None for value in values]
+
+
+def _to_string(value):
+    if isinstance(value, str):
+        return value
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, separators=(',', ':'), ensure_ascii=False)
+    return str(value)
+
+
+def cast(raw, type):
+    """
+    Function to cast a column of json values the way Snowflake casts a
+    VARIANT, null where the value cannot be cast. Columns of plain strings
+    or numbers are cast with pandas, only the values of mixed columns
+    (booleans, objects) are converted one by one
+    """
+    import pandas as pd
+    from pandas.api.types import infer_dtype
+    if type == 'string':
+        kind = infer_dtype(raw, skipna=True)
+        if kind in ('string', 'empty'):
+            return raw
+        if kind in ('integer', 'floating', 'mixed-integer-float'):
+            return raw.astype('string').astype(object).where(raw.notna(), None)
+        return raw.map(_to_string, na_action='ignore').astype(object)
+    if type == 'float':
+        return pd.to_numeric(raw, errors='coerce').astype('float64')
+    if type == 'boolean':
+        return raw.astype('string').str.lower().map({'true': True, 'false': False}).astype(object)
+    return pd.to_datetime(raw, errors='coerce', utc=True)
+
+
+class DriftReport:
+    """
+    Accumulates, over the batches of a stage, how the items matched the
+    field spec of a retailer:
+    - missing: fields none of whose paths is present in any item
+    - invalid: rows whose value is present but could not be cast or parsed
+    - unknown: item keys the spec neither maps nor ignores (closed specs only)
+    """
+    def __init__(self, spec):
+        self.spec = spec
+        self.rows = 0
+        self.present = Counter()
+        self.invalid = Counter()
+        self.samples = {}
+        self.unknown = Counter()
+
+    def missing(self):
+        return [f.name for f in self.spec.fields if self.rows and not self.present[f.name]]
+
+    def as_dict(self):
+        return {
+            'rows': self.rows,
+            'missing': self.missing(),
+            'invalid': dict(self.invalid),
+            'invalid_samples': self.samples,
+            'unknown': dict(self.unknown),
+        }
+
+    def log(self):
+        """Log the drift of the stage, publish it as the field_drift_rows gauge and a run report event."""
+        name = self.spec.name
+        telemetry.event('field_drift', retailer=name, **self.as_dict())
+        for field_name in self.missing():
+            FIELD_DRIFT.set(self.rows, retailer=name, field=field_name, kind='missing')
+        for field_name, count in self.invalid.items():
+            FIELD_DRIFT.set(count, retailer=name, field=field_name, kind='invalid')
+        for key, count in self.unknown.items():
+            FIELD_DRIFT.set(count, retailer=name, field=key, kind='unknown')
+
+        if self.missing():
+            logger.warning(f"{name}: no item has a value for {', '.join(self.missing())}, check the paths of these fields")
+        if self.invalid:
+            details = ', '.join(f"{key} ({count} rows, e.g. {self.samples[key]!r})" for key, count in self.invalid.items())
+            logger.warning(f"{name}: values that could not be read for {details}")
+        if self.unknown:
+            logger.warning(f"{name}: keys not in the field spec {', '.join(f'{key} ({count} rows)' for key, count in self.unknown.items())}")
+        if not (self.missing() or self.invalid or self.unknown):
+            logger.info(f"{name}: {self.rows} rows matched the field spec")
+
+
+class FieldSpec:
+    """
+    Declarative mapping of the staged json items of a retailer to typed
+    warehouse columns.
+
+    `normalize` runs the mapping client side and records drift in a
+    DriftReport: the values of a json path are collected in a Python pass
+    over the items (their types are mixed, e.g. a brand is a string or an
+    object), the casts and parsers then run on whole pandas columns. `select_statement` generates the
+    equivalent Snowflake projection for the json stage format. A `closed`
+    spec maps (or `ignore`s) every key the scraper writes, so new keys are
+    reported as drift, an open spec only reports the fields missing from
+    the items.
+
+    `root_keys` lists the top level item keys the fields read, in field
+    order: the scrapers hash them to detect changed rows.
+    """
+    def __init__(self, name, fields, closed=False, ignore=('_row_hash',)):
+        self.name = name
+        self.fields = list(fields)
+        self.closed = closed
+        self.ignore = set(ignore)
+        self.root_keys = list(dict.fromkeys(path[0] for f in self.fields for path in f.paths))
+        self.roots = set(self.root_keys)
+
+    def __iter__(self):
+        return iter(self.fields)
+
+    def select_statement(self):
+        """Return the Snowflake projection of the spec over JSON_DATA, with the LOAD_TIMESTAMP."""
+        lines = []
+        for f in self.fields:
+            if f.parse is None:
+                values = [f'{sql_path(path)}::{SNOWFLAKE_TYPES[f.type]}' for path in f.paths]
+                expression = values[0] if len(values) == 1 else f"COALESCE({', '.join(values)})"
+            else:
+                texts = [f'{sql_path(path)}::STRING' for path in f.paths]
+                text = texts[0] if len(texts) == 1 else f"COALESCE({', '.join(texts)})"
+                expression = PARSERS[f.parse]['sql'].format(text=text)
+            lines.append(f'{expression} as {f.name}')
+        lines.append('CURRENT_TIMESTAMP() as LOAD_TIMESTAMP')
+        return '\n' + ',\n'.join(f'    {line}' for line in lines) + '\n'
+
+    def normalize(self, items, drift=None):
+        """
+        Map a batch of json items onto the fields, returns a DataFrame of
+        typed columns (None/NaN where there is no value)
+        """
+        import pandas as pd
+        data = {}
+        roots, raws = {}, {}
+        for f in self.fields:
+            # Fields reading the same paths (e.g. the quantity parsers) share their values
+            raw = raws.get(f.paths)
+            if raw is None:
+                for path in f.paths:
+                    if path[0] not in roots:
+                        roots[path[0]] = [item.get(path[0]) for item in items]
+                    values = roots[path[0]]
+                    for key in path[1:]:
+                        values = _get(values, key)
+                    values = pd.Series(values, dtype=object)
+                    raw = values if raw is None else raw.where(raw.notna(), values)
+                raws[f.paths] = raw
+            typed = PARSERS[f.parse]['parse'](raw) if f.parse is not None else cast(raw, f.type)
+            data[f.name] = typed
+
+            if drift is not None:
+                present = raw.notna()
+                invalid = present & typed.isna()
+                drift.present[f.name] += int(present.sum())
+                if invalid.any():
+                    drift.invalid[f.name] += int(invalid.sum())
+                    drift.samples.setdefault(f.name, _to_string(raw[invalid].iloc[0]))
+
+        if drift is not None:
+            drift.rows += len(items)
+            if self.closed:
+                for item in items:
+                    for key in item.keys() - self.roots - self.ignore:
+                        drift.unknown[key] += 1
+        return pd.DataFrame(data, index=pd.RangeIndex(len(items)))
@@ -0,0 +1,98 @@
+import os
+from bs4 import BeautifulSoup, SoupStrainer
+from .logger import setup_logging
+
+logger = setup_logging(__name__)
+
+# Tags each retailer page actually reads. Anything outside these tags (and
+# their subtrees) is skipped by the tree builder instead of being built and
+# thrown away.
+SELECTORS = {
+    'spinneys': [('script', {}), ('div', {'class': 'arc-grid'})],
+    'spinneys-pagination': [('div', {'class': 'page-numbers'})],
+    'choithrams': [('script', {})],
+    'choithrams-pagination': [('div', {'class': 'page-buttons'})],
+    'carrefour': [('script', {'type': 'application/json'})],
+}
+
+# html.parser : full tree with the stdlib parser (original behaviour)
+# strainer    : stdlib parser, tree limited to the retailer selectors
+# lxml        : lxml parser, tree limited to the retailer selectors
+BACKENDS = ('html.parser', 'strainer', 'lxml')
+
+DEFAULT_BACKEND = os.environ.get('SCRAPER_HTML_BACKEND', 'strainer')
+
+try:
+    import lxml  # noqa: F401
+    LXML_AVAILABLE = True
+except ImportError:
+    LXML_AVAILABLE = False
+
+
+def _classes(value):
+    if not value:
+        return []
+    return value.split() if isinstance(value, str) else list(value)
+
+
+def _matches(selector, name, attrs):
+    tag_name, tag_attrs = selector
+    if name != tag_name:
+        return False
+    for attr, expected in tag_attrs.items():
+        if attr == 'class':
+            if expected not in _classes(attrs.get('class')):
+                return False
+        elif attrs.get(attr) != expected:
+            return False
+    return True
+
+
+class SelectorStrainer(SoupStrainer):
+    """
+    SoupStrainer that keeps every tag matching any of the given selectors
+    """
+    def __init__(self, selectors):
+        self.selectors = selectors
+        super().__init__(self.keep)
+
+    def keep(self, name, attrs=None):
+        # bs4 < 4.13 calls the name rule with the raw tag name and attributes
+        return any(_matches(selector, name, attrs or {}) for selector in self.selectors)
+
+    def allow_tag_creation(self, nsprefix, name, attrs):
+        # bs4 >= 4.13 decides on tag creation through this hook instead
+        return self.keep(name, attrs)
+
+
+def make_soup(html, retailer, backend=None):
+    """
+    Function to parse the html of a retailer page with the configured backend
+    """
+    backend = backend or DEFAULT_BACKEND
+    if backend == 'html.parser':
+        return BeautifulSoup(html, 'html.parser')
+    if backend == 'lxml' and not LXML_AVAILABLE:
+        logger.warning("lxml is not installed, falling back to the strainer backend")
+        backend = 'strainer'
+    if backend == 'strainer':
+        return BeautifulSoup(html, 'html.parser', parse_only=SelectorStrainer(SELECTORS[retailer]))
+    if backend == 'lxml':
+        return BeautifulSoup(html, 'lxml', parse_only=SelectorStrainer(SELECTORS[retailer]))
+    raise ValueError(f"Please enter one of {', '.join(BACKENDS)} for argument backend")
+
+
+def compare_backends(parse_page, html, page=1, backends=BACKENDS):
+    """
+    Parity check: run `parse_page(html, page, backend=...)` with every backend
+    and return the backends whose output differs from the full html.parser tree
+    """
+    reference = parse_page(html, page, backend='html.parser')
+    mismatches = {}
+    for backend in backends:
+        if backend == 'lxml' and not LXML_AVAILABLE:
+            continue
+        output = parse_page(html, page, backend=backend)
+        if output != reference:
+            mismatches[backend] = output
+    return mismatches
@@ -0,0 +1,218 @@
+import os
+import json
+import zlib
+import time
+import sqlite3
+import hashlib
+import threading
+from urllib.parse import urlencode
+from .logger import setup_logging
+
+logger = setup_logging(__name__)
+
+DEFAULT_CACHE_PATH = os.path.join(os.getcwd(), 'state', 'http_cache.db')
+MB = 1024 ** 2
+
+
+def cache_key(url, params=None):
+    """
+    Function to build the cache key of a request from its url and params
+    """
+    query = urlencode(sorted((params or {}).items()), doseq=True)
+    return hashlib.sha1(f'{url}?{query}'.encode('utf-8')).hexdigest()
+
+
+class CacheEntry:
+    """A cached response: its validators, body and the items extracted from it."""
+    def __init__(self, key, etag, last_modified, body, body_bytes, items, version):
+        self.key = key
+        self.etag = etag
+        self.last_modified = last_modified
+        self.body = body
+        self.body_bytes = body_bytes
+        self.items = items
+        self.version = version
+
+    def conditional_headers(self):
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class HttpCache:
+    """
+    On-disk cache of conditional GET responses, kept in SQLite.
+
+    Only responses carrying an ETag or Last-Modified validator are stored,
+    together with the zlib compressed body and the items the scraper
+    extracted from it. The next run sends the validators back and a
+    304 Not Modified reuses the stored items without downloading or parsing
+    the page. The items are re-extracted from the stored body when the
+    `version` of the parser changed.
+
+    Entries stored more than `max_age_days` ago are dropped, a 304 does not
+    renew them, so every page is downloaded in full at least that often.
+    The least recently used entries are then dropped until the cache fits
+    in `max_bytes`.
+    """
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=512 * MB, max_age_days=7):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self.stats = {'hits': 0, 'misses': 0, 'stored': 0, 'bytes_saved': 0}
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                body BLOB NOT NULL,
+                body_bytes INTEGER NOT NULL,
+                items BLOB,
+                version TEXT,
+                size INTEGER NOT NULL,
+                stored REAL NOT NULL,
+                accessed REAL NOT NULL
+            )
+        ''')
+        self.evict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _execute(self, query, args=()):
+        with self._lock:
+            return self._conn.execute(query, args).fetchall()
+
+    def get(self, key):
+        rows = self._execute(
+            "SELECT etag, last_modified, body, body_bytes, items, version FROM responses WHERE key = ?", (key,)
+        )
+        if not rows:
+            return None
+        etag, last_modified, body, body_bytes, items, version = rows[0]
+        return CacheEntry(
+            key, etag, last_modified,
+            zlib.decompress(body),
+            body_bytes,
+            json.loads(zlib.decompress(items)) if items is not None else None,
+            version
+        )
+
+    def put(self, key, url, response, items, version=None):
+        """Store a 200 response with validators and the items extracted from it."""
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if not etag and not last_modified:
+            return False
+        body = zlib.compress(response.content, 6)
+        items_blob = zlib.compress(json.dumps(items, ensure_ascii=False).encode('utf-8'), 6)
+        now = time.time()
+        self._execute('''
+            INSERT OR REPLACE INTO responses
+            (key, url, etag, last_modified, body, body_bytes, items, version, size, stored, accessed)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (key, url, etag, last_modified, body, len(response.content), items_blob, version,
+              len(body) + len(items_blob), now, now))
+        self.count('stored')
+        return True
+
+    def refresh(self, key, items=None, version=None):
+        """
+        Mark an entry as revalidated, replacing its items when given. The
+        store time is kept, max_age_days counts from the last full download
+        """
+        now = time.time()
+        if items is None:
+            self._execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            return
+        items_blob = zlib.compress(json.dumps(items, ensure_ascii=False).encode('utf-8'), 6)
+        self._execute('''
+            UPDATE responses SET accessed = ?, items = ?, version = ?,
+            size = length(body) + ? WHERE key = ?
+        ''', (now, items_blob, version, len(items_blob), key))
+
+    def evict(self):
+        """Drop expired entries, then the least recently used ones above max_bytes."""
+        cutoff = time.time() - self.max_age_days * 86400
+        with self._lock:
+            expired = self._conn.execute("DELETE FROM responses WHERE stored < ?", (cutoff,)).rowcount
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            evicted = 0
+            if total > self.max_bytes:
+                rows = self._conn.execute("SELECT key, size FROM responses ORDER BY accessed").fetchall()
+                doomed = []
+                for key, size in rows:
+                    if total <= self.max_bytes:
+                        break
+                    doomed.append((key,))
+                    total -= size
+                self._conn.executemany("DELETE FROM responses WHERE key = ?", doomed)
+                evicted = len(doomed)
+        if expired or evicted:
+            logger.info(f"HTTP cache evicted {expired} expired and {evicted} least recently used entries")
+
+    def count(self, stat, amount=1):
+        with self._lock:
+            self.stats[stat] += amount
+
+    def close(self):
+        self.evict()
+        with self._lock:
+            self._conn.close()
+        logger.info(
+            f"HTTP cache: {self.stats['hits']} hits, {self.stats['misses']} misses, "
+            f"{self.stats['stored']} stored, {self.stats['bytes_saved'] / MB:.1f} MB not downloaded"
+        )
+
+
+def cached_fetch(client, cache, url, extract, params=None, version=None, check=None, **kwargs):
+    """
+    Function to GET `url` and return the items produced by `extract(content)`,
+    after `check(response)` (if given) validated the response.
+    With a cache the request is conditional: a 304 returns the items stored
+    by the previous run, skipping both the download and the extraction.
+    Returns the items and the response (None when served from the cache)
+    """
+    if cache is None:
+        response = client.get(url, params=params, **kwargs)
+        if check is not None:
+            check(response)
+        return extract(response.content), response
+
+    key = cache_key(url, params)
+    entry = cache.get(key)
+    headers = dict(kwargs.pop('headers', None) or {})
+    if entry is not None:
+        headers.update(entry.conditional_headers())
+    response = client.get(url, params=params, headers=headers, **kwargs)
+
+    if response.status_code == 304 and entry is not None:
+        cache.count('hits')
+        cache.count('bytes_saved', entry.body_bytes)
+        if entry.version != version or entry.items is None:
+            # The extraction changed since the page was cached, redo it from the stored body
+            items = extract(entry.body)
+            cache.refresh(key, items, version)
+            return items, None
+        cache.refresh(key)
+        return entry.items, None
+
+    cache.count('misses')
+    if check is not None:
+        check(response)
+    items = extract(response.content)
+    if response.status_code == 200:
+        cache.put(key, url, response, items, version)
+    return items, response
@@ -0,0 +1,162 @@
+import os
+import json
+import time
+import threading
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from .logger import setup_logging
+from .adaptive_limiter import get_limiter
+from .telemetry import record_request
+
+logger = setup_logging(__name__)
+
+# Brotli responses can only be decoded by urllib3 when one of the brotli
+# packages is installed, so only advertise 'br' when that is the case
+try:
+    import brotli  # noqa: F401
+    ACCEPT_ENCODING = 'gzip, deflate, br'
+except ImportError:
+    try:
+        import brotlicffi  # noqa: F401
+        ACCEPT_ENCODING = 'gzip, deflate, br'
+    except ImportError:
+        ACCEPT_ENCODING = 'gzip, deflate'
+
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# Origins to send requests to instead of the live sites, e.g. the replay
+# server of the benchmark harness: {"https://www.spinneys.com": "http://127.0.0.1:8800/www.spinneys.com"}
+ORIGIN_OVERRIDES = json.loads(os.environ.get('SCRAPER_ORIGIN_OVERRIDES', '{}'))
+
+# Callables added as requests response hooks to every session built
+RESPONSE_HOOKS = []
+
+
+def resolve_url(url):
+    """
+    Function to rewrite the origin of `url` according to ORIGIN_OVERRIDES
+    """
+    for origin, replacement in ORIGIN_OVERRIDES.items():
+        if url.startswith(origin):
+            return replacement + url[len(origin):]
+    return url
+
+
+class HttpClient:
+    """
+    Keep-alive HTTP client shared by the requests based scrapers.
+
+    Every worker thread gets its own requests.Session (sessions are not
+    thread safe) with a connection pool sized to the number of workers,
+    so consecutive pages fetched by a thread reuse the same TCP/TLS
+    connection instead of paying a fresh handshake per page.
+
+    With `adaptive=True` every request also holds a slot of the host's
+    AdaptiveLimiter, so the number of threads is only a ceiling and the
+    concurrency actually used follows what the site tolerates.
+    """
+    def __init__(self, headers=None, pool_size=10, retries=3, backoff_factor=0.5,
+                 status_forcelist=RETRY_STATUS_CODES, timeout=30, cookies=None, adaptive=True):
+        self.headers = dict(headers or {})
+        self.cookies = dict(cookies or {})
+        self.pool_size = pool_size
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.status_forcelist = status_forcelist
+        self.timeout = timeout
+        self.adaptive = adaptive
+        self._local = threading.local()
+        self._sessions = []
+        self._lock = threading.Lock()
+        self._generation = 0
+
+    def configure(self, **kwargs):
+        """
+        Update pool/retry/header/cookie settings (e.g. pool_size=num_workers).
+        Every thread swaps its session for a new one on its next request, so
+        requests already in flight on other threads are not interrupted.
+        """
+        for key, value in kwargs.items():
+            if not hasattr(self, key):
+                raise AttributeError(f"Unknown HTTP client setting: {key}")
+            setattr(self, key, value)
+        with self._lock:
+            self._generation += 1
+
+    def build_session(self):
+        """Create a session with a sized, retrying connection pool."""
+        retry = Retry(
+            total=self.retries,
+            backoff_factor=self.backoff_factor,
+            status_forcelist=self.status_forcelist,
+            allowed_methods=frozenset(['GET', 'HEAD']),
+            respect_retry_after_header=True,
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_size,
+            pool_maxsize=self.pool_size,
+            max_retries=retry
+        )
+        session = requests.Session()
+        session.headers.update(self.headers)
+        session.headers['Accept-Encoding'] = ACCEPT_ENCODING
+        session.cookies.update(self.cookies)
+        session.hooks['response'].extend(RESPONSE_HOOKS)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    @property
+    def session(self):
+        """Return the session owned by the calling thread."""
+        session = getattr(self._local, 'session', None)
+        if session is not None and self._local.generation != self._generation:
+            # Settings changed since this session was built
+            with self._lock:
+                if session in self._sessions:
+                    self._sessions.remove(session)
+            session.close()
+            session = None
+        if session is None:
+            session = self.build_session()
+            self._local.session = session
+            self._local.generation = self._generation
+            with self._lock:
+                self._sessions.append(session)
+        return session
+
+    def get(self, url, **kwargs):
+        """Issue a GET request on the calling thread's session."""
+        kwargs.setdefault('timeout', self.timeout)
+        url = resolve_url(url)
+        host = urlsplit(url).netloc
+        limiter = get_limiter(host) if self.adaptive else None
+        if limiter is not None:
+            limiter.acquire()
+        start = time.perf_counter()
+        status, retried_statuses, size = None, (), 0
+        try:
+            response = self.session.get(url, **kwargs)
+            status = response.status_code
+            if not kwargs.get('stream'):
+                size = len(response.content)
+            retries = getattr(response.raw, 'retries', None)
+            if retries is not None:
+                retried_statuses = [attempt.status for attempt in retries.history]
+            return response
+        finally:
+            latency = time.perf_counter() - start
+            if limiter is not None:
+                limiter.release(latency, status, retried_statuses)
+            record_request(host, status, latency, size)
+
+    def close(self):
+        """Close every session handed out so far."""
+        with self._lock:
+            sessions, self._sessions = self._sessions, []
+        for session in sessions:
+            session.close()
+        self._local = threading.local()
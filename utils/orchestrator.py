@@ -0,0 +1,121 @@
+import time
+import traceback
+from datetime import datetime as dt
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from .logger import setup_logging
+
+logger = setup_logging(__name__)
+
+
+class Stage:
+    """
+    A unit of work in the pipeline. `func` is called without arguments,
+    returning False (or raising) marks the stage as failed.
+    """
+    def __init__(self, name, func, depends_on=(), weight=1):
+        self.name = name
+        self.func = func
+        self.depends_on = tuple(depends_on)
+        self.weight = weight
+        self.status = 'pending'
+        self.started = None
+        self.finished = None
+        self.seconds = None
+        self.error = None
+
+    def run(self):
+        self.started = dt.now()
+        start = time.perf_counter()
+        try:
+            return self.func()
+        finally:
+            self.seconds = time.perf_counter() - start
+            self.finished = dt.now()
+
+    def summary(self):
+        return {
+            'status': self.status,
+            'depends_on': list(self.depends_on),
+            'started': self.started.isoformat() if self.started else None,
+            'finished': self.finished.isoformat() if self.finished else None,
+            'seconds': round(self.seconds, 3) if self.seconds is not None else None,
+            'error': self.error,
+        }
+
+
+class Pipeline:
+    """
+    Minimal DAG runner. Stages run as soon as all their dependencies have
+    succeeded, as long as the sum of the weights of the running stages stays
+    within `budget` (a stage heavier than the budget runs on its own).
+    Stages downstream of a failure are skipped.
+    """
+    def __init__(self, budget=4):
+        self.budget = budget
+        self.stages = {}
+
+    def add(self, name, func, depends_on=(), weight=1):
+        for dependency in depends_on:
+            if dependency not in self.stages:
+                raise ValueError(f"Stage {name} depends on unknown stage {dependency}")
+        self.stages[name] = Stage(name, func, depends_on, weight)
+        return name
+
+    def _ready(self, stage):
+        return all(self.stages[d].status == 'done' for d in stage.depends_on)
+
+    def _blocked(self, stage):
+        return any(self.stages[d].status in ('failed', 'skipped') for d in stage.depends_on)
+
+    def run(self):
+        """
+        Run every stage and return the run summary (status and timings per stage)
+        """
+        start = time.perf_counter()
+        running = {}
+        in_use = 0
+
+        with ThreadPoolExecutor(max_workers=max(len(self.stages), 1)) as executor:
+            while True:
+                for stage in self.stages.values():
+                    if stage.status == 'pending' and self._blocked(stage):
+                        stage.status = 'skipped'
+                        logger.warning(f"Skipping stage {stage.name}, an upstream stage failed")
+
+                for stage in self.stages.values():
+                    if stage.status != 'pending' or not self._ready(stage):
+                        continue
+                    if running and in_use + stage.weight > self.budget:
+                        continue
+                    stage.status = 'running'
+                    in_use += stage.weight
+                    running[executor.submit(stage.run)] = stage
+                    logger.info(f"Stage {stage.name} started")
+
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage = running.pop(future)
+                    in_use -= stage.weight
+                    try:
+                        result = future.result()
+                        stage.status = 'failed' if result is False else 'done'
+                    except Exception as e:
+                        stage.status = 'failed'
+                        stage.error = str(e)
+                        logger.error(f"Stage {stage.name} raised {e}")
+                        logger.error(traceback.format_exc())
+                    logger.info(f"Stage {stage.name} {stage.status} in {stage.seconds:.1f}s")
+
+        summary = {
+            'seconds': round(time.perf_counter() - start, 3),
+            'budget': self.budget,
+            'stages': {name: stage.summary() for name, stage in self.stages.items()},
+        }
+        return summary
+
+    @property
+    def succeeded(self):
+        return all(stage.status == 'done' for stage in self.stages.values())
@@ -0,0 +1,123 @@
+import io
+import os
+import gzip
+import json
+from datetime import datetime, timezone
+from .logger import setup_logging
+from .stage_writer import STAGE_EXTENSION, COMPRESSION_EXTENSIONS, is_stage_file
+from .field_mapping import DriftReport
+
+# pyarrow is imported by the first conversion, declaring the field spec of a
+# retailer (at the CLI start) does not pay for it
+pa = pq = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = setup_logging(__name__)
+
+PARQUET_EXTENSION = '.parquet'
+PARQUET_FOLDER = 'parquet'
+PARQUET_COMPRESSIONS = ('zstd', 'snappy')
+BATCH_ROWS = 50000
+
+# Columns added to every Parquet stage file: the time of the conversion and
+# the `_row_hash` of the stage writer used by the incremental loads
+LOAD_TIMESTAMP = 'LOAD_TIMESTAMP'
+ROW_HASH = 'ROW_HASH'
+
+
+def has_pyarrow():
+    """Function to import pyarrow on first use, returns False when it is not installed"""
+    global pa, pq
+    if pa is None:
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            return False
+        pa, pq = pyarrow, pyarrow.parquet
+    return True
+
+
+def arrow_schema(spec):
+    types = {'string': pa.string(), 'float': pa.float64(), 'boolean': pa.bool_(), 'timestamp': pa.timestamp('us', tz='UTC')}
+    fields = [pa.field(f.name, types[f.type]) for f in spec]
+    fields.append(pa.field(LOAD_TIMESTAMP, types['timestamp']))
+    fields.append(pa.field(ROW_HASH, pa.string()))
+    return pa.schema(fields)
+
+
+def _open_stage_file(file_path):
+    if file_path.endswith(COMPRESSION_EXTENSIONS['gzip']):
+        return gzip.open(file_path, 'rb')
+    if file_path.endswith(COMPRESSION_EXTENSIONS['zstd']):
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(file_path, 'rb'), closefd=True))
+    return open(file_path, 'rb')
+
+
+def _read_batches(file_path, batch_rows):
+    with _open_stage_file(file_path) as f:
+        batch = []
+        for line in f:
+            if line.strip():
+                batch.append(json.loads(line))
+            if len(batch) >= batch_rows:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+def convert_stage_file(file_path, output_path, spec, compression='zstd', load_timestamp=None, batch_rows=BATCH_ROWS, drift=None):
+    """
+    Function to normalize a jsonl stage file with the field spec into a typed
+    Parquet file, one row group per batch so memory stays flat. Returns the
+    number of rows written
+    """
+    if not has_pyarrow():
+        raise ImportError("pyarrow is required for the parquet stage format")
+    schema = arrow_schema(spec)
+    load_timestamp = load_timestamp or datetime.now(timezone.utc)
+    rows = 0
+    with pq.ParquetWriter(output_path, schema, compression=compression) as writer:
+        for batch in _read_batches(file_path, batch_rows):
+            frame = spec.normalize(batch, drift)
+            frame[LOAD_TIMESTAMP] = load_timestamp
+            frame[ROW_HASH] = [item.get('_row_hash') for item in batch]
+            writer.write_table(pa.Table.from_pandas(frame, schema=schema, preserve_index=False))
+            rows += len(batch)
+    return rows
+
+
+def write_parquet_stage(stage_path, spec, compression='zstd', batch_rows=BATCH_ROWS):
+    """
+    Function to normalize every jsonl stage file of the folder into a Parquet
+    file of its `parquet` sub folder, leaving the jsonl files in place for
+    the archive. The drift of the items against the spec is logged. Returns
+    the Parquet folder, the files written and the DriftReport
+    """
+    if not has_pyarrow():
+        raise ImportError("pyarrow is required for the parquet stage format")
+    if compression not in PARQUET_COMPRESSIONS:
+        raise ValueError(f"Please enter one of {', '.join(PARQUET_COMPRESSIONS)} for argument compression")
+    output_dir = os.path.join(stage_path, PARQUET_FOLDER)
+    os.makedirs(output_dir, exist_ok=True)
+    for file_name in os.listdir(output_dir):
+        os.remove(os.path.join(output_dir, file_name))
+
+    load_timestamp = datetime.now(timezone.utc)
+    drift = DriftReport(spec)
+    files, rows = [], 0
+    for file_name in sorted(os.listdir(stage_path)):
+        if not is_stage_file(file_name):
+            continue
+        stem = file_name[:file_name.index(STAGE_EXTENSION)]
+        output_path = os.path.join(output_dir, stem + PARQUET_EXTENSION)
+        rows += convert_stage_file(os.path.join(stage_path, file_name), output_path, spec, compression, load_timestamp, batch_rows, drift)
+        files.append(output_path)
+    logger.info(f"Converted {rows} rows of {stage_path} into {len(files)} {compression} Parquet files")
+    drift.log()
+    return output_dir, files, drift
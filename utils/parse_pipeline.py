@@ -0,0 +1,123 @@
+import os
+import time
+import queue
+import threading
+from tqdm import tqdm
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from .logger import setup_logging
+from .telemetry import PARSE_SECONDS
+
+logger = setup_logging(__name__)
+
+
+def timed_parse(parse_page, html, page):
+    """
+    Run the parser inside a worker process and return the items
+    together with the time spent parsing and the page number
+    """
+    start = time.perf_counter()
+    items = parse_page(html, page)
+    return items, time.perf_counter() - start, page
+
+
+def run_pipeline(fetch_page, parse_page, pages, fetch_workers=5, parse_workers=None, queue_size=None, on_page=None):
+    """
+    Two stage fetch/parse pipeline.
+
+    `fetch_page(page)` runs on a pool of I/O threads and pushes the raw html
+    onto a bounded queue; `parse_page(html, page)` runs on a process pool so
+    parsing scales across cores. Both callables must be module level
+    functions so they can be pickled to the parse processes.
+
+    Returns the list of items (empty when an `on_page(items, page)` callback
+    consumes each page's items instead) and a dict with the utilisation of each stage.
+    A busy parse stage together with fetchers blocked on a full queue means
+    parsing is the bottleneck, a mostly idle parse stage means fetching is.
+    """
+    pages = list(pages)
+    parse_workers = parse_workers or os.cpu_count() or 1
+    queue_size = queue_size or parse_workers * 2
+    html_queue = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    lock = threading.Lock()
+    stats = {
+        'pages': len(pages),
+        'fetch_workers': fetch_workers,
+        'parse_workers': parse_workers,
+        'queue_size': queue_size,
+        'fetch_busy_seconds': 0.0,
+        'fetch_blocked_seconds': 0.0,
+        'parse_busy_seconds': 0.0,
+        'queue_high_water': 0,
+    }
+
+    def fetch(page):
+        if stop.is_set():
+            return
+        start = time.perf_counter()
+        try:
+            item = (page, fetch_page(page), None)
+        except Exception as e:
+            item = (page, None, e)
+        fetched = time.perf_counter()
+        while not stop.is_set():
+            try:
+                html_queue.put(item, timeout=0.5)
+                break
+            except queue.Full:
+                continue
+        with lock:
+            stats['fetch_busy_seconds'] += fetched - start
+            stats['fetch_blocked_seconds'] += time.perf_counter() - fetched
+            stats['queue_high_water'] = max(stats['queue_high_water'], html_queue.qsize())
+
+    all_items = []
+    retailer = parse_page.__module__.split('.')[0]
+
+    def collect(futures):
+        for future in futures:
+            items, elapsed, page = future.result()
+            stats['parse_busy_seconds'] += elapsed
+            # Timed in the parse process, observed here as the worker's registry is not the parent's
+            PARSE_SECONDS.observe(elapsed, retailer=retailer)
+            if on_page is None:
+                all_items.extend(items)
+            else:
+                on_page(items, page)
+            progress.update(1)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=fetch_workers) as fetchers, \
+            ProcessPoolExecutor(max_workers=parse_workers) as parsers, \
+            tqdm(total=len(pages)) as progress:
+        try:
+            for page in pages:
+                fetchers.submit(fetch, page)
+
+            pending = set()
+            for _ in range(len(pages)):
+                page, html, error = html_queue.get()
+                if error is not None:
+                    logger.error(f"Error {error} while fetching page {page}")
+                    raise error
+                pending.add(parsers.submit(timed_parse, parse_page, html, page))
+                # Keep at most one page per parser in flight so that a slow
+                # parse stage pushes back on the fetchers through the queue
+                while len(pending) >= parse_workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+            collect(wait(pending)[0])
+        finally:
+            stop.set()
+
+    wall = time.perf_counter() - start
+    stats['wall_seconds'] = wall
+    stats['fetch_utilisation'] = stats['fetch_busy_seconds'] / (wall * fetch_workers) if wall else 0.0
+    stats['parse_utilisation'] = stats['parse_busy_seconds'] / (wall * parse_workers) if wall else 0.0
+    logger.info(
+        f"Pipeline finished {len(pages)} pages in {wall:.1f}s - "
+        f"fetch utilisation {stats['fetch_utilisation']:.0%}, "
+        f"parse utilisation {stats['parse_utilisation']:.0%}, "
+        f"fetchers blocked on full queue {stats['fetch_blocked_seconds']:.1f}s"
+    )
+    return all_items, stats
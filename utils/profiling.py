@@ -0,0 +1,215 @@
+import io
+import os
+import sys
+import time
+import pstats
+import cProfile
+import threading
+import tracemalloc
+from .logger import setup_logging
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+logger = setup_logging(__name__)
+
+MB = 1024 ** 2
+
+# tracemalloc is process wide, it runs while at least one profiled stage does
+_tracing_lock = threading.Lock()
+_tracing_stages = 0
+
+
+def peak_rss_mb():
+    """
+    Function to return the peak resident memory of the process so far in MB
+    """
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports kilobytes, macOS bytes
+        return peak / MB if sys.platform == 'darwin' else peak / 1024
+    except ImportError:
+        if psutil is None:
+            return None
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss) / MB
+
+
+class MemorySampler:
+    """
+    Samples the memory of the process every `interval` seconds while a stage
+    runs, so the peak can be attributed to that stage rather than to the
+    whole process lifetime. A tracemalloc snapshot is kept whenever the
+    traced memory grows by more than `growth` over the largest snapshot so
+    far, so the top allocators are those near the peak and not the few
+    objects still alive when the stage returns
+    """
+    def __init__(self, interval=0.5, growth=0.1):
+        self.interval = interval
+        self.growth = growth
+        self.start_mb = self.peak_mb = self._rss()
+        self.snapshot = None
+        self._snapshot_size = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def _rss():
+        return psutil.Process().memory_info().rss / MB if psutil is not None else None
+
+    def sample(self):
+        if self.start_mb is not None:
+            self.peak_mb = max(self.peak_mb, self._rss())
+        if tracemalloc.is_tracing():
+            current, _ = tracemalloc.get_traced_memory()
+            if self.snapshot is None or current > self._snapshot_size * (1 + self.growth):
+                self.snapshot = tracemalloc.take_snapshot()
+                self._snapshot_size = current
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+
+
+def _start_tracing():
+    global _tracing_stages
+    with _tracing_lock:
+        if _tracing_stages == 0:
+            tracemalloc.start()
+        _tracing_stages += 1
+
+
+def _stop_tracing():
+    """Stop tracing when no other profiled stage is running, returns the traced peak."""
+    global _tracing_stages
+    with _tracing_lock:
+        _, peak = tracemalloc.get_traced_memory()
+        _tracing_stages -= 1
+        if _tracing_stages == 0:
+            tracemalloc.stop()
+    return peak
+
+
+class StageProfiler:
+    """
+    Opt-in CPU and memory profiler of the pipeline stages.
+
+    Every profiled stage writes to `output_dir`:
+    - <stage>.prof: cProfile stats of the stage thread (snakeviz, pstats), or
+      <stage>.html with `profiler='pyinstrument'` when pyinstrument is installed
+    - <stage>.txt: top functions by cumulative time, top allocators near the
+      memory peak (tracemalloc) and the resident memory during the stage
+
+    The CPU profile only covers the thread running the stage, the work of its
+    thread/process pools shows up as the time spent waiting on them.
+    tracemalloc and RSS are process wide, so stages running concurrently
+    share their allocations.
+    """
+    def __init__(self, output_dir, profiler='cprofile', top=30):
+        if profiler not in ('cprofile', 'pyinstrument'):
+            raise ValueError("Please enter either cprofile or pyinstrument for argument profiler")
+        if profiler == 'pyinstrument':
+            try:
+                import pyinstrument  # noqa: F401
+            except ImportError:
+                logger.warning("pyinstrument is not installed, falling back to cProfile")
+                profiler = 'cprofile'
+        self.output_dir = output_dir
+        self.profiler = profiler
+        self.top = top
+        self.results = {}
+        os.makedirs(output_dir, exist_ok=True)
+
+    def wrap(self, stage, func):
+        """Return `func` profiled as `stage`."""
+        return lambda: self.run(stage, func)
+
+    def _start_cpu(self, stage):
+        try:
+            if self.profiler == 'pyinstrument':
+                from pyinstrument import Profiler
+                profiler = Profiler()
+                profiler.start()
+            else:
+                profiler = cProfile.Profile()
+                profiler.enable()
+            return profiler
+        except (ValueError, RuntimeError) as e:
+            # Python 3.12+ allows a single active profiler per process
+            logger.warning(f"CPU profile of {stage} skipped: {e}")
+            return None
+
+    def _stop_cpu(self, stage, profiler, path):
+        if profiler is None:
+            return ''
+        if self.profiler == 'pyinstrument':
+            profiler.stop()
+            with open(path + '.html', 'w', encoding='utf-8') as f:
+                f.write(profiler.output_html())
+            return profiler.output_text(unicode=False, color=False)
+        profiler.disable()
+        profiler.dump_stats(path + '.prof')
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(self.top)
+        return out.getvalue()
+
+    def run(self, stage, func):
+        """
+        Run `func` under the profilers and write the stage's profile files.
+        The result (or exception) of `func` is passed through unchanged
+        """
+        path = os.path.join(self.output_dir, stage)
+        _start_tracing()
+        sampler = MemorySampler().start()
+        profiler = self._start_cpu(stage)
+        start = time.perf_counter()
+        try:
+            return func()
+        finally:
+            seconds = time.perf_counter() - start
+            cpu_report = self._stop_cpu(stage, profiler, path)
+            sampler.stop()
+            traced_peak = _stop_tracing()
+            self._write(stage, path, seconds, cpu_report, traced_peak, sampler)
+
+    def _write(self, stage, path, seconds, cpu_report, traced_peak, sampler):
+        allocators = sampler.snapshot.filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap*>'),
+        )).statistics('lineno')[:self.top]
+        process_peak = peak_rss_mb()
+        result = {
+            'seconds': round(seconds, 3),
+            'traced_peak_mb': round(traced_peak / MB, 1),
+            'rss_start_mb': round(sampler.start_mb, 1) if sampler.start_mb is not None else None,
+            'rss_peak_mb': round(sampler.peak_mb, 1) if sampler.peak_mb is not None else None,
+            'process_peak_rss_mb': round(process_peak, 1) if process_peak is not None else None,
+        }
+        self.results[stage] = result
+
+        with open(path + '.txt', 'w', encoding='utf-8') as f:
+            f.write(f"Stage {stage}\n")
+            for key, value in result.items():
+                f.write(f"{key}: {value}\n")
+            f.write(f"\nTop {self.top} allocators near the traced peak (tracemalloc)\n")
+            for stat in allocators:
+                f.write(f"{stat.size / 1024:10.1f} KB {stat.count:8d} blocks  {stat.traceback}\n")
+            f.write(f"\nCPU profile ({self.profiler})\n")
+            f.write(cpu_report)
+        logger.info(
+            f"Profiled {stage}: {seconds:.1f}s, traced peak {result['traced_peak_mb']} MB, "
+            f"RSS peak {result['rss_peak_mb']} MB -> {path}.txt"
+        )
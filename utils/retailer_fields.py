@@ -0,0 +1,67 @@
+from .field_mapping import FieldSpec, field
+
+# Field specs of the retailers: how the staged json items map to the typed
+# warehouse columns (the first json path present wins, like a COALESCE).
+# The Parquet stage format normalizes the items with them client side, the
+# json stage format loads the Snowflake projection generated from them.
+# The specs are closed: an item key that is neither mapped nor ignored (the
+# images and links of a Carrefour product, the analytics fields of a
+# Choithrams item...) is reported as drift
+CARREFOUR_FIELDS = FieldSpec('CARREFOUR', [
+    field('EAN', 'string', 'ean'),
+    field('ID', 'string', 'id', 'productId'),
+    field('NAME', 'string', 'name'),
+    field('TYPE', 'string', 'type'),
+    field('CATEGORY_L1', 'string', 'category.0.name', 'categories.0.name'),
+    field('CATEGORY_L2', 'string', 'category.1.name', 'categories.1.name'),
+    field('CATEGORY_L3', 'string', 'category.2.name', 'categories.2.name'),
+    field('BRAND_ID', 'string', 'brand.id'),
+    field('BRAND_NAME', 'string', 'brand.name', 'brand'),
+    field('FOOD_TYPE', 'string', 'foodType'),
+    field('PRICE', 'float', 'price.price', 'applicablePrice'),
+    field('DISCOUNT_END_DATE', 'string', 'price.discount.endDate', 'discount.endDate'),
+    field('DISCOUNT_PRICE', 'float', 'price.discount.price', 'discount.price'),
+    field('SIZE', 'string', 'size'),
+    field('ITEMS_PER_UNIT', 'string', 'unit.itemsPerUnit', 'itemsPerUnit'),
+    field('UNIT_OF_MEASURE', 'string', 'unit.unitOfMeasure', 'unitOfMeasure'),
+    field('IS_MARKETPLACE', 'string', 'isMarketPlace'),
+    field('PRODUCT_ORIGIN', 'string', 'productOrigin'),
+    field('PROMO_BADGE_1', 'string', 'promoBadges.0.text.boldText'),
+    field('PROMO_BADGE_2', 'string', 'promoBadges.1.text.boldText'),
+    field('PROMO_BADGE_3', 'string', 'promoBadges.2.text.boldText'),
+    field('STOCK_LEVEL_STATUS', 'string', 'stock.stockLevelStatus'),
+    field('IS_AVAILABLE', 'string', 'availability.isAvailable'),
+    ], closed=True, ignore=('_row_hash', 'badges', 'images', 'links', 'url', 'offerType', 'maxQuantity', 'supplier'))
+
+# Spinneys items join the analytics impression of a product (id, name, ...)
+# with the texts of its product grid tile, such as 'AED 12.50' and
+# '6 x 330 ml'
+SPINNEYS_FIELDS = FieldSpec('SPINNEYS', [
+    field('EAN', 'string', 'id'),
+    field('NAME', 'string', 'item_name'),
+    field('PRICE', 'float', 'item_price', parse='price'),
+    field('LINK', 'string', 'item_link'),
+    field('QUANTITY', 'string', 'item_quantity'),
+    field('QUANTITY_VALUE', 'float', 'item_quantity', parse='quantity_value'),
+    field('QUANTITY_UNIT', 'string', 'item_quantity', parse='quantity_unit'),
+    field('PACK_COUNT', 'float', 'item_quantity', parse='pack_count'),
+    ], closed=True, ignore=('_row_hash', 'name', 'price', 'brand', 'category', 'variant', 'list', 'position'))
+
+CHOITHRAMS_FIELDS = FieldSpec('CHOITHRAMS', [
+    field('EAN', 'string', 'item_id'),
+    field('NAME', 'string', 'item_name'),
+    field('PRICE', 'float', 'price'),
+    field('CATEGORY', 'string', 'item_category'),
+    field('BRAND', 'string', 'item_brand'),
+    field('QUANTITY', 'float', 'quantity'),
+    ], closed=True, ignore=(
+        '_row_hash', 'affiliation', 'discount', 'coupon', 'currency', 'index', 'item_variant',
+        'item_list_id', 'item_list_name', 'item_category2', 'item_category3', 'item_category4',
+        'item_category5', 'location_id'
+    ))
+
+RETAILER_FIELDS = {
+    'SPINNEYS': SPINNEYS_FIELDS,
+    'CHOITHRAMS': CHOITHRAMS_FIELDS,
+    'CARREFOUR': CARREFOUR_FIELDS,
+}
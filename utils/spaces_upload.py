@@ -1,39 +1,132 @@
+
 import os
+import time
+import hashlib
 import configparser
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import boto3  # Assuming AWS S3 is being used for uploads
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
+from .logger import setup_logging
+from .telemetry import UPLOADED_FILES, UPLOADED_BYTES, UPLOAD_THROUGHPUT
+
+logger = setup_logging(__name__)
+
+MB = 1024 ** 2
+
+
+def local_etag(file_path, multipart_threshold, multipart_chunksize):
+    """
+    Compute the ETag S3 assigns to a file uploaded with the given transfer
+    settings: the MD5 of the file for single part uploads, the MD5 of the
+    concatenated part digests suffixed with the part count for multipart ones.
+    """
+    size = os.path.getsize(file_path)
+    digests = []
+    with open(file_path, 'rb') as f:
+        if size < multipart_threshold:
+            md5 = hashlib.md5()
+            for block in iter(lambda: f.read(MB), b''):
+                md5.update(block)
+            return f'"{md5.hexdigest()}"'
+        for part in iter(lambda: f.read(multipart_chunksize), b''):
+            digests.append(hashlib.md5(part).digest())
+    return f'"{hashlib.md5(b"".join(digests)).hexdigest()}-{len(digests)}"'
+
 
 class FolderUploader:
-    def __init__(self, config_path):
+    def __init__(self, config_path, s3_client=None, multipart_threshold=8 * MB,
+                 multipart_chunksize=8 * MB, max_concurrency=4, max_workers=4):
         self.config = configparser.ConfigParser()
         self.config.read(config_path)
-        self.access_id = self.config['spaces']['access_id']
-        self.access_key = self.config['spaces']['access_secret']
-        self.region_name = self.config['spaces']['region_name']
-        self.endpoint_url = self.config['spaces']['endpoint_url']
-        self.s3_client = boto3.client(
-            's3',
-            region_name = self.region_name,
-            endpoint_url = self.endpoint_url, 
-            aws_access_key_id=self.access_id,
-            aws_secret_access_key=self.access_key
+        if s3_client is None:
+            self.access_id = self.config['spaces']['access_id']
+            self.access_key = self.config['spaces']['access_secret']
+            self.region_name = self.config['spaces']['region_name']
+            self.endpoint_url = self.config['spaces']['endpoint_url']
+            s3_client = boto3.client(
+                's3',
+                region_name = self.region_name,
+                endpoint_url = self.endpoint_url,
+                aws_access_key_id=self.access_id,
+                aws_secret_access_key=self.access_key
+            )
+        self.s3_client = s3_client
+        self.max_workers = max_workers
+        self.transfer_config = TransferConfig(
+            multipart_threshold=multipart_threshold,
+            multipart_chunksize=multipart_chunksize,
+            max_concurrency=max_concurrency,
+            use_threads=True
         )
 
-    def upload_folder(self, folder_path, bucket_name, subfolder=""):
+    def upload_folder(self, folder_path, bucket_name, subfolder="", max_workers=None, skip_unchanged=True):
         """
         Uploads all files from the specified folder to the specified S3 bucket, possibly within a subfolder.
+        Files are uploaded concurrently and files whose ETag already matches the object in the
+        bucket are skipped.
 
         Args:
         folder_path (str): The path to the folder whose files are to be uploaded.
         bucket_name (str): The S3 bucket to which files will be uploaded.
         subfolder (str): Subfolder within the S3 bucket where files will be stored.
+        max_workers (int): Number of files uploaded in parallel, defaults to the uploader setting.
+        skip_unchanged (bool): Skip files whose MD5/ETag matches the existing object.
+
+        Returns:
+        dict: uploaded/skipped keys, failures by file, bytes uploaded and duration in seconds.
         """
         folder_path = Path(folder_path)
-        for file_path in folder_path.iterdir():
-            if file_path.is_file():
-                self.upload_file(file_path, bucket_name, subfolder)
+        files = [file_path for file_path in folder_path.iterdir() if file_path.is_file()]
+        result = {'uploaded': [], 'skipped': [], 'failed': {}, 'bytes': 0, 'seconds': 0.0}
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max_workers or self.max_workers) as executor:
+            futures = {
+                executor.submit(self.upload_file, file_path, bucket_name, subfolder, skip_unchanged): file_path
+                for file_path in files
+            }
+            for future in as_completed(futures):
+                file_path = futures[future]
+                status, key, detail = future.result()
+                if status == 'uploaded':
+                    result['uploaded'].append(key)
+                    result['bytes'] += detail
+                elif status == 'skipped':
+                    result['skipped'].append(key)
+                else:
+                    result['failed'][str(file_path)] = detail
+        result['seconds'] = time.perf_counter() - start
 
-    def upload_file(self, file_path, bucket_name, subfolder):
+        UPLOADED_FILES.inc(len(result['uploaded']), bucket=bucket_name, status='uploaded')
+        UPLOADED_FILES.inc(len(result['skipped']), bucket=bucket_name, status='skipped')
+        UPLOADED_FILES.inc(len(result['failed']), bucket=bucket_name, status='failed')
+        UPLOADED_BYTES.inc(result['bytes'], bucket=bucket_name)
+        if result['seconds']:
+            UPLOAD_THROUGHPUT.set(result['bytes'] / result['seconds'], bucket=bucket_name)
+
+        logger.info(
+            f"Uploaded {len(result['uploaded'])} files ({result['bytes'] / MB:.1f} MB) to {bucket_name}/{subfolder} "
+            f"in {result['seconds']:.1f}s, skipped {len(result['skipped'])} unchanged, {len(result['failed'])} failed"
+        )
+        return result
+
+    def is_unchanged(self, file_path, bucket_name, key):
+        """
+        Helper method to check whether the object in the bucket already has the file's ETag.
+        """
+        try:
+            remote = self.s3_client.head_object(Bucket=bucket_name, Key=key)
+        except ClientError:
+            return False
+        return remote.get('ETag') == local_etag(
+            file_path,
+            self.transfer_config.multipart_threshold,
+            self.transfer_config.multipart_chunksize
+        )
+
+    def upload_file(self, file_path, bucket_name, subfolder, skip_unchanged=False):
         """
         Helper method to upload a single file to an S3 bucket within a specified subfolder.
 
@@ -41,21 +134,32 @@ class FolderUploader:
         file_path (Path): The path to the file to upload.
         bucket_name (str): The S3 bucket to which the file will be uploaded.
         subfolder (str): Subfolder within the S3 bucket where the file will be stored.
+        skip_unchanged (bool): Skip the upload if the object already has the same ETag.
+
+        Returns:
+        tuple: ('uploaded', key, bytes), ('skipped', key, 0) or ('failed', key, error message).
         """
+        file_path = Path(file_path)
         # Ensure the subfolder path ends with a '/'
         if subfolder and not subfolder.endswith('/'):
             subfolder += '/'
         key = f"{subfolder}{file_path.name}"
 
         try:
+            if skip_unchanged and self.is_unchanged(file_path, bucket_name, key):
+                logger.info(f"Skipped unchanged {file_path}")
+                return 'skipped', key, 0
             self.s3_client.upload_file(
                 Filename=str(file_path),
                 Bucket=bucket_name,
-                Key=key
+                Key=key,
+                Config=self.transfer_config
             )
-            print(f"Uploaded {file_path} to {bucket_name}/{key}")
+            logger.info(f"Uploaded {file_path} to {bucket_name}/{key}")
+            return 'uploaded', key, file_path.stat().st_size
         except Exception as e:
-            print(f"Failed to upload {file_path}: {str(e)}")
+            logger.error(f"Failed to upload {file_path}: {str(e)}")
+            return 'failed', key, str(e)
 
 # Example Usage
 if __name__ == "__main__":
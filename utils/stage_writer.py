@@ -0,0 +1,229 @@
+import os
+import gzip
+import json
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from .logger import setup_logging
+from .telemetry import STAGED_ITEMS, STAGED_BYTES
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = setup_logging(__name__)
+
+STAGE_EXTENSION = '.jsonl'
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+# Sub folder of the stage folder holding the compressed chunks to PUT
+COMPRESSED_FOLDER = 'compressed'
+
+# Local compression codecs and the matching PUT SOURCE_COMPRESSION value
+COMPRESSION_EXTENSIONS = {'gzip': '.gz', 'zstd': '.zst'}
+SOURCE_COMPRESSION = {'gzip': 'GZIP', 'zstd': 'ZSTD'}
+
+
+def is_stage_file(file_name):
+    """
+    Check whether a file name is a jsonl stage file, compressed or not
+    """
+    return any(
+        file_name.endswith(STAGE_EXTENSION + extension)
+        for extension in ('', *COMPRESSION_EXTENSIONS.values())
+    )
+
+
+def remove_stage_files(stage_path, prefix):
+    """
+    Remove the stage files written under `prefix`, e.g. the partial output
+    of a category that is about to be scraped again. Returns the count removed.
+    """
+    removed = 0
+    if not os.path.isdir(stage_path):
+        return removed
+    for file_name in os.listdir(stage_path):
+        if is_stage_file(file_name) and file_name.startswith(prefix + '_'):
+            os.remove(os.path.join(stage_path, file_name))
+            removed += 1
+    return removed
+
+
+def truncate_partial_line(file_path, block_size=64 * 1024):
+    """
+    Cut an incomplete last line off a jsonl stage file, left behind when
+    the process died in the middle of a write. Returns the bytes removed.
+    """
+    with open(file_path, 'rb+') as f:
+        size = f.seek(0, os.SEEK_END)
+        end = size
+        while end > 0:
+            start = max(0, end - block_size)
+            f.seek(start)
+            newline = f.read(end - start).rfind(b'\n')
+            if newline != -1:
+                end = start + newline + 1
+                break
+            end = start
+        if end < size:
+            f.truncate(end)
+        return size - end
+
+
+def row_hash(item, fields):
+    """
+    Stable hash of the given top level fields of an item
+    """
+    payload = json.dumps([item.get(field) for field in fields], sort_keys=True, ensure_ascii=False)
+    return hashlib.md5(payload.encode('utf-8')).hexdigest()
+
+
+class JsonlStageWriter:
+    """
+    Streams scraped items into newline delimited json files in the local
+    stage folder, rolling over to a new file once `max_bytes` is reached.
+
+    Every `write` is flushed straight away so memory stays flat regardless
+    of the catalogue size and a crash only loses the page in flight.
+
+    When `hash_fields` is given every item gets a `_row_hash` of those fields,
+    used by the incremental loader to detect changed rows.
+
+    File numbers already taken in the stage folder (plain or compressed) are
+    skipped, so a resumed run adds to the files of the interrupted one. A
+    half written last line the interrupted run left in its files is cut off
+    first, the page it belonged to is scraped again.
+    """
+    def __init__(self, stage_path, prefix, max_bytes=DEFAULT_MAX_BYTES, hash_fields=None):
+        self.stage_path = stage_path
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.hash_fields = hash_fields
+        self.files = []
+        self.items_written = 0
+        self.bytes_written = 0
+        self._file = None
+        self._file_bytes = 0
+        self._lock = threading.Lock()
+        # Stage folders are named after the retailer
+        self.retailer = os.path.basename(os.path.normpath(stage_path)).lower()
+        self._existing = [name for name in os.listdir(stage_path) if is_stage_file(name)] if os.path.isdir(stage_path) else []
+        for name in self._existing:
+            if name.startswith(prefix + '_') and name.endswith(STAGE_EXTENSION):
+                removed = truncate_partial_line(os.path.join(stage_path, name))
+                if removed:
+                    logger.warning(f"Removed a partial line of {removed} bytes at the end of {name}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _next_path(self):
+        index = len(self.files)
+        while True:
+            name = f'{self.prefix}_{index:04d}'
+            # Compressed chunks of a split file are named <name>_<chunk>.jsonl.gz
+            if not any(existing.startswith((name + '.', name + '_')) for existing in self._existing):
+                return os.path.join(self.stage_path, name + STAGE_EXTENSION)
+            index += 1
+
+    def _roll(self):
+        if self._file is not None:
+            self._file.close()
+        file_path = self._next_path()
+        self._file = open(file_path, 'wb')
+        self._file_bytes = 0
+        self.files.append(file_path)
+        self._existing.append(os.path.basename(file_path))
+
+    def write(self, items):
+        """
+        Append a batch of items (usually one page) and flush it to disk
+        """
+        if not items:
+            return
+        with self._lock:
+            bytes_before = self.bytes_written
+            for item in items:
+                if self.hash_fields:
+                    item = dict(item, _row_hash=row_hash(item, self.hash_fields))
+                line = (json.dumps(item, ensure_ascii=False) + '\n').encode('utf-8')
+                if self._file is None or (self._file_bytes and self._file_bytes + len(line) > self.max_bytes):
+                    self._roll()
+                self._file.write(line)
+                self._file_bytes += len(line)
+                self.bytes_written += len(line)
+                self.items_written += 1
+            self._file.flush()
+        STAGED_ITEMS.inc(len(items), retailer=self.retailer)
+        STAGED_BYTES.inc(self.bytes_written - bytes_before, retailer=self.retailer)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def _open_compressed(file_path, compression):
+    if compression == 'gzip':
+        return gzip.open(file_path, 'wb', compresslevel=6)
+    if compression == 'zstd':
+        return zstandard.ZstdCompressor(level=3).stream_writer(open(file_path, 'wb'), closefd=True)
+    raise ValueError(f"Please enter one of {', '.join(COMPRESSION_EXTENSIONS)} for argument compression")
+
+
+def compress_stage_file(file_path, output_dir, compression='gzip', chunk_bytes=DEFAULT_MAX_BYTES):
+    """
+    Split a jsonl stage file on line boundaries into chunks of at most
+    `chunk_bytes` uncompressed bytes and compress every chunk into
+    `output_dir`, leaving the original in place. Returns the paths of the
+    compressed chunks.
+    """
+    stem = os.path.join(output_dir, os.path.basename(file_path)[:-len(STAGE_EXTENSION)])
+    extension = STAGE_EXTENSION + COMPRESSION_EXTENSIONS[compression]
+    single = os.path.getsize(file_path) <= chunk_bytes
+    chunks = []
+    out, out_bytes = None, 0
+    try:
+        with open(file_path, 'rb') as f:
+            for line in f:
+                if out is None or (out_bytes and out_bytes + len(line) > chunk_bytes):
+                    if out is not None:
+                        out.close()
+                    chunk_path = stem + extension if single else f'{stem}_{len(chunks):02d}{extension}'
+                    out, out_bytes = _open_compressed(chunk_path, compression), 0
+                    chunks.append(chunk_path)
+                out.write(line)
+                out_bytes += len(line)
+    finally:
+        if out is not None:
+            out.close()
+    return chunks
+
+
+def compress_stage_folder(stage_path, compression='gzip', chunk_bytes=DEFAULT_MAX_BYTES, workers=4):
+    """
+    Compress every uncompressed jsonl file of the stage folder in parallel
+    into its `compressed` sub folder. The jsonl files are left in place, the
+    Spaces upload archives them while the load runs and the cleanup removes
+    them. Returns the codec actually used, the compressed folder and the
+    compressed stage files to PUT
+    """
+    if compression == 'zstd' and zstandard is None:
+        logger.warning("zstandard is not installed, falling back to gzip compression")
+        compression = 'gzip'
+    output_dir = os.path.join(stage_path, COMPRESSED_FOLDER)
+    os.makedirs(output_dir, exist_ok=True)
+    for file_name in os.listdir(output_dir):
+        os.remove(os.path.join(output_dir, file_name))
+    pending = [
+        os.path.join(stage_path, file_name) for file_name in sorted(os.listdir(stage_path))
+        if file_name.endswith(STAGE_EXTENSION)
+    ]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        chunks = executor.map(lambda path: compress_stage_file(path, output_dir, compression, chunk_bytes), pending)
+        files = [chunk for file_chunks in chunks for chunk in file_chunks]
+    return compression, output_dir, files
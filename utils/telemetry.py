@@ -0,0 +1,220 @@
+import os
+import json
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+from .logger import setup_logging
+
+logger = setup_logging(__name__)
+
+# Latency style buckets in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+NAMESPACE = 'scraper'
+
+
+def _label_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(key):
+    if not key:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in key) + '}'
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, help):
+        self.name = f'{NAMESPACE}_{name}'
+        self.help = help
+        self._values = {}
+        self._lock = threading.Lock()
+
+
+class Counter(Metric):
+    """Monotonic total per label set."""
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+    def report(self):
+        with self._lock:
+            return [{'labels': dict(key), 'value': value} for key, value in self._values.items()]
+
+
+class Gauge(Counter):
+    """Last value set per label set."""
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+
+class Histogram(Metric):
+    """Bucketed distribution of observations per label set."""
+    type = 'histogram'
+
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {'counts': [0] * (len(self.buckets) + 1), 'sum': 0.0, 'count': 0, 'max': value}
+            state['counts'][bisect.bisect_left(self.buckets, value)] += 1
+            state['sum'] += value
+            state['count'] += 1
+            state['max'] = max(state['max'], value)
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the with block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _quantile(self, state, q):
+        # Upper bound of the bucket holding the q-th observation
+        rank = q * state['count']
+        cumulative = 0
+        for bound, count in zip(self.buckets + (state['max'],), state['counts']):
+            cumulative += count
+            if cumulative >= rank:
+                return min(bound, state['max'])
+        return state['max']
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, state in self._values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets, state['counts']):
+                    cumulative += count
+                    samples.append((f'{self.name}_bucket', key + (('le', repr(float(bound))),), cumulative))
+                samples.append((f'{self.name}_bucket', key + (('le', '+Inf'),), state['count']))
+                samples.append((f'{self.name}_sum', key, state['sum']))
+                samples.append((f'{self.name}_count', key, state['count']))
+        return samples
+
+    def report(self):
+        with self._lock:
+            return [{
+                'labels': dict(key),
+                'count': state['count'],
+                'sum': round(state['sum'], 6),
+                'mean': round(state['sum'] / state['count'], 6),
+                'p50': self._quantile(state, 0.5),
+                'p99': self._quantile(state, 0.99),
+                'max': state['max'],
+            } for key, state in self._values.items()]
+
+
+class Telemetry:
+    """
+    Process wide registry of metrics plus a list of notable events (e.g.
+    Snowflake query IDs), exported as a Prometheus textfile and a json report.
+    """
+    def __init__(self):
+        self.metrics = {}
+        self.events = []
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help, **kwargs):
+        with self._lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, help, **kwargs)
+            return metric
+
+    def counter(self, name, help=''):
+        return self._get(Counter, name, help)
+
+    def gauge(self, name, help=''):
+        return self._get(Gauge, name, help)
+
+    def histogram(self, name, help='', buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, help, buckets=buckets)
+
+    def event(self, name, **fields):
+        """Record a notable event for the json report."""
+        with self._lock:
+            self.events.append({'event': name, 'time': time.time(), **fields})
+
+    def prometheus_text(self):
+        lines = []
+        for metric in sorted(self.metrics.values(), key=lambda metric: metric.name):
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            for name, key, value in metric.samples():
+                lines.append(f'{name}{_format_labels(key)} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        """
+        Write the metrics in the Prometheus text format, atomically so the
+        node exporter textfile collector never reads a partial file
+        """
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp_path, path)
+
+    def report(self):
+        with self._lock:
+            events = list(self.events)
+        return {
+            'metrics': {metric.name: {'type': metric.type, 'help': metric.help, 'values': metric.report()}
+                        for metric in self.metrics.values()},
+            'events': events,
+        }
+
+    def write_report(self, path, **extra):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump({**extra, **self.report()}, f, indent=4, default=str)
+
+
+telemetry = Telemetry()
+
+# Metrics shared by the scrapers, loaders and uploader
+REQUESTS = telemetry.counter('http_requests_total', 'HTTP requests by host and status')
+RESPONSE_BYTES = telemetry.counter('http_response_bytes_total', 'Response body bytes by host')
+REQUEST_SECONDS = telemetry.histogram('http_request_seconds', 'HTTP request latency by host')
+PARSE_SECONDS = telemetry.histogram('parse_seconds', 'Parse time per page by retailer')
+STAGED_ITEMS = telemetry.counter('staged_items_total', 'Items written to the local stage by retailer')
+STAGED_BYTES = telemetry.counter('staged_bytes_total', 'Bytes written to the local stage by retailer')
+QUERY_SECONDS = telemetry.histogram('snowflake_query_seconds', 'Snowflake query duration by statement type')
+UPLOADED_FILES = telemetry.counter('upload_files_total', 'Files archived to Spaces by bucket and status')
+UPLOADED_BYTES = telemetry.counter('upload_bytes_total', 'Bytes archived to Spaces by bucket')
+UPLOAD_THROUGHPUT = telemetry.gauge('upload_bytes_per_second', 'Throughput of the last folder upload by bucket')
+STAGE_SECONDS = telemetry.gauge('pipeline_stage_seconds', 'Duration of each pipeline stage')
+STAGE_SUCCESS = telemetry.gauge('pipeline_stage_success', '1 when the pipeline stage succeeded')
+FIELD_DRIFT = telemetry.gauge('field_drift_rows', 'Rows of a stage with a missing, invalid or unknown field by retailer')
+
+
+def record_request(host, status, seconds, size=0):
+    """Function to count one HTTP request (status None for connection errors)"""
+    REQUESTS.inc(host=host, status=status or 'error')
+    RESPONSE_BYTES.inc(size, host=host)
+    REQUEST_SECONDS.observe(seconds, host=host)
@@ -1,5 +1,6 @@
 import os
 from .logger import setup_logging
+from .stage_writer import is_stage_file
 
 # Initializing helper classes and functions
 logger = setup_logging(__name__)
@@ -13,15 +14,15 @@ def create_directory(dir_path):
 
 def has_json_files(folder_path):
         """
-        Check if the given folder contains any JSON files
+        Check if the given folder contains any jsonl stage files (compressed or not)
         """
         for file_name in os.listdir(folder_path):
             file_path = os.path.join(folder_path, file_name)
-            # Check if the file is a CSV file
-            if file_name.endswith('.json') and os.path.isfile(file_path):
+            # Check if the file is a json or jsonl stage file
+            if is_stage_file(file_name) and os.path.isfile(file_path):
                 return True
 
-        # No CSV files were found
+        # No jsonl stage files were found
         return False
 
 def py_file_name():
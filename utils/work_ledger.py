@@ -0,0 +1,188 @@
+import os
+import sqlite3
+import threading
+from datetime import datetime as dt, timedelta
+from .logger import setup_logging
+
+logger = setup_logging(__name__)
+
+DEFAULT_LEDGER_PATH = os.path.join(os.getcwd(), 'state', 'ledger.db')
+
+STATUSES = ('pending', 'done', 'failed')
+
+
+class WorkLedger:
+    """
+    Persistent record of the work done by a run, kept in SQLite.
+
+    Every unit of work (a catalogue page, a Carrefour category, a pipeline
+    stage, a load step...) is a (kind, key) row of the run marked pending,
+    done or failed. Resuming a run keeps its run ID so anything already
+    done is skipped and only the missing or failed work is redone.
+    Only unfinished runs started within `max_age_hours` are resumed, an
+    older one is stale and a new run is started instead.
+    """
+    def __init__(self, path=DEFAULT_LEDGER_PATH, run_id=None, resume=True, max_age_hours=12):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS runs (
+                run_id TEXT PRIMARY KEY,
+                started TEXT NOT NULL,
+                finished TEXT,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 1
+            );
+            CREATE TABLE IF NOT EXISTS work (
+                run_id TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                key TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                updated TEXT NOT NULL,
+                detail TEXT,
+                PRIMARY KEY (run_id, kind, key)
+            );
+        ''')
+        self.run_id, self.attempt, self.started = self._start_run(run_id, resume, max_age_hours)
+        logger.info(f"Run {self.run_id} attempt {self.attempt} (ledger {path})")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _execute(self, query, args=()):
+        with self._lock:
+            return self._conn.execute(query, args).fetchall()
+
+    def _start_run(self, run_id, resume, max_age_hours):
+        now = dt.now().isoformat()
+        if run_id is None and resume:
+            # Pick up the latest recent run that did not finish successfully
+            cutoff = (dt.now() - timedelta(hours=max_age_hours)).isoformat()
+            rows = self._execute(
+                "SELECT run_id FROM runs WHERE status != 'done' AND started >= ? ORDER BY started DESC LIMIT 1",
+                (cutoff,)
+            )
+            run_id = rows[0][0] if rows else None
+        if run_id is None:
+            run_id = base = dt.now().strftime('%Y%m%d-%H%M%S')
+            suffix = 1
+            while self._execute("SELECT 1 FROM runs WHERE run_id = ?", (run_id,)):
+                suffix += 1
+                run_id = f'{base}-{suffix}'
+
+        rows = self._execute("SELECT attempts, started FROM runs WHERE run_id = ?", (run_id,))
+        if rows:
+            attempt, started = rows[0][0] + 1, rows[0][1]
+            self._execute(
+                "UPDATE runs SET attempts = ?, status = 'running', finished = NULL WHERE run_id = ?",
+                (attempt, run_id)
+            )
+        else:
+            attempt, started = 1, now
+            self._execute(
+                "INSERT INTO runs (run_id, started, status) VALUES (?, ?, 'running')",
+                (run_id, now)
+            )
+        return run_id, attempt, dt.fromisoformat(started)
+
+    def finish(self, succeeded):
+        """Close the run, a run that did not succeed is resumed next time."""
+        status = 'done' if succeeded else 'failed'
+        self._execute(
+            "UPDATE runs SET finished = ?, status = ? WHERE run_id = ?",
+            (dt.now().isoformat(), status, self.run_id)
+        )
+        logger.info(f"Run {self.run_id} {status}")
+
+    def mark(self, kind, key, status, detail=None):
+        """Record the status of a unit of work."""
+        if status not in STATUSES:
+            raise ValueError(f"Please enter one of {', '.join(STATUSES)} for argument status")
+        self._execute('''
+            INSERT INTO work (run_id, kind, key, status, attempts, updated, detail)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (run_id, kind, key) DO UPDATE SET
+                status = excluded.status,
+                attempts = work.attempts + excluded.attempts,
+                updated = excluded.updated,
+                detail = excluded.detail
+        ''', (self.run_id, kind, str(key), status, int(status != 'pending'), dt.now().isoformat(), detail))
+
+    def add_pending(self, kind, keys):
+        """Register units of work that have not been recorded yet."""
+        now = dt.now().isoformat()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO work (run_id, kind, key, status, updated) VALUES (?, ?, ?, 'pending', ?)",
+                [(self.run_id, kind, str(key), now) for key in keys]
+            )
+            self._conn.execute("COMMIT")
+
+    def status(self, kind, key):
+        rows = self._execute(
+            "SELECT status FROM work WHERE run_id = ? AND kind = ? AND key = ?",
+            (self.run_id, kind, str(key))
+        )
+        return rows[0][0] if rows else None
+
+    def is_done(self, kind, key):
+        return self.status(kind, key) == 'done'
+
+    def done_keys(self, kind):
+        rows = self._execute(
+            "SELECT key FROM work WHERE run_id = ? AND kind = ? AND status = 'done'",
+            (self.run_id, kind)
+        )
+        return {row[0] for row in rows}
+
+    def remaining(self, kind, keys):
+        """
+        Register `keys` as pending and return the ones not done yet, in order
+        """
+        keys = list(keys)
+        self.add_pending(kind, keys)
+        done = self.done_keys(kind)
+        remaining = [key for key in keys if str(key) not in done]
+        if len(remaining) < len(keys):
+            logger.info(f"Resuming {kind}: {len(keys) - len(remaining)} of {len(keys)} already done")
+        return remaining
+
+    def run_step(self, kind, key, func):
+        """
+        Run `func` unless the step is already done, recording the outcome.
+        Returning False or raising marks the step as failed.
+        """
+        if self.is_done(kind, key):
+            logger.info(f"Skipping {kind} {key}, already done in run {self.run_id}")
+            return True
+        try:
+            result = func()
+        except Exception as e:
+            self.mark(kind, key, 'failed', detail=str(e))
+            raise
+        self.mark(kind, key, 'failed' if result is False else 'done')
+        return result
+
+    def summary(self):
+        """Return the number of units of work per kind and status."""
+        rows = self._execute(
+            "SELECT kind, status, COUNT(*) FROM work WHERE run_id = ? GROUP BY kind, status",
+            (self.run_id,)
+        )
+        summary = {}
+        for kind, status, count in rows:
+            summary.setdefault(kind, {})[status] = count
+        return summary
+
+    def close(self):
+        with self._lock:
+            self._conn.close()